@@ -0,0 +1,186 @@
+"""Admission control and per-request deadlines for the query endpoints.
+
+``AdaptiveLimiter`` caps the queries in flight with an AIMD limit and queues
+the excess briefly, rejecting with ``Overloaded`` when the queue is full or
+the wait runs out. ``within_deadline`` and ``stop_at_deadline`` keep awaits
+and tenacity retries inside the request's deadline.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Deque, Dict, Optional
+
+from tenacity import RetryCallState
+from tenacity.stop import stop_base
+
+deadline_var: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def set_deadline(seconds: float) -> None:
+    deadline_var.set(time.monotonic() + seconds)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None outside a request."""
+    deadline = deadline_var.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+async def within_deadline(awaitable: Awaitable[Any]) -> Any:
+    left = remaining()
+    if left is None:
+        return await awaitable
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded()
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded() from None
+
+
+class stop_at_deadline(stop_base):
+    """Stop when the next sleep would overrun the deadline; ``max_attempts`` outside a request."""
+
+    def __init__(self, max_attempts: int = 5):
+        self.max_attempts = max_attempts
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        left = remaining()
+        if left is None:
+            return retry_state.attempt_number >= self.max_attempts
+        return retry_state.upcoming_sleep >= left
+
+
+@dataclass
+class Ticket:
+    start: float = field(default_factory=time.monotonic)
+    ok: bool = True
+    # For streams: when the first token went out, so generation time is not held against the upstream
+    first_byte: Optional[float] = None
+    released: bool = False
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial_limit: int = 20,
+        min_limit: int = 2,
+        max_limit: int = 200,
+        target_latency: float = 10.0,
+        backoff: float = 0.8,
+        cooldown: float = 1.0,
+        queue_timeout: float = 2.0,
+        max_queue: int = 100,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self._latency: Optional[float] = None  # EWMA of admitted requests, for Retry-After
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def _retry_after(self) -> int:
+        return min(30, max(1, math.ceil(self._latency or 1.0)))
+
+    def _reject(self) -> Overloaded:
+        self.rejected += 1
+        return Overloaded(self._retry_after())
+
+    async def acquire(self) -> Ticket:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return Ticket()
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject()
+
+        left = remaining()
+        timeout = self.queue_timeout if left is None else min(self.queue_timeout, left)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait({waiter}, timeout=max(timeout, 0))
+        except asyncio.CancelledError:
+            if waiter.done():
+                self._release_slot()  # handed a slot just as the caller went away
+            else:
+                self._waiters.remove(waiter)
+            raise
+        if not waiter.done():
+            self._waiters.remove(waiter)
+            raise self._reject()
+        self.admitted += 1
+        return Ticket()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._waiters.popleft().set_result(None)
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+        now = time.monotonic()
+        latency = (ticket.first_byte or now) - ticket.start
+        self._latency = latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+
+        if not ticket.ok or latency > self.target_latency:
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self._last_decrease = now
+        elif self.in_flight >= int(self.limit) - 1:
+            # Only grow a limit that is being used, or it drifts up while idle
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        self._release_slot()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_length": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+def limiter_from_env() -> AdaptiveLimiter:
+    return AdaptiveLimiter(
+        initial_limit=int(os.getenv("ADMISSION_INITIAL_LIMIT", "20")),
+        min_limit=int(os.getenv("ADMISSION_MIN_LIMIT", "2")),
+        max_limit=int(os.getenv("ADMISSION_MAX_LIMIT", "200")),
+        target_latency=float(os.getenv("ADMISSION_TARGET_LATENCY", "10")),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "100")),
+    )
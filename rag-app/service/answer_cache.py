@@ -0,0 +1,200 @@
+"""Semantic answer cache: reuse answers for near-duplicate questions.
+
+Each entry stores the query vector, the sources (chunk id, title, ...) that
+were retrieved for it and the generated answer. Vectors are L2-normalised
+into one preallocated float32 matrix, so a lookup is a single matrix-vector
+product followed by an argmax. A lookup only hits when the best cosine similarity reaches
+``threshold`` and the entry was produced with the same ``top``/``max_tokens``,
+source token budget and retrieval ``variant`` (mode, filters, boosts).
+
+Entries are evicted least-recently-used once ``capacity`` is reached, expire
+after ``ttl`` seconds, and are dropped as soon as any chunk they cite is
+re-ingested (``invalidate``).
+
+``AnswerCachePartitions`` keeps one such cache per set of searched indexes,
+so one corpus's traffic cannot evict another's answers and hit rates are
+reported per index set.
+"""
+import os
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    sources: List[Dict[str, Any]]
+    similarity: float = 1.0
+
+    @property
+    def doc_ids(self) -> List[str]:
+        # A packed source may span several merged chunks
+        return [doc_id for source in self.sources for doc_id in source.get("ids", [source["id"]])]
+
+
+class SemanticAnswerCache:
+    def __init__(self, capacity: int = 1000, threshold: float = 0.95, ttl: int = 86400):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._matrix: Optional[np.ndarray] = None
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._params = np.zeros((capacity, 4), dtype=np.int64)
+        self._entries: List[Optional[CachedAnswer]] = [None] * capacity
+        self._slots_by_doc: Dict[str, Set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _free(self, slot: int) -> None:
+        entry = self._entries[slot]
+        if entry is not None:
+            for doc_id in entry.doc_ids:
+                slots = self._slots_by_doc.get(doc_id)
+                if slots is not None:
+                    slots.discard(slot)
+                    if not slots:
+                        del self._slots_by_doc[doc_id]
+        self._entries[slot] = None
+        self._valid[slot] = False
+
+    @staticmethod
+    def _key(top: int, max_tokens: int, context_tokens: int, variant: str) -> tuple:
+        return (top, max_tokens, context_tokens, zlib.crc32(variant.encode("utf-8")))
+
+    def lookup(
+        self, vector: List[float], top: int, max_tokens: int, context_tokens: int = 0, variant: str = ""
+    ) -> Optional[CachedAnswer]:
+        """Return the cached answer closest to ``vector`` if it clears the threshold."""
+        if not self.enabled or self._matrix is None or not self._valid.any():
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        for slot in np.flatnonzero(self._valid & (self._expires < now)):
+            self._free(int(slot))
+
+        candidates = self._valid & np.all(self._params == self._key(top, max_tokens, context_tokens, variant), axis=1)
+        if not candidates.any():
+            self.misses += 1
+            return None
+
+        scores = self._matrix @ self._normalize(vector)
+        scores[~candidates] = -np.inf
+        slot = int(np.argmax(scores))
+        if scores[slot] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._last_used[slot] = now
+        entry = self._entries[slot]
+        return CachedAnswer(entry.answer, entry.sources, float(scores[slot]))
+
+    def put(
+        self,
+        vector: List[float],
+        sources: List[Dict[str, Any]],
+        answer: str,
+        top: int,
+        max_tokens: int,
+        context_tokens: int = 0,
+        variant: str = "",
+    ) -> None:
+        if not self.enabled:
+            return
+        v = self._normalize(vector)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.capacity, len(v)), dtype=np.float32)
+
+        free = np.flatnonzero(~self._valid)
+        if len(free):
+            slot = int(free[0])
+        else:
+            slot = int(np.argmin(self._last_used))
+            self._free(slot)
+            self.evictions += 1
+
+        now = time.monotonic()
+        self._matrix[slot] = v
+        self._valid[slot] = True
+        self._expires[slot] = now + self.ttl
+        self._last_used[slot] = now
+        self._params[slot] = self._key(top, max_tokens, context_tokens, variant)
+        entry = self._entries[slot] = CachedAnswer(answer, list(sources))
+        for doc_id in entry.doc_ids:
+            self._slots_by_doc.setdefault(doc_id, set()).add(slot)
+
+    def invalidate(self, doc_ids: List[str]) -> int:
+        """Drop every entry that cites one of ``doc_ids``; return how many were dropped."""
+        slots: Set[int] = set()
+        for doc_id in doc_ids:
+            slots |= self._slots_by_doc.get(doc_id, set())
+        for slot in slots:
+            self._free(slot)
+        self.invalidations += len(slots)
+        return len(slots)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": int(self._valid.sum()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def answer_cache_from_env() -> SemanticAnswerCache:
+    return SemanticAnswerCache(
+        capacity=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+        ttl=int(os.getenv("ANSWER_CACHE_TTL", "86400")),
+    )
+
+
+class AnswerCachePartitions:
+    """One ``SemanticAnswerCache`` per partition, created on first use; at most ``max_partitions``, LRU."""
+
+    def __init__(self, factory: Callable[[], SemanticAnswerCache] = answer_cache_from_env, max_partitions: int = 16):
+        self.factory = factory
+        self.max_partitions = max_partitions
+        self._caches: "OrderedDict[str, SemanticAnswerCache]" = OrderedDict()
+
+    def get(self, partition: str) -> SemanticAnswerCache:
+        cache = self._caches.get(partition)
+        if cache is None:
+            cache = self._caches[partition] = self.factory()
+            while len(self._caches) > self.max_partitions:
+                self._caches.popitem(last=False)
+        self._caches.move_to_end(partition)
+        return cache
+
+    def invalidate(self, doc_ids: List[str]) -> int:
+        # Chunk ids do not say which index they came from; dropping a namesake's answer is harmless
+        return sum(cache.invalidate(doc_ids) for cache in self._caches.values())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {partition: cache.stats() for partition, cache in self._caches.items()}
+
+
+def answer_caches_from_env() -> AnswerCachePartitions:
+    return AnswerCachePartitions(max_partitions=int(os.getenv("ANSWER_CACHE_PARTITIONS", "16")))
@@ -0,0 +1,59 @@
+"""Baseline app reproducing the pre-async query path for before/after comparisons.
+
+It calls the synchronous OpenAI and Search clients from inside an ``async``
+endpoint, which is exactly what ``main.query_rag`` used to do.
+"""
+import os
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.models import VectorizedQuery
+from fastapi import FastAPI
+from openai import AzureOpenAI
+
+from models import QueryRequest, QueryResponse
+from rag_service import GROUNDED_PROMPT
+from tokens import truncate_to_tokens
+
+search_client = SearchClient(
+    endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
+    index_name=os.environ["AZURE_SEARCH_INDEX"],
+    credential=AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"]),
+)
+
+openai_client = AzureOpenAI(
+    api_key=os.environ["AZURE_OPENAI_API_KEY"],
+    api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
+    azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+)
+
+app = FastAPI(title="Blocking baseline")
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy"}
+
+
+@app.post("/api/v1/query", response_model=QueryResponse)
+async def query_rag(request: QueryRequest):
+    embedding = openai_client.embeddings.create(
+        input=request.query, model=os.environ["AZURE_OPENAI_EMBED_DEPLOYMENT"]
+    ).data[0].embedding
+    vector_query = VectorizedQuery(vector=embedding, k_nearest_neighbors=5, fields="contentVector", kind="vector")
+    results = search_client.search(
+        search_text=None,
+        vector_queries=[vector_query],
+        select=["id", "title", "source", "chunk_index", "content", "topics"],
+        top=request.top,
+    )
+    sources = "=================\n".join(
+        f"TITLE: {d['title']}, CONTENT: {truncate_to_tokens(d['content'], 250)}" for d in results
+    )
+    response = openai_client.chat.completions.create(
+        messages=[{"role": "user", "content": GROUNDED_PROMPT.format(query=request.query, sources=sources)}],
+        model=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+        max_tokens=request.max_tokens,
+        temperature=0.2,
+    )
+    return QueryResponse(answer=response.choices[0].message.content)
@@ -0,0 +1,124 @@
+"""Chunker throughput and allocations: legacy decode-per-chunk vs token spans.
+
+The corpus is the Markdown samples under ``rag-app/data_samples`` (or
+``--corpus``), replicated until it reaches ``--mb`` megabytes. Reported:
+
+- chunks/s and MB/s for the legacy chunker, ``chunk_text`` and ``chunk_many``
+- peak traced memory per document and blocks still allocated afterwards
+  (``tracemalloc``, in a separate pass on a sample so tracing does not
+  skew the timings)
+- how many documents chunk identically to the legacy implementation
+
+    cd rag-app/service
+    python -m benchmarks.chunking --mb 20 --workers 4
+"""
+import argparse
+import os
+import re
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List
+
+import tiktoken
+
+from chunking import chunk_many, chunk_text
+from tokens import get_encoding
+
+SAMPLES = Path(__file__).resolve().parents[2] / "data_samples"
+
+
+def legacy_chunk(text: str, max_tokens: int = 300, overlap: int = 50, model="gpt-35-turbo") -> List[str]:
+    """``ingest_so.chunk_preserve_code_tokens`` as it was before ``chunking.py``."""
+    enc = tiktoken.encoding_for_model(model)
+    parts = []
+    buffer_tokens = []
+    segments = re.split(r"(```.*?```)", text, flags=re.DOTALL)
+    for seg in segments:
+        seg_tokens = enc.encode(seg)
+        if len(buffer_tokens) + len(seg_tokens) > max_tokens:
+            if buffer_tokens:
+                parts.append(enc.decode(buffer_tokens))
+            buffer_tokens = buffer_tokens[-overlap:] + seg_tokens
+            while len(buffer_tokens) > max_tokens:
+                parts.append(enc.decode(buffer_tokens[:max_tokens]))
+                buffer_tokens = buffer_tokens[max_tokens - overlap:]
+        else:
+            buffer_tokens.extend(seg_tokens)
+    if buffer_tokens:
+        parts.append(enc.decode(buffer_tokens))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def load_corpus(root: Path, megabytes: float) -> List[str]:
+    docs = [p.read_text(encoding="utf-8") for p in sorted(root.rglob("*.md"))]
+    if not docs:
+        raise SystemExit(f"No .md files under {root}")
+    corpus, size, copy = [], 0, 0
+    while size < megabytes * 1e6:
+        for doc in docs:
+            text = f"<!-- copy {copy} -->\n{doc}"
+            corpus.append(text)
+            size += len(text.encode("utf-8"))
+        copy += 1
+    return corpus
+
+
+def timed(label: str, run: Callable[[], List[List[str]]], megabytes: float) -> List[List[str]]:
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    chunks = sum(len(r) for r in result)
+    print(f"{label:<22} {chunks / elapsed:>12,.0f} {megabytes / elapsed:>8.2f} {elapsed:>8.2f}")
+    return result
+
+
+def allocations(label: str, chunker: Callable[[str], List[str]], sample: List[str]) -> None:
+    tracemalloc.start()
+    peaks, blocks = [], 0
+    for text in sample:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        before = tracemalloc.take_snapshot()
+        chunker(text)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+        blocks += sum(s.count_diff for s in tracemalloc.take_snapshot().compare_to(before, "lineno") if s.count_diff > 0)
+    tracemalloc.stop()
+    print(f"{label:<22} {sum(peaks) / len(peaks) / 1024:>14.1f} {max(peaks) / 1024:>14.1f} {blocks / len(sample):>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=SAMPLES)
+    parser.add_argument("--mb", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--alloc-sample", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.mb)
+    megabytes = sum(len(t.encode("utf-8")) for t in corpus) / 1e6
+    get_encoding()  # load the encoder and token table outside the timings
+    chunk_text("warm up")
+    print(f"{len(corpus)} documents, {megabytes:.1f} MB\n")
+
+    print(f"{'chunker':<22} {'chunks/s':>12} {'MB/s':>8} {'seconds':>8}")
+    legacy = timed("legacy", lambda: [legacy_chunk(t) for t in corpus], megabytes)
+    spans = timed("chunk_text", lambda: [chunk_text(t) for t in corpus], megabytes)
+    timed(
+        f"chunk_many x{args.workers}",
+        lambda: [[c.text for c in chunks] for chunks in chunk_many(corpus, workers=args.workers)],
+        megabytes,
+    )
+
+    same = sum(a == b for a, b in zip(legacy, spans))
+    print(f"\nidentical to legacy: {same}/{len(corpus)} documents\n")
+
+    sample = corpus[:args.alloc_sample]
+    print(f"{'chunker':<22} {'mean peak KiB':>14} {'max peak KiB':>14} {'kept blocks':>12}")
+    allocations("legacy", legacy_chunk, sample)
+    allocations("chunk_text", chunk_text, sample)
+
+
+if __name__ == "__main__":
+    main()
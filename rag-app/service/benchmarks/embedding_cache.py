@@ -0,0 +1,112 @@
+"""Load time and RSS of the JSON cache vs the memory-mapped binary cache.
+
+Each measurement runs in a fresh interpreter so peak RSS is not polluted by
+the generator process. JSON is skipped above ``--json-max`` entries because
+at 1536 dimensions it takes roughly 30 KB of text per entry.
+
+    cd rag-app/service
+    python -m benchmarks.embedding_cache --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from embedding_cache import DIGEST_SIZE, HEADER, MAGIC, VERSION, EmbeddingCache
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+LOOKUPS = 1000
+
+
+def write_binary(base: Path, n: int, dim: int) -> None:
+    rng = np.random.default_rng(0)
+    with open(base.with_suffix(".idx"), "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, dim, 0))
+        f.write(rng.bytes(n * DIGEST_SIZE))
+    with open(base.with_suffix(".f32"), "wb") as f:
+        for start in range(0, n, 10_000):
+            rows = min(10_000, n - start)
+            f.write(rng.standard_normal((rows, dim), dtype=np.float32).tobytes())
+
+
+def write_json(path: Path, n: int, dim: int) -> None:
+    rng = random.Random(0)
+    with open(path, "w") as f:
+        f.write("{")
+        for i in range(n):
+            vector = ",".join(repr(rng.uniform(-0.1, 0.1)) for _ in range(dim))
+            f.write(f'{"," if i else ""}"{rng.getrandbits(128):032x}":[{vector}]')
+        f.write("}")
+
+
+def child(kind: str, path: Path) -> None:
+    start = time.perf_counter()
+    if kind == "json":
+        with open(path) as f:
+            cache = json.load(f)
+        keys = list(cache)
+    else:
+        cache = EmbeddingCache(path)
+        keys = [digest.hex() for digest in list(cache._rows)[:LOOKUPS * 10]]
+    load_s = time.perf_counter() - start
+
+    sample = random.Random(1).sample(keys, min(LOOKUPS, len(keys)))
+    start = time.perf_counter()
+    for key in sample:
+        cache[key]
+    lookup_us = (time.perf_counter() - start) / len(sample) * 1e6
+
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"load_s": load_s, "lookup_us": lookup_us, "rss_mb": rss_mb}))
+
+
+def measure(kind: str, path: Path) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.embedding_cache", "--child", kind, str(path)],
+        cwd=SERVICE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--json-max", type=int, default=100_000)
+    parser.add_argument("--child", nargs=2, metavar=("KIND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], Path(args.child[1]))
+        return
+
+    print(f"{'entries':>9} {'format':>7} {'disk MB':>9} {'load s':>8} {'lookup us':>10} {'RSS MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            base = Path(tmp) / f"cache-{n}"
+            write_binary(base, n, args.dim)
+            runs = [("binary", base, base.with_suffix(".f32").stat().st_size + base.with_suffix(".idx").stat().st_size)]
+            if n <= args.json_max:
+                json_path = base.with_suffix(".json")
+                write_json(json_path, n, args.dim)
+                runs.insert(0, ("json", json_path, json_path.stat().st_size))
+            for kind, path, size in runs:
+                r = measure(kind, path)
+                print(f"{n:>9} {kind:>7} {size / 1e6:>9.1f} {r['load_s']:>8.3f} {r['lookup_us']:>10.1f} {r['rss_mb']:>8.1f}")
+            for f in Path(tmp).glob(f"cache-{n}.*"):
+                os.remove(f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Concurrent throughput of /api/v1/query per uvicorn worker, before and after.
+
+Starts the Azure stub server, then runs the blocking baseline app and the async
+``main`` app (one uvicorn worker each) against it and fires concurrent queries,
+probing ``/health`` while the load runs.
+
+    cd rag-app/service
+    python -m benchmarks.load_query --requests 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import httpx
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+def stub_env(stub_port: int) -> Dict[str, str]:
+    env = dict(os.environ)
+    endpoint = f"http://127.0.0.1:{stub_port}"
+    env.update(
+        {
+            "AZURE_OPENAI_ENDPOINT": endpoint,
+            "AZURE_OPENAI_API_KEY": "stub",
+            "AZURE_OPENAI_EMBED_DEPLOYMENT": "embed",
+            "AZURE_OPENAI_CHAT_DEPLOYMENT": "chat",
+            "AZURE_SEARCH_ENDPOINT": endpoint,
+            "AZURE_SEARCH_API_KEY": "stub",
+            "AZURE_SEARCH_INDEX": "stub-index",
+        }
+    )
+    return env
+
+
+@contextmanager
+def serve(app: str, port: int, env: Dict[str, str]) -> Iterator[str]:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--workers", "1", "--log-level", "warning"],
+        cwd=SERVICE_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline or proc.poll() is not None:
+                raise RuntimeError(f"{app} did not start on port {port}")
+            time.sleep(0.2)
+        yield base_url
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_load(base_url: str, requests: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    health: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency + 1)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+
+        async def one(i: int) -> None:
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                resp = await client.post("/api/v1/query", json={"query": f"question {i}", "top": 3})
+                latencies.append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    errors += 1
+
+        async def probe(stop: asyncio.Event) -> None:
+            while not stop.is_set():
+                start = time.perf_counter()
+                await client.get("/health")
+                health.append(time.perf_counter() - start)
+                await asyncio.sleep(0.1)
+
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await prober
+
+    return {
+        "rps": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 95),
+        "health_p95": percentile(health, 95),
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--app-port", type=int, default=8101)
+    args = parser.parse_args()
+
+    env = stub_env(args.stub_port)
+    print(f"{'app':<10} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'health p95 s':>13} {'errors':>7}")
+    with serve("benchmarks.stub_server:app", args.stub_port, env):
+        for label, app in (("before", "benchmarks.blocking_app:app"), ("after", "main:app")):
+            with serve(app, args.app_port, env) as base_url:
+                r = asyncio.run(run_load(base_url, args.requests, args.concurrency))
+            print(
+                f"{label:<10} {r['rps']:>8.1f} {r['p50']:>8.3f} {r['p95']:>8.3f} "
+                f"{r['health_p95']:>13.3f} {int(r['errors']):>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
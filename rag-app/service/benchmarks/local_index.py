@@ -0,0 +1,89 @@
+"""Recall and latency of the local index: HNSW graph vs exact brute force.
+
+Builds a synthetic clustered corpus (real embeddings are far from uniform, so
+pure Gaussian noise would understate HNSW recall), saves it as a
+``LocalVectorIndex`` once without and once with an HNSW graph, and compares
+top-k results for held-out queries against the exact ground truth.
+
+    cd rag-app/service
+    python -m benchmarks.local_index --docs 100000 --dim 1536 --queries 200
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from local_index import LocalVectorIndex, hnswlib
+
+
+def clustered(rng: np.random.Generator, n: int, dim: int, centers: np.ndarray) -> np.ndarray:
+    labels = rng.integers(0, len(centers), n)
+    return (centers[labels] + 0.35 * rng.standard_normal((n, dim), dtype=np.float32)).astype(np.float32)
+
+
+def build(path: Path, vectors: np.ndarray, hnsw_min_docs: int) -> LocalVectorIndex:
+    index = LocalVectorIndex.create(path, vectors.shape[1])
+    index.hnsw_min_docs = hnsw_min_docs
+    for start in range(0, len(vectors), 10_000):
+        index.upload_documents(
+            [{"id": str(start + i), "contentVector": v} for i, v in enumerate(vectors[start:start + 10_000])]
+        )
+    start = time.perf_counter()
+    index.save()
+    print(f"  saved {path.name} in {time.perf_counter() - start:.1f}s")
+    return LocalVectorIndex(path, hnsw_min_docs=hnsw_min_docs)
+
+
+def run(index: LocalVectorIndex, queries: np.ndarray, k: int, exact: bool):
+    latencies, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = index.search(q, top=k, select=["id"], exact=exact)
+        latencies.append(time.perf_counter() - start)
+        results.append({h["id"] for h in hits})
+    return latencies, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--ef", type=int, default=128)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((256, args.dim), dtype=np.float32)
+    corpus = clustered(rng, args.docs, args.dim, centers)
+    queries = clustered(rng, args.queries, args.dim, centers)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exact_index = build(Path(tmp) / "exact", corpus, hnsw_min_docs=args.docs + 1)
+        exact_lat, truth = run(exact_index, queries, args.k, exact=True)
+
+        print(f"{'mode':<8} {'p50 ms':>8} {'p95 ms':>8} {f'recall@{args.k}':>10}")
+        print(
+            f"{'exact':<8} {statistics.median(exact_lat) * 1e3:>8.2f} "
+            f"{sorted(exact_lat)[int(0.95 * len(exact_lat))] * 1e3:>8.2f} {1.0:>10.3f}"
+        )
+
+        if hnswlib is None:
+            print("hnswlib is not installed; skipping HNSW (uv sync --extra local-ann)")
+            return
+
+        hnsw_index = build(Path(tmp) / "hnsw", corpus, hnsw_min_docs=1)
+        hnsw_index._hnsw.set_ef(args.ef)
+        hnsw_lat, found = run(hnsw_index, queries, args.k, exact=False)
+        recall = statistics.mean(len(f & t) / len(t) for f, t in zip(found, truth))
+        print(
+            f"{'hnsw':<8} {statistics.median(hnsw_lat) * 1e3:>8.2f} "
+            f"{sorted(hnsw_lat)[int(0.95 * len(hnsw_lat))] * 1e3:>8.2f} {recall:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Memory, latency and recall of reduced dimensions and quantized vectors.
+
+Builds ``LocalVectorIndex`` copies of ``rag-app/data_samples`` (chunked and
+embedded with the hashed bag of words of ``benchmarks.retrieval``) for every
+``--dims`` x quantization pair, padded with ``--distractors`` synthetic
+clustered vectors so the scan has realistic work to do, and reports for each:
+
+- ``vectors MB``: what a query scans in memory (float32 matrix, or int8 codes
+  + scales, or packed sign bits); quantized indexes read only the shortlisted
+  float32 rows from the memory map for rescoring
+- ``recall@1`` / ``recall@k`` / ``mrr`` on the labelled sample questions
+- ``overlap@k``: share of the full-precision top k (same dimensions) that the
+  quantized search returns, i.e. the recall lost to quantization alone
+- ``p50 ms``: median latency of ``LocalVectorIndex.search``
+
+Fewer hashed dimensions means more term collisions, which stands in for the
+smaller ``dimensions`` of text-embedding-3 (truncated, re-normalised vectors);
+as in ``benchmarks.retrieval``, compare rows rather than trust absolute numbers.
+The last lines compare the ingestion embedding cache stored as float32 and int8.
+
+    cd rag-app/service
+    python -m benchmarks.quantization --dims 1536 512 256 --distractors 50000
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.local_index import clustered
+from benchmarks.retrieval import QUESTIONS, hashed_embedding, sample_docs
+from embedding_cache import EmbeddingCache
+from local_index import LocalVectorIndex
+
+QUANTIZATIONS = ("none", "int8", "binary")
+
+
+def build(path: Path, dim: int, distractors: int) -> List[Dict]:
+    docs = sample_docs(dim)
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((64, dim), dtype=np.float32)
+    index = LocalVectorIndex.create(path, dim)
+    index.hnsw_min_docs = 1 + len(docs) + distractors  # exact scans only: the path quantization replaces
+    index.upload_documents(docs)
+    for start in range(0, distractors, 10_000):
+        vectors = clustered(rng, min(10_000, distractors - start), dim, centers)
+        index.upload_documents([{"id": f"distractor-{start + i}", "contentVector": v} for i, v in enumerate(vectors)])
+    index.save()
+    return docs
+
+
+def scanned_bytes(index: LocalVectorIndex) -> int:
+    if index.quantization == "none":
+        return index._vectors.nbytes
+    codes, scales = index._quantized()
+    return codes.nbytes + (scales.nbytes if scales is not None else 0)
+
+
+def evaluate(index: LocalVectorIndex, exact: LocalVectorIndex, dim: int, k: int) -> Dict[str, float]:
+    ranks, overlaps, latencies = [], [], []
+    for question, slug in QUESTIONS:
+        embedding = hashed_embedding(question, dim)
+        start = time.perf_counter()
+        hits = index.search(embedding, top=k, select=["id"])
+        latencies.append(time.perf_counter() - start)
+        truth = {hit["id"] for hit in exact.search(embedding, top=k, select=["id"], exact=True)}
+        overlaps.append(len(truth & {hit["id"] for hit in hits}) / len(truth))
+        ranks.append(next((i for i, hit in enumerate(hits, start=1) if hit["id"].rsplit("-chunk", 1)[0] == slug), None))
+    return {
+        "vectors MB": scanned_bytes(index) / 2**20,
+        "recall@1": sum(1 for r in ranks if r == 1) / len(ranks),
+        f"recall@{k}": sum(1 for r in ranks if r) / len(ranks),
+        "mrr": statistics.mean(1 / r if r else 0 for r in ranks),
+        f"overlap@{k}": statistics.mean(overlaps),
+        "p50 ms": statistics.median(latencies) * 1e3,
+    }
+
+
+def cache_sizes(tmp: Path, docs: List[Dict]) -> None:
+    for quantization in ("none", "int8"):
+        cache = EmbeddingCache(tmp / f"cache-{quantization}", quantization=quantization)
+        cache.put_many((f"{i:032x}", doc["contentVector"]) for i, doc in enumerate(docs))
+        cache.flush()
+        error = max(
+            float(np.abs(cache.get_array(f"{i:032x}") - doc["contentVector"]).max()) for i, doc in enumerate(docs)
+        )
+        size = cache.vectors_path.stat().st_size
+        print(f"embedding cache {quantization:<6} {len(docs)} vectors  {size / 1024:>8.1f} KB  max abs error {error:.4f}")
+        cache.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dims", type=int, nargs="+", default=[1536, 512, 256])
+    parser.add_argument("--distractors", type=int, default=50_000)
+    parser.add_argument("--rescore-factor", type=int, default=4, help="shortlist size as a multiple of k")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = []
+        for dim in args.dims:
+            path = Path(tmp) / f"index-{dim}"
+            docs = build(path, dim, args.distractors)
+            exact = LocalVectorIndex(path)
+            for quantization in QUANTIZATIONS:
+                index = LocalVectorIndex(path, quantization=quantization, rescore_factor=args.rescore_factor)
+                index.search(hashed_embedding("warm up", dim), top=1)  # builds the codes
+                rows.append((dim, quantization, evaluate(index, exact, dim, args.k)))
+
+        print(
+            f"{len(docs)} sample chunks + {args.distractors} distractors, {len(QUESTIONS)} labelled questions, "
+            f"rescoring {args.rescore_factor}x{args.k} candidates\n"
+        )
+        columns = list(rows[0][2])
+        print(f"{'dims':>5} {'quant':<7}" + "".join(f"{c:>12}" for c in columns))
+        for dim, quantization, result in rows:
+            print(f"{dim:>5} {quantization:<7}" + "".join(f"{result[c]:>12.3f}" for c in columns))
+        print()
+        cache_sizes(Path(tmp), sample_docs(args.dims[0]))
+
+
+if __name__ == "__main__":
+    main()
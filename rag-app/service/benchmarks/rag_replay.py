@@ -0,0 +1,434 @@
+"""End-to-end RAG benchmark, replayed offline from recorded upstream calls.
+
+Runs every question of ``fixtures/rag_questions.json`` through
+``RAGService.answer`` (what ``query`` returns the text of) with the real
+prompt building, context packing, reranking and caches, but with the
+embeddings and chat calls answered from a cassette at the HTTP layer of the
+OpenAI client and every search answered from the same cassette in place of
+the retriever. Nothing goes over the network, so the run is deterministic and
+needs no credentials.
+
+Per pass over the questions it reports:
+
+- p50 / p95 / max of every ``span`` stage (embed, search, rerank, pack, chat,
+  total), over the questions that ran it. With ``--latency recorded`` each
+  replayed call waits as long as it took when recorded; the default
+  (``none``) leaves only the service's own time
+- upstream calls made, prompt / completion / embedding tokens and their cost
+  at ``--price-*`` (USD per 1M tokens). Prompt and embedding tokens are
+  counted from the requests this run built, completion tokens come from the
+  recorded responses
+- retrieval against the labelled chunk ids of each question: recall (share of
+  the relevant chunks among the answer's sources), hit rate (any of them) and
+  MRR (first source holding one)
+
+``--repeat 2`` runs the questions again on the warm caches of the first pass.
+
+Recorded calls are looked up by the exact request (path and JSON body; index,
+query, embedding and options for searches). A request that changed since the
+recording, e.g. because prompt building did, falls back to the call made at
+the same point of the same question and counts as ``drifted``: its tokens
+are this run's, but the response (and therefore the answer) is the recorded
+one. Re-record after changes to what is asked upstream:
+
+    cd rag-app/service
+    python -m benchmarks.rag_replay --record   # live Azure OpenAI + search, from .env
+    python -m benchmarks.rag_replay --repeat 2 --save report.json
+    python -m benchmarks.rag_replay --baseline report.json
+
+With ``--baseline`` the first pass is compared to a saved report and the
+exit status is 1 if tokens or cost grew, or retrieval got worse, by more than
+``--tolerance``, or median latency grew by more than ``--latency-tolerance``.
+
+The committed cassette was recorded against ``benchmarks.stub_server``
+(``STUB_EMBEDDINGS=hashed``, so vector search ranks by shared terms) over a
+local index of ``data_samples``: its answers are canned and its upstream
+latencies those of the stub. Record against Azure for representative
+latency, tokens and recall.
+"""
+import argparse
+import asyncio
+import contextvars
+import copy
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from benchmarks.load_query import percentile
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+STAGES = ("embed", "search", "rerank", "pack", "chat", "total")
+# Response headers kept in the cassette: what the client and the rate limiter read
+KEPT_HEADERS = ("content-type", "retry-after", "x-ratelimit-")
+
+current_question: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("question", default=None)
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+def digest(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def plain(value: Any) -> Any:
+    """JSON-ready copy of search hits (numpy scalars and vectors become floats and lists)."""
+    return json.loads(json.dumps(value, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o)))
+
+
+class Cassette:
+    """Recorded upstream calls, plus what the current pass used of them."""
+
+    def __init__(self, meta: Optional[Dict[str, Any]] = None, interactions: Optional[List[Dict[str, Any]]] = None):
+        self.meta = meta or {}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.turns: Dict[Tuple[Optional[str], str, int], Dict[str, Any]] = {}
+        for entry in interactions or []:
+            self.entries.setdefault(entry["key"], entry)
+            self.turns.setdefault((entry["question"], entry["kind"], entry["seq"]), entry)
+        self.seq: Counter = Counter()
+        self.usage: Counter = Counter()
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls(data["meta"], data["interactions"])
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        interactions = ",\n".join("  " + json.dumps(entry, ensure_ascii=False) for entry in self.entries.values())
+        path.write_text(
+            f'{{"meta": {json.dumps(self.meta)},\n"interactions": [\n{interactions}\n]}}\n', encoding="utf-8"
+        )
+
+    def start_pass(self) -> None:
+        self.seq.clear()
+        self.usage = Counter()
+
+    def _turn(self, kind: str) -> Tuple[Optional[str], str, int]:
+        question = current_question.get()
+        seq = self.seq[(question, kind)]
+        self.seq[(question, kind)] += 1
+        self.usage[f"{kind} calls"] += 1
+        return question, kind, seq
+
+    def record(self, kind: str, key: str, entry: Dict[str, Any]) -> None:
+        question, kind, seq = turn = self._turn(kind)
+        entry = {"question": question, "kind": kind, "seq": seq, "key": key, **entry}
+        self.entries.setdefault(key, entry)
+        self.turns.setdefault(turn, entry)
+
+    def replay(self, kind: str, key: str) -> Dict[str, Any]:
+        turn = self._turn(kind)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.turns.get(turn)
+            if entry is None:
+                raise CassetteMiss(f"No recorded {kind} call #{turn[2]} for question {turn[0]}; re-record with --record")
+            self.usage["drifted"] += 1
+        return entry
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """OpenAI client transport: replays the cassette, or records what ``upstream`` answers."""
+
+    def __init__(self, cassette: Cassette, upstream: Optional[httpx.AsyncBaseTransport] = None, latency: bool = False):
+        self.cassette = cassette
+        self.upstream = upstream
+        self.latency = latency
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(await request.aread() or b"null")
+        path = request.url.path
+        kind = "chat" if path.endswith("/chat/completions") else "embeddings" if path.endswith("/embeddings") else path
+        key = digest({"path": path, "body": body})
+        if self.upstream is None:
+            entry = self.cassette.replay(kind, key)
+            if self.latency:
+                await asyncio.sleep(entry["elapsed"])
+        else:
+            start = time.perf_counter()
+            response = await self.upstream.handle_async_request(request)
+            content = (await response.aread()).decode("utf-8")
+            headers = {k: v for k, v in response.headers.items() if k.lower().startswith(KEPT_HEADERS)}
+            entry = {"elapsed": round(time.perf_counter() - start, 4), "status": response.status_code,
+                     "headers": headers, "body": content}
+            await response.aclose()
+            self.cassette.record(kind, key, entry)
+        self._count(kind, body, entry)
+        return httpx.Response(entry["status"], headers=entry["headers"], content=entry["body"].encode("utf-8"))
+
+    def _count(self, kind: str, body: Any, entry: Dict[str, Any]) -> None:
+        from tokens import count_tokens
+
+        usage = self.cassette.usage
+        if kind == "embeddings":
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            usage["embedding tokens"] += sum(count_tokens(text) for text in texts)
+        elif kind == "chat" and entry["status"] == 200:
+            # Per message: the content plus ~3 tokens of role markup, and 3 priming the reply
+            usage["prompt tokens"] += sum(count_tokens(m["content"]) + 3 for m in body["messages"]) + 3
+            usage["completion tokens"] += json.loads(entry["body"]).get("usage", {}).get("completion_tokens", 0)
+
+
+class CassetteRetriever:
+    """Retriever answering from the cassette, or recording what ``inner`` returns."""
+
+    def __init__(self, cassette: Cassette, index: str, inner: Any = None, latency: bool = False):
+        self.cassette = cassette
+        self.index = index
+        self.inner = inner
+        self.latency = latency
+
+    async def search(
+        self, embedding: List[float], top: int = 3, query: Optional[str] = None, options: Any = None
+    ) -> List[Dict[str, Any]]:
+        vector = hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+        key = digest({"index": self.index, "top": top, "query": query, "vector": vector,
+                      "options": options.cache_key if options is not None else None})
+        if self.inner is None:
+            entry = self.cassette.replay("search", key)
+            if self.latency:
+                await asyncio.sleep(entry["elapsed"])
+            return copy.deepcopy(entry["hits"])
+        start = time.perf_counter()
+        hits = await self.inner.search(embedding, top=top, query=query, options=options)
+        self.cassette.record("search", key, {"elapsed": round(time.perf_counter() - start, 4), "hits": plain(hits)})
+        return hits
+
+    async def warm_up(self) -> None:
+        if self.inner is not None:
+            await self.inner.warm_up()
+
+    async def close(self) -> None:
+        if self.inner is not None:
+            await self.inner.close()
+
+
+def replay_env(meta: Dict[str, Any]) -> None:
+    """Configuration a replay needs before ``rag_service`` is imported (and reads .env)."""
+    os.environ.update(
+        {
+            "AZURE_OPENAI_ENDPOINT": "https://replay.invalid",
+            "AZURE_OPENAI_API_KEY": "replay",
+            "AZURE_OPENAI_EMBED_DEPLOYMENT": meta["embed_deployment"],
+            "AZURE_OPENAI_CHAT_DEPLOYMENT": meta["chat_deployment"],
+            "AZURE_SEARCH_INDEX": meta["index"],
+            "RETRIEVER_BACKEND": "local",  # no search service is built; the cassette answers
+        }
+    )
+    if meta.get("embed_dimensions"):
+        os.environ["EMBED_DIMENSIONS"] = str(meta["embed_dimensions"])
+    else:
+        os.environ.pop("EMBED_DIMENSIONS", None)
+    os.environ.pop("QUERY_EMBED_CACHE_REDIS_URL", None)
+
+
+def score_retrieval(sources: List[Dict[str, Any]], relevant: List[str]) -> Dict[str, float]:
+    wanted = set(relevant)
+    found = {chunk for source in sources for chunk in source["ids"]} & wanted
+    rank = next((i for i, source in enumerate(sources, start=1) if wanted.intersection(source["ids"])), None)
+    return {"recall": len(found) / len(wanted), "hit": float(bool(found)), "mrr": 1 / rank if rank else 0.0}
+
+
+async def run_pass(service: Any, cassette: Cassette, questions: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    from metrics import collect_stages
+    from retrievers import SearchOptions
+
+    cassette.start_pass()
+    options = SearchOptions(mode=args.mode, rerank=args.rerank)
+    timings: Dict[str, List[float]] = {}
+    scores: List[Dict[str, float]] = []
+    errors = []
+    for question in questions:
+        token = current_question.set(question["id"])
+        try:
+            with collect_stages() as stages:
+                answer = await service.answer(question["question"], top=args.top, max_tokens=args.max_tokens, options=options)
+        except Exception as e:
+            errors.append(f"{question['id']}: {type(e).__name__}: {e}")
+            continue
+        finally:
+            current_question.reset(token)
+        for stage, seconds in stages.items():
+            timings.setdefault(stage, []).append(seconds * 1e3)
+        scores.append(score_retrieval(answer.sources, question["relevant"]))
+
+    usage = cassette.usage
+    cost = (
+        usage["prompt tokens"] * args.price_prompt
+        + usage["completion tokens"] * args.price_completion
+        + usage["embedding tokens"] * args.price_embedding
+    ) / 1e6
+    answered = len(scores)
+    return {
+        "questions": len(questions),
+        "errors": errors,
+        "stages": {
+            stage: {"n": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95), "max_ms": max(values)}
+            for stage, values in sorted(timings.items(), key=lambda item: STAGES.index(item[0]) if item[0] in STAGES else 99)
+        },
+        "usage": dict(usage),
+        "prompt_tokens_per_question": usage["prompt tokens"] / answered if answered else 0.0,
+        "cost_usd": cost,
+        "cost_per_1k_questions_usd": cost / answered * 1000 if answered else 0.0,
+        "retrieval": {
+            name: statistics.mean(score[name] for score in scores) if scores else 0.0 for name in ("recall", "hit", "mrr")
+        },
+    }
+
+
+def print_pass(number: int, result: Dict[str, Any]) -> None:
+    usage = result["usage"]
+    warm = "cold caches" if number == 1 else "warm caches"
+    print(f"\npass {number} ({warm}): {result['questions']} questions, {len(result['errors'])} errors, "
+          f"{usage.get('drifted', 0)} drifted calls")
+    for error in result["errors"]:
+        print(f"  error {error}")
+    print(f"  {'stage':<8} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for stage, t in result["stages"].items():
+        print(f"  {stage:<8} {t['n']:>4} {t['p50_ms']:>9.2f} {t['p95_ms']:>9.2f} {t['max_ms']:>9.2f}")
+    print(f"  calls: {usage.get('embeddings calls', 0)} embeddings, {usage.get('search calls', 0)} searches, "
+          f"{usage.get('chat calls', 0)} chat")
+    print(f"  tokens: {usage.get('prompt tokens', 0)} prompt ({result['prompt_tokens_per_question']:.0f}/question), "
+          f"{usage.get('completion tokens', 0)} completion, {usage.get('embedding tokens', 0)} embedding")
+    print(f"  cost: ${result['cost_usd']:.6f} (${result['cost_per_1k_questions_usd']:.4f} per 1k questions)")
+    r = result["retrieval"]
+    print(f"  retrieval: recall {r['recall']:.3f}, hit rate {r['hit']:.3f}, MRR {r['mrr']:.3f}")
+
+
+def regressions(result: Dict[str, Any], baseline: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    """What got worse than ``baseline`` (first pass of a saved report) beyond the tolerances."""
+    found = []
+
+    def check(name: str, new: float, old: float, tolerance: float, higher_is_worse: bool = True, min_delta: float = 0.0):
+        worse = new - old if higher_is_worse else old - new
+        if worse > max(tolerance * abs(old), min_delta):
+            found.append(f"{name}: {old:.4g} -> {new:.4g}")
+
+    # Medians only: with a dozen questions the p95 is the slowest one, mostly first-call costs
+    for stage in ("total", "pack", "rerank"):
+        if stage in result["stages"] and stage in baseline["stages"]:
+            check(f"{stage} p50 ms", result["stages"][stage]["p50_ms"], baseline["stages"][stage]["p50_ms"],
+                  args.latency_tolerance, min_delta=args.min_latency_ms)
+    tolerance = args.tolerance
+    check("prompt tokens/question", result["prompt_tokens_per_question"], baseline["prompt_tokens_per_question"], tolerance)
+    check("cost per 1k questions", result["cost_per_1k_questions_usd"], baseline["cost_per_1k_questions_usd"], tolerance)
+    for name in ("recall", "hit", "mrr"):
+        check(name, result["retrieval"][name], baseline["retrieval"][name], tolerance, higher_is_worse=False)
+    return found
+
+
+async def run(args: argparse.Namespace, cassette: Cassette, questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    from rag_service import RAGService, openai_client_from_env
+    from tokens import get_encoding, token_byte_lengths
+
+    service = RAGService()
+    await service.openai_client.close()
+    upstream = httpx.AsyncHTTPTransport() if args.record else None
+    service.http_client = httpx.AsyncClient(
+        transport=CassetteTransport(cassette, upstream, args.latency == "recorded"), timeout=60.0
+    )
+    service.openai_client = openai_client_from_env(service.http_client)
+    create = service.retrievers.create
+    latency = args.latency == "recorded"
+
+    async def cassette_retriever(index: str) -> CassetteRetriever:
+        return CassetteRetriever(cassette, index, await create(index) if args.record else None, latency)
+
+    service.retrievers.create = cassette_retriever
+    # What a warmed-up server has loaded, so the first question does not pay for it
+    get_encoding()
+    token_byte_lengths()
+    service.template_tokens
+    await service.retrievers.warm_up(service.index)
+    try:
+        return [await run_pass(service, cassette, questions, args) for _ in range(args.repeat)]
+    finally:
+        await service.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=Path, default=FIXTURES / "rag_questions.json")
+    parser.add_argument("--cassette", type=Path, default=FIXTURES / "rag_cassette.json")
+    parser.add_argument("--record", action="store_true", help="call the live services and (re)write the cassette")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the questions (later ones hit the caches)")
+    parser.add_argument("--latency", choices=("none", "recorded"), default="none", help="replayed upstream latency")
+    parser.add_argument("--top", type=int, help="sources per answer (default: as recorded, else 3)")
+    parser.add_argument("--max-tokens", type=int, help="completion tokens (default: as recorded, else 300)")
+    parser.add_argument("--mode", help="retrieval mode (default: as recorded, else RETRIEVAL_MODE)")
+    parser.add_argument("--rerank", help="rerank strategy (default: as recorded, else RERANK_STRATEGY)")
+    parser.add_argument("--price-prompt", type=float, default=0.15, help="USD per 1M prompt tokens")
+    parser.add_argument("--price-completion", type=float, default=0.60, help="USD per 1M completion tokens")
+    parser.add_argument("--price-embedding", type=float, default=0.02, help="USD per 1M embedding tokens")
+    parser.add_argument("--save", type=Path, help="write the report as JSON")
+    parser.add_argument("--baseline", type=Path, help="saved report to compare the first pass with")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="relative change of tokens, cost or retrieval "
+                        "counted as a regression (they are deterministic in a replay)")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5, help="relative change of median latency")
+    parser.add_argument("--min-latency-ms", type=float, default=2.0, help="smaller latency changes are noise")
+    args = parser.parse_args()
+
+    questions = json.loads(args.questions.read_text(encoding="utf-8"))
+    if args.record:
+        cassette = Cassette()
+    else:
+        cassette = Cassette.load(args.cassette)
+        replay_env(cassette.meta)
+    from rerank import DEFAULT_RERANK
+    from retrievers import DEFAULT_RETRIEVAL_MODE
+
+    recorded = cassette.meta.get("options", {})
+    args.top = args.top or recorded.get("top", 3)
+    args.max_tokens = args.max_tokens or recorded.get("max_tokens", 300)
+    args.mode = args.mode or recorded.get("mode", DEFAULT_RETRIEVAL_MODE)
+    args.rerank = args.rerank or recorded.get("rerank", DEFAULT_RERANK)
+
+    results = asyncio.run(run(args, cassette, questions))
+    if args.record:
+        cassette.meta = {
+            "recorded_at": date.today().isoformat(),
+            "embed_deployment": os.environ["AZURE_OPENAI_EMBED_DEPLOYMENT"],
+            "chat_deployment": os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+            "embed_dimensions": int(os.environ["EMBED_DIMENSIONS"]) if os.getenv("EMBED_DIMENSIONS") else None,
+            "index": os.getenv("AZURE_SEARCH_INDEX") or "default",
+            "backend": os.getenv("RETRIEVER_BACKEND", "azure"),
+            "options": {"top": args.top, "max_tokens": args.max_tokens, "mode": args.mode, "rerank": args.rerank},
+        }
+        cassette.save(args.cassette)
+        print(f"Recorded {len(cassette.entries)} calls to {args.cassette}")
+
+    meta = cassette.meta
+    print(f"{len(questions)} questions, cassette of {meta.get('recorded_at')} ({meta.get('backend')} search); "
+          f"top={args.top} max_tokens={args.max_tokens} mode={args.mode} rerank={args.rerank} latency={args.latency}")
+    for number, result in enumerate(results, start=1):
+        print_pass(number, result)
+
+    if args.save:
+        options = {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()}
+        args.save.write_text(json.dumps({"options": options, "passes": results}, indent=2) + "\n", encoding="utf-8")
+    failed = any(result["errors"] for result in results)
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["passes"][0]
+        found = regressions(results[0], baseline, args)
+        print(f"\nAgainst {args.baseline}: " + ("no regressions" if not found else f"{len(found)} regressions"))
+        for line in found:
+            print(f"  {line}")
+        failed = failed or bool(found)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Offline relevance of each retrieval mode over ``rag-app/data_samples``.
+
+Search is mocked by a ``LocalVectorIndex`` holding the sample threads,
+chunked exactly as ingestion does, and embeddings by a hashed bag of words
+(each term lands in one signed dimension). The vector mode is therefore a
+lexical stand-in for real embeddings: use the numbers to compare modes and
+fusion settings, not to predict absolute quality against Azure.
+
+Each question is labelled with the thread that answers it; recall@k is the
+share of questions with a chunk of that thread among the first k hits, and
+MRR is the mean reciprocal rank of the first such chunk. ``semantic`` runs
+as ``hybrid`` locally (no semantic ranker offline) and is omitted. Rows with
+a ``+strategy`` suffix over-fetch ``--candidates`` hits and rerank them as
+RAGService does; latency then includes the rerank.
+
+    cd rag-app/service
+    python -m benchmarks.retrieval --k 10
+"""
+import argparse
+import asyncio
+import re
+import statistics
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import yaml
+
+from chunking import chunk_text, prompt_fields
+from local_index import LocalVectorIndex, terms
+from rerank import Reranker
+from retrievers import LocalRetriever, SearchOptions
+
+SAMPLES = Path(__file__).resolve().parents[2] / "data_samples" / "stack_overflow"
+DIM = 1536
+FRONT_MATTER_RE = re.compile(r"^---\n(.*?)\n---\n*", re.DOTALL)
+
+# (question, slug of the thread that answers it); paraphrased, not copied from titles
+QUESTIONS = [
+    ("My app-of-apps was created but no child applications appear in the Argo CD UI", "application-not-showing-in-argocd"),
+    ("kubectl apply of an Application manifest does nothing in argocd", "application-not-showing-in-argocd"),
+    ("Azure OpenAI on your data returns wrong answers from my documents", "azure-openai-byod-incorrect-answers"),
+    ("answers grounded on my cognitive search index are inaccurate", "azure-openai-byod-incorrect-answers"),
+    ("Argo CD ignores the custom values file of my Helm chart", "helm-values-yml-not-applied-in-argocd"),
+    ("valueFiles in the application spec are not picked up", "helm-values-yml-not-applied-in-argocd"),
+    ("how do I pass a list of maps with --set to helm install", "pass-array-of-objects-to-helm"),
+    ("set an array of objects from the command line for a chart", "pass-array-of-objects-to-helm"),
+    ("send a picture to GPT-4 vision with the JavaScript SDK", "query-azure-openai-with-images"),
+    ("multimodal chat completion with an image using @azure/openai", "query-azure-openai-with-images"),
+    ("who should be allowed to push to the gitops environment repository", "secure-environment-repo-gitops"),
+    ("protect the deployment config repo from unauthorized changes in GitOps", "secure-environment-repo-gitops"),
+]
+
+MODES = [
+    ("vector", SearchOptions(mode="vector")),
+    ("keyword", SearchOptions(mode="keyword")),
+    ("hybrid", SearchOptions(mode="hybrid")),
+    ("vector+bm25", SearchOptions(mode="vector", rerank="bm25")),
+    ("vector+mmr", SearchOptions(mode="vector", rerank="mmr")),
+    ("hybrid+bm25", SearchOptions(mode="hybrid", rerank="bm25")),
+]
+
+
+def hashed_embedding(text: str, dim: int = DIM) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    for term in terms(text):
+        h = zlib.crc32(term.encode("utf-8"))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    return vector
+
+
+def sample_docs(dim: int = DIM) -> List[Dict[str, Any]]:
+    docs = []
+    for path in sorted(SAMPLES.glob("*.md")):
+        raw = path.read_text(encoding="utf-8")
+        m = FRONT_MATTER_RE.match(raw)
+        meta = yaml.safe_load(m.group(1)) or {}
+        body = re.sub(r"^# RAW_THREAD\s*\n", "", raw[m.end():].strip())
+        chunks = chunk_text(body)
+        for i, (text, fields) in enumerate(zip(chunks, prompt_fields(chunks))):
+            docs.append({
+                "id": f"{path.stem.lower()}-chunk{i}",
+                "content": text,
+                "title": meta.get("title", ""),
+                "source": meta.get("source", ""),
+                "topics": meta.get("topics") or meta.get("topic") or [],
+                "chunk_index": i,
+                "contentVector": hashed_embedding(f"{meta.get('title', '')} {text}", dim),
+                **fields,
+            })
+    return docs
+
+
+def evaluate(retriever: LocalRetriever, reranker: Reranker, options: SearchOptions, k: int) -> Dict[str, float]:
+    ranks, latencies = [], []
+    for question, slug in QUESTIONS:
+        embedding = hashed_embedding(question)
+        start = time.perf_counter()
+        hits = retriever._search(embedding, reranker.fetch_size(k, options.rerank), question, options)
+        if options.rerank != "none":
+            hits = asyncio.run(reranker.rerank(options.rerank, question, embedding, hits, k))
+        latencies.append(time.perf_counter() - start)
+        rank = next((i for i, hit in enumerate(hits, start=1) if hit["id"].rsplit("-chunk", 1)[0] == slug), None)
+        ranks.append(rank)
+    result = {f"recall@{n}": sum(1 for r in ranks if r and r <= n) / len(ranks) for n in (1, 3, k)}
+    result["mrr"] = statistics.mean(1 / r if r else 0 for r in ranks)
+    result["p50 ms"] = statistics.median(latencies) * 1e3
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=5, help="hits retrieved per question")
+    parser.add_argument("--candidates", type=int, default=20, help="hits over-fetched for reranking")
+    args = parser.parse_args()
+
+    docs = sample_docs()
+    with tempfile.TemporaryDirectory() as tmp:
+        index = LocalVectorIndex.create(Path(tmp), DIM)
+        index.upload_documents(docs)
+        index.save()
+        retriever = LocalRetriever(index)
+        print(f"{len(docs)} chunks, {len(QUESTIONS)} labelled questions\n")
+
+        reranker = Reranker(candidates=args.candidates, budget_ms=1000)
+        rows = [(name, evaluate(retriever, reranker, options, args.k)) for name, options in MODES]
+        columns = list(rows[0][1])
+        print(f"{'mode':<12}" + "".join(f"{c:>11}" for c in columns))
+        for name, result in rows:
+            print(f"{name:<12}" + "".join(f"{result[c]:>11.3f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Cold-start cost of the API: import time, RSS and time to /ready.
+
+Every measurement runs in a fresh interpreter against the Azure stub server:
+
+- ``import main``: wall time, resident memory afterwards, and whether any
+  module of the ``dev`` dependency group (notebooks, plotting, analysis) got
+  imported; plus the slowest imports from ``python -X importtime``
+- ``import + warm``: the same, then building ``RAGService`` and running
+  ``warm_up()`` inline, i.e. everything the first request would otherwise pay for
+- ``uvicorn``: time until ``/health`` answers (port open), until ``/ready``
+  answers 200, and the server's RSS once ready
+
+    cd rag-app/service
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.load_query import serve, stub_env
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+DEV_MODULES = ("IPython", "ipykernel", "jupyter", "matplotlib", "mypy", "pandas", "plotly", "scipy", "sklearn")
+
+
+def rss_mb(pid: str = "self") -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child(mode: str) -> None:
+    start = time.perf_counter()
+    import main  # noqa: F401
+    result = {"import_s": time.perf_counter() - start}
+    if mode == "warm":
+        from rag_service import RAGService
+
+        async def build_and_warm() -> None:
+            service = RAGService()
+            await service.warm_up()
+            await service.close()
+
+        asyncio.run(build_and_warm())
+        result["warm_s"] = time.perf_counter() - start - result["import_s"]
+    result["rss_mb"] = rss_mb()
+    result["dev_modules"] = sorted(m for m in DEV_MODULES if m in sys.modules)
+    print(json.dumps(result))
+
+
+def measure(mode: str, env: Dict[str, str]) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", mode],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[str]:
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Modules first imported directly by main (one indent level below it)
+        if len(name) - len(name.lstrip()) == 3:
+            rows.append((int(cumulative), name.strip()))
+    return [f"{name:<28} {us / 1000:>8.1f} ms" for us, name in sorted(rows, reverse=True)[:top]]
+
+
+def time_to_ready(env: Dict[str, str], port: int) -> Dict[str, float]:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env=env,
+    )
+    start = time.perf_counter()
+    result: Dict[str, float] = {}
+    try:
+        while "ready_s" not in result:
+            if proc.poll() is not None or time.perf_counter() - start > 60:
+                raise RuntimeError("main:app did not become ready")
+            try:
+                if "health_s" not in result and httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    result["health_s"] = time.perf_counter() - start
+                if "health_s" in result and httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                    result["ready_s"] = time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+        result["rss_mb"] = rss_mb(str(proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    parser.add_argument("--app-port", type=int, default=8101)
+    parser.add_argument("--child", choices=["import", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    env = stub_env(args.stub_port)
+    with serve("benchmarks.stub_server:app", args.stub_port, env):
+        print(f"{'measurement':<16} {'import s':>9} {'warm s':>8} {'RSS MB':>8}  dev-group modules")
+        for mode, label in (("import", "import main"), ("warm", "import + warm")):
+            runs = [measure(mode, env) for _ in range(args.runs)]
+            warm = statistics.median(r["warm_s"] for r in runs) if mode == "warm" else 0.0
+            print(
+                f"{label:<16} {statistics.median(r['import_s'] for r in runs):>9.3f} {warm:>8.3f} "
+                f"{statistics.median(r['rss_mb'] for r in runs):>8.1f}  {', '.join(runs[0]['dev_modules']) or 'none'}"
+            )
+
+        runs = [time_to_ready(env, args.app_port) for _ in range(args.runs)]
+        print(f"\n{'uvicorn main:app':<16} {'/health s':>9} {'/ready s':>9} {'RSS MB':>8}")
+        print(
+            f"{'median':<16} {statistics.median(r['health_s'] for r in runs):>9.3f} "
+            f"{statistics.median(r['ready_s'] for r in runs):>9.3f} {statistics.median(r['rss_mb'] for r in runs):>8.1f}"
+        )
+
+        print("\nslowest imports under main (cumulative):")
+        for line in slowest_imports(env, 10):
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Local stand-in for the Azure OpenAI and Azure AI Search REST endpoints.
+
+Only the routes the service and ingestion scripts call are implemented, with a
+configurable artificial latency so benchmarks can exercise concurrency without
+network access or credentials:
+
+    STUB_EMBED_LATENCY=0.05 STUB_CHAT_LATENCY=0.5 uvicorn benchmarks.stub_server:app --port 8100
+
+STUB_EMBEDDINGS=hashed returns the hashed bag of words of
+``benchmarks.retrieval`` instead of pseudo-random vectors, so retrieval over
+the stub's embeddings ranks by shared terms (what ``benchmarks.rag_replay``
+records its default cassette with).
+
+The indexing route can also act like a loaded search service: each request
+takes STUB_INDEX_LATENCY plus STUB_INDEX_SECONDS_PER_MB of its body, requests
+beyond STUB_INDEX_CAPACITY in flight get 503, STUB_INDEX_FAIL_RATE of the
+documents fail with a per-item 503 (207 Multi-Status), and bodies over
+STUB_INDEX_MAX_MB get 413. ``GET /stub/stats`` counts what it saw.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBED_LATENCY = float(os.getenv("STUB_EMBED_LATENCY", "0.05"))
+CHAT_LATENCY = float(os.getenv("STUB_CHAT_LATENCY", "0.5"))
+SEARCH_LATENCY = float(os.getenv("STUB_SEARCH_LATENCY", "0.03"))
+DIMENSIONS = int(os.getenv("STUB_DIMENSIONS", "1536"))
+EMBEDDINGS = os.getenv("STUB_EMBEDDINGS", "random")
+INDEX_LATENCY = float(os.getenv("STUB_INDEX_LATENCY", str(SEARCH_LATENCY)))
+INDEX_SECONDS_PER_MB = float(os.getenv("STUB_INDEX_SECONDS_PER_MB", "0"))
+INDEX_CAPACITY = int(os.getenv("STUB_INDEX_CAPACITY", "0"))  # 0: unlimited
+INDEX_FAIL_RATE = float(os.getenv("STUB_INDEX_FAIL_RATE", "0"))
+INDEX_MAX_BYTES = int(float(os.getenv("STUB_INDEX_MAX_MB", "16")) * 2**20)
+# Document keys straight from the raw body: json.loads of a multi-MB batch would stall the event loop
+KEY_RE = re.compile(rb'[{,]\s*"id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+app = FastAPI(title="Azure stub")
+
+
+def fake_embedding(text: str, dimensions: int = DIMENSIONS) -> List[float]:
+    if EMBEDDINGS == "hashed":
+        from benchmarks.retrieval import hashed_embedding
+
+        return hashed_embedding(text, dimensions).tolist()
+    seed = hashlib.md5(text.encode("utf-8")).digest()
+    return [((seed[i % len(seed)] + i) % 255) / 255.0 - 0.5 for i in range(dimensions)]
+
+
+@app.get("/health")
+async def health() -> Dict[str, str]:
+    return {"status": "healthy"}
+
+
+@app.post("/openai/deployments/{deployment}/embeddings")
+async def embeddings(deployment: str, request: Request) -> Dict[str, Any]:
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(EMBED_LATENCY)
+    dimensions = body.get("dimensions") or DIMENSIONS
+    return {
+        "object": "list",
+        "model": deployment,
+        "data": [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(str(text), dimensions)}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": 8 * len(inputs), "total_tokens": 8 * len(inputs)},
+    }
+
+
+STUB_ANSWER = "Stub answer citing the sources."
+
+
+async def stream_chat(deployment: str) -> AsyncIterator[str]:
+    words = STUB_ANSWER.split(" ")
+    for i, word in enumerate(words):
+        await asyncio.sleep(CHAT_LATENCY / len(words))
+        chunk = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop" if i == len(words) - 1 else None,
+                    "delta": {"content": word if i == 0 else " " + word},
+                }
+            ],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request) -> Any:
+    body = await request.json()
+    if body.get("stream"):
+        return StreamingResponse(stream_chat(deployment), media_type="text/event-stream")
+    await asyncio.sleep(CHAT_LATENCY)
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": deployment,
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": STUB_ANSWER},
+            }
+        ],
+        "usage": {"prompt_tokens": 400, "completion_tokens": 12, "total_tokens": 412},
+    }
+
+
+@app.post("/indexes('{index}')/docs/search.post.search")
+async def search(index: str, request: Request) -> Dict[str, Any]:
+    body = await request.json()
+    await asyncio.sleep(SEARCH_LATENCY)
+    top = body.get("top") or 3
+    return {
+        "value": [
+            {
+                "@search.score": 1.0 / (i + 1),
+                "id": f"stub-thread-chunk{i}",
+                "title": "Stub thread",
+                "source": "https://example.com/stub",
+                "chunk_index": i,
+                "content": "Stub content about Argo CD applications. " * 20,
+                "topics": ["stub"],
+                "token_count": 161,
+                "snippet": "Stub content about Argo CD applications. " * 20,
+                "snippet_token_count": 161,
+            }
+            for i in range(top)
+        ]
+    }
+
+
+@app.get("/indexes('{index}')/docs/$count")
+async def document_count(index: str) -> int:
+    await asyncio.sleep(SEARCH_LATENCY)
+    return 0
+
+
+index_stats: Counter = Counter()
+index_in_flight = 0
+
+
+def service_error(status: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse({"error": {"code": code, "message": message}}, status_code=status, headers={"Retry-After": "1"})
+
+
+@app.post("/indexes('{index}')/docs/search.index")
+async def index_documents(index: str, request: Request) -> Any:
+    global index_in_flight
+    body = await request.body()
+    index_stats["requests"] += 1
+    index_stats["bytes"] += len(body)
+    if len(body) > INDEX_MAX_BYTES:
+        index_stats["too_large"] += 1
+        return service_error(413, "RequestEntityTooLarge", "The request is too large")
+    if INDEX_CAPACITY and index_in_flight >= INDEX_CAPACITY:
+        index_stats["throttled"] += 1
+        return service_error(503, "ServiceUnavailable", "The service is too busy to process the request")
+    index_in_flight += 1
+    try:
+        await asyncio.sleep(INDEX_LATENCY + INDEX_SECONDS_PER_MB * len(body) / 2**20)
+    finally:
+        index_in_flight -= 1
+
+    value = []
+    for key in KEY_RE.findall(body):
+        key = json.loads(b'"' + key + b'"')
+        if random.random() < INDEX_FAIL_RATE:
+            index_stats["failed_items"] += 1
+            value.append({"key": key, "status": False, "errorMessage": "Service busy", "statusCode": 503})
+        else:
+            index_stats["indexed"] += 1
+            value.append({"key": key, "status": True, "errorMessage": None, "statusCode": 200})
+    failed = any(not item["status"] for item in value)
+    return JSONResponse({"value": value}, status_code=207 if failed else 200)
+
+
+@app.get("/stub/stats")
+async def stub_stats() -> Dict[str, int]:
+    return dict(index_stats)
+
+
+@app.delete("/stub/stats")
+async def reset_stub_stats() -> Dict[str, int]:
+    index_stats.clear()
+    return {}
@@ -0,0 +1,155 @@
+"""Bulk upload throughput against a throttling stand-in for Azure AI Search.
+
+Starts the stub server with its indexing route acting like a loaded service
+(``--capacity`` requests in flight before it answers 503, a fixed cost per
+request plus a cost per MB, and ``--fail-rate`` of documents failing with a
+per-item 503), then uploads ``--docs`` synthetic chunks (``--dim`` float32
+vectors, about 1.5 KB of text each) with:
+
+- ``sequential``: the previous ingestion path, one ``merge_or_upload_documents``
+  call of 200 documents at a time with the SDK retry policy; any failed
+  document fails its whole batch
+- ``bulk c=N``: ``BulkUploader`` at a fixed concurrency of N
+- ``bulk adaptive``: ``BulkUploader`` starting at 4, adapting up to ``--max-concurrency``
+
+and reports documents per second, requests, MB sent, 503s seen by the stub,
+documents retried and documents that ended up failed.
+
+    cd rag-app/service
+    python -m benchmarks.upload --docs 5000 --capacity 6
+"""
+import argparse
+import time
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.policies import RetryPolicy
+from azure.search.documents import SearchClient
+
+from benchmarks.load_query import serve, stub_env
+from uploader import BulkUploader, pooled_transport
+
+
+def synthetic_docs(count: int, dim: int) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((count, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    text = "Argo CD keeps the cluster in sync with the manifests in git. " * 25
+    return [
+        {
+            "id": f"bench-{i // 4}-chunk{i % 4}",
+            "title": f"Benchmark thread {i // 4}",
+            "source": f"https://example.com/questions/{i // 4}",
+            "chunk_index": i % 4,
+            "content": text,
+            "snippet": text[:600],
+            "topics": ["argocd", "kubernetes"],
+            "token_count": 300,
+            "snippet_token_count": 120,
+            "doc_type": "stackoverflow_thread",
+            "contentVector": vector.tolist(),  # as the embedding cache hands them out
+        }
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def search_client(base_url: str, connections: int, retries: int = 3) -> SearchClient:
+    return SearchClient(
+        endpoint=base_url,
+        index_name="stub-index",
+        credential=AzureKeyCredential("stub"),
+        retry_policy=RetryPolicy(retry_total=retries, retry_backoff_factor=1.0, retry_on_status_codes=[429, 503, 504]),
+        transport=pooled_transport(connections),
+    )
+
+
+def sequential(base_url: str, docs: List[Dict[str, Any]]) -> Dict[str, float]:
+    client = search_client(base_url, 1)
+    failed = 0
+    for start in range(0, len(docs), 200):
+        batch = docs[start:start + 200]
+        try:
+            results = client.merge_or_upload_documents(batch)
+            if any(not r.succeeded for r in results):
+                failed += len(batch)
+        except Exception:
+            failed += len(batch)
+    return {"retried": 0, "failed": failed}
+
+
+def bulk(base_url: str, docs: List[Dict[str, Any]], **options: Any) -> Dict[str, float]:
+    client = search_client(base_url, options.get("max_concurrency", 1) + 1)
+    uploader = BulkUploader(lambda batch: client.merge_or_upload_documents(batch, retry_total=0), **options)
+    for doc in docs:
+        uploader.add(doc)
+    uploader.close()
+    return {"retried": uploader.retried, "failed": uploader.failed, "limit": uploader.limit}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=10_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--capacity", type=int, default=6, help="requests the stub serves at once before 503")
+    parser.add_argument("--request-latency", type=float, default=0.05, help="stub seconds per request")
+    parser.add_argument("--seconds-per-mb", type=float, default=0.1, help="stub seconds per MB of request body")
+    parser.add_argument("--fail-rate", type=float, default=0.002, help="share of documents failing with 503")
+    parser.add_argument("--max-mb", type=float, default=4, help="BulkUploader request size cap")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--stub-port", type=int, default=8100)
+    args = parser.parse_args()
+
+    env = stub_env(args.stub_port)
+    env.update(
+        {
+            "STUB_INDEX_LATENCY": str(args.request_latency),
+            "STUB_INDEX_SECONDS_PER_MB": str(args.seconds_per_mb),
+            "STUB_INDEX_CAPACITY": str(args.capacity),
+            "STUB_INDEX_FAIL_RATE": str(args.fail_rate),
+        }
+    )
+    docs = synthetic_docs(args.docs, args.dim)
+    max_bytes = int(args.max_mb * 2**20)
+    runs = [
+        ("sequential", sequential, {}),
+        ("bulk c=1", bulk, {"concurrency": 1, "max_concurrency": 1, "max_bytes": max_bytes}),
+        ("bulk c=1 raw vectors", bulk, {
+            "concurrency": 1, "max_concurrency": 1, "max_bytes": max_bytes, "vector_decimals": None,
+        }),
+        (f"bulk c={args.max_concurrency}", bulk, {
+            "concurrency": args.max_concurrency,
+            "min_concurrency": args.max_concurrency,
+            "max_concurrency": args.max_concurrency,
+            "max_bytes": max_bytes,
+        }),
+        ("bulk adaptive", bulk, {
+            "concurrency": 4, "max_concurrency": args.max_concurrency, "max_bytes": max_bytes,
+        }),
+    ]
+
+    print(
+        f"{args.docs} docs x {args.dim} dims; stub: {args.capacity} concurrent requests, "
+        f"{args.request_latency}s + {args.seconds_per_mb}s/MB per request, {args.fail_rate:.1%} item failures\n"
+    )
+    print(
+        f"{'run':<22} {'docs/s':>8} {'requests':>9} {'MB sent':>8} {'503s':>6} {'retried':>8} {'failed':>7} {'limit':>6}"
+    )
+    with serve("benchmarks.stub_server:app", args.stub_port, env) as base_url:
+        for label, run, options in runs:
+            httpx.delete(f"{base_url}/stub/stats")
+            start = time.perf_counter()
+            result = run(base_url, docs, **options)
+            elapsed = time.perf_counter() - start
+            seen = httpx.get(f"{base_url}/stub/stats").json()
+            limit = f"{result['limit']:.1f}" if "limit" in result else "-"
+            print(
+                f"{label:<22} {args.docs / elapsed:>8.0f} {seen.get('requests', 0):>9} "
+                f"{seen.get('bytes', 0) / 2**20:>8.1f} {seen.get('throttled', 0):>6} "
+                f"{result['retried']:>8} {result['failed']:>7} {limit:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
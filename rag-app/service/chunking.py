@@ -0,0 +1,123 @@
+"""Token-aware chunking of Markdown threads.
+
+A document is split into alternating prose and fenced code segments, each
+segment is tokenized once, and chunk boundaries are computed as
+``[start, end)`` spans over the resulting token stream: segments are packed
+greedily up to ``max_tokens``, each new chunk repeats the last ``overlap``
+tokens of the previous one, and a fenced code block is only ever split when
+it alone exceeds ``max_tokens``. Chunk text is sliced out of the original
+string via ``tokens.char_offsets``, so nothing is decoded or re-encoded.
+
+``chunk_many`` fans a corpus out over a process pool; tokenization and the
+span bookkeeping are CPU-bound, so threads would mostly contend on the GIL.
+
+``prompt_fields`` precomputes, at ingest time, the token counts and the
+truncated prompt snippet stored with each chunk, so the query path can build
+prompts without tokenizing anything.
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from tokens import DEFAULT_MODEL, char_offsets, get_encoding
+
+CODE_BLOCK_RE = re.compile(r"(```.*?```)", re.DOTALL)
+
+# Tokens of chunk content quoted per source in the grounded prompt
+SNIPPET_TOKENS = 250
+
+
+@dataclass(frozen=True)
+class Chunk:
+    text: str
+    start_token: int
+    end_token: int
+
+    @property
+    def tokens(self) -> int:
+        """Tokens in the span (the stripped ``text`` may be a token or two shorter)."""
+        return self.end_token - self.start_token
+
+
+def chunk_spans(segment_ends: Sequence[int], max_tokens: int = 300, overlap: int = 50) -> List[Tuple[int, int]]:
+    """Pack segments ending at the given token offsets into overlapping spans."""
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be in [0, max_tokens)")
+    spans: List[Tuple[int, int]] = []
+    start = end = 0
+    for seg_end in segment_ends:
+        if seg_end - start > max_tokens:
+            if end > start:
+                spans.append((start, end))
+            start = max(start, end - overlap)
+            end = seg_end
+            # A single oversized segment (e.g. a giant code block) is force-split
+            while end - start > max_tokens:
+                spans.append((start, start + max_tokens))
+                start += max_tokens - overlap
+        else:
+            end = seg_end
+    if end > start:
+        spans.append((start, end))
+    return spans
+
+
+def chunk_document(text: str, max_tokens: int = 300, overlap: int = 50, model: str = DEFAULT_MODEL) -> List[Chunk]:
+    enc = get_encoding(model)
+    tokens: List[int] = []
+    segment_ends: List[int] = []
+    for segment in CODE_BLOCK_RE.split(text):
+        tokens.extend(enc.encode_ordinary(segment))
+        segment_ends.append(len(tokens))
+
+    spans = chunk_spans(segment_ends, max_tokens, overlap)
+    boundaries = sorted({position for span in spans for position in span})
+    offsets = dict(zip(boundaries, char_offsets(text, tokens, boundaries, model)))
+    chunks = []
+    for start, end in spans:
+        piece = text[offsets[start]:offsets[end]].strip()
+        if piece:
+            chunks.append(Chunk(piece, start, end))
+    return chunks
+
+
+def chunk_text(text: str, max_tokens: int = 300, overlap: int = 50, model: str = DEFAULT_MODEL) -> List[str]:
+    return [chunk.text for chunk in chunk_document(text, max_tokens, overlap, model)]
+
+
+def prompt_fields(
+    texts: Sequence[str], snippet_tokens: int = SNIPPET_TOKENS, model: str = DEFAULT_MODEL
+) -> List[Dict[str, Any]]:
+    """``token_count``, ``snippet`` and ``snippet_token_count`` index fields for each chunk text."""
+    enc = get_encoding(model)
+    fields = []
+    for text, tokens in zip(texts, enc.encode_ordinary_batch(list(texts))):
+        if len(tokens) <= snippet_tokens:
+            snippet, snippet_count = text, len(tokens)
+        else:
+            snippet = text[:char_offsets(text, tokens, [snippet_tokens], model)[0]]
+            # Re-encode the cut text: BPE merges at the cut can shift the count by a token
+            snippet_count = len(enc.encode_ordinary(snippet))
+        fields.append({"token_count": len(tokens), "snippet": snippet, "snippet_token_count": snippet_count})
+    return fields
+
+
+def chunk_many(
+    texts: Sequence[str],
+    max_tokens: int = 300,
+    overlap: int = 50,
+    workers: Optional[int] = None,
+    model: str = DEFAULT_MODEL,
+) -> List[List[Chunk]]:
+    """Chunk every text, in input order, across ``workers`` processes (default: all CPUs)."""
+    workers = workers or os.cpu_count() or 1
+    chunk = partial(chunk_document, max_tokens=max_tokens, overlap=overlap, model=model)
+    if workers == 1 or len(texts) < 2 * workers:
+        return [chunk(text) for text in texts]
+    # Each worker loads the encoder once; batching keeps IPC per document small
+    chunksize = max(1, len(texts) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(chunk, texts, chunksize=chunksize))
@@ -0,0 +1,147 @@
+"""Token-budgeted packing of search hits into the grounded prompt's sources.
+
+``pack_context`` walks the hits by descending ``@search.score`` and adds each
+one to the prompt while it fits the token budget:
+
+- hits that are consecutive chunks (``chunk_index``) of the same thread are
+  merged into one source, keeping the text the chunker repeated between them
+  (its overlap) only once
+- a source that no longer fits whole is cut to the remaining budget (a single
+  chunk uses its precomputed ``snippet`` when that fits); sources that would
+  get fewer than ``min_source_tokens`` are dropped
+- token counts come from the ``token_count``/``snippet_token_count`` index
+  fields, so only merged or cut text is tokenized
+
+Each source's ``TITLE: ..., CONTENT: `` header and separator count against
+the budget, so ``PackedContext.tokens`` bounds the formatted sources block.
+"""
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from tokens import count_tokens, truncate_to_tokens
+
+SEPARATOR = "=================\n"
+# The chunker's 50-token overlap is a few hundred characters of text
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 2000
+
+
+@dataclass
+class PackedSource:
+    ids: List[str]
+    title: str
+    source: str
+    chunk_index: int
+    score: float
+    text: str
+    tokens: int  # text only until packed, then header + text as counted against the budget
+    truncated: bool = False
+    index: Optional[str] = None  # the index the chunks came from
+    # Precomputed cut of a single-chunk source, used when the whole chunk does not fit
+    snippet: Optional[str] = field(default=None, repr=False)
+    snippet_tokens: Optional[int] = field(default=None, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.ids[0],
+            "ids": self.ids,
+            "title": self.title,
+            "source": self.source,
+            "chunk_index": self.chunk_index,
+            "score": self.score,
+            "tokens": self.tokens,
+            "truncated": self.truncated,
+            "index": self.index,
+        }
+
+
+@dataclass
+class PackedContext:
+    sources: List[PackedSource]
+    budget: int
+
+    @property
+    def tokens(self) -> int:
+        return sum(source.tokens for source in self.sources)
+
+    @property
+    def text(self) -> str:
+        return SEPARATOR.join(f"TITLE: {s.title}, CONTENT: {s.text}" for s in self.sources)
+
+
+@lru_cache(maxsize=4096)
+def header_tokens(title: str) -> int:
+    return count_tokens(f"TITLE: {title}, CONTENT: ") + count_tokens(SEPARATOR)
+
+
+def merge_overlap(first: str, second: str) -> str:
+    """Join two consecutive chunks, keeping the text they share only once."""
+    for start in range(max(0, len(first) - MAX_OVERLAP_CHARS), len(first) - MIN_OVERLAP_CHARS + 1):
+        if second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+    return first + "\n\n" + second
+
+
+def _chunk_tokens(hit: Dict[str, Any]) -> int:
+    count = hit.get("token_count")
+    return count if count is not None else count_tokens(hit["content"])
+
+
+def merge_adjacent(hits: List[Dict[str, Any]]) -> List[PackedSource]:
+    """Group hits into runs of consecutive chunks per thread, best score first."""
+    threads: Dict[Tuple[Optional[str], str], List[Dict[str, Any]]] = {}
+    for hit in hits:
+        # Threads of different indexes never merge, even with the same URL
+        threads.setdefault((hit.get("index"), hit.get("source") or hit["title"]), []).append(hit)
+
+    blocks: List[PackedSource] = []
+    for thread in threads.values():
+        thread.sort(key=lambda h: h["chunk_index"])
+        runs = [[thread[0]]]
+        for hit in thread[1:]:
+            if hit["chunk_index"] == runs[-1][-1]["chunk_index"] + 1:
+                runs[-1].append(hit)
+            elif hit["chunk_index"] != runs[-1][-1]["chunk_index"]:
+                runs.append([hit])
+        for run in runs:
+            first = run[0]
+            text = first["content"]
+            for hit in run[1:]:
+                text = merge_overlap(text, hit["content"])
+            block = PackedSource(
+                ids=[h["id"] for h in run],
+                title=first["title"],
+                source=first.get("source", ""),
+                chunk_index=first["chunk_index"],
+                score=max(h.get("@search.score") or 0.0 for h in run),
+                text=text,
+                tokens=_chunk_tokens(first) if len(run) == 1 else count_tokens(text),
+                index=first.get("index"),
+            )
+            if len(run) == 1:
+                block.snippet, block.snippet_tokens = first.get("snippet"), first.get("snippet_token_count")
+            blocks.append(block)
+    blocks.sort(key=lambda b: b.score, reverse=True)
+    return blocks
+
+
+def pack_context(hits: List[Dict[str, Any]], budget: int, min_source_tokens: int = 50) -> PackedContext:
+    packed: List[PackedSource] = []
+    remaining = budget
+    for block in merge_adjacent(hits):
+        header = header_tokens(block.title)
+        allowed = remaining - header
+        if allowed < min(min_source_tokens, block.tokens):
+            continue
+        body_tokens = block.tokens
+        if body_tokens > allowed:
+            if block.snippet and block.snippet_tokens is not None and block.snippet_tokens <= allowed:
+                block.text, body_tokens = block.snippet, block.snippet_tokens
+            else:
+                block.text, body_tokens = truncate_to_tokens(block.text, allowed), allowed
+            block.truncated = True
+        block.tokens = header + body_tokens
+        packed.append(block)
+        remaining -= block.tokens
+    return PackedContext(packed, budget)
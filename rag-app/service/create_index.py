@@ -1,3 +1,4 @@
+import argparse
 import os
 from pathlib import Path
 
@@ -22,15 +23,18 @@ from azure.search.documents.indexes.models import (
 )
 from dotenv import load_dotenv
 
+from local_index import DEFAULT_INDEX_DIR, LocalVectorIndex
+from quantization import embed_dimensions
+from search_schema import INDEX_NAME_RE, SCORING_PROFILE_NAME, SEMANTIC_CONFIG_NAME, TAGS_PARAMETER
+
 # Load .env from the rag-app directory (parent of service)
 load_dotenv(Path(__file__).parent.parent / ".env", override=True)
 
-search_endpoint = os.environ["AZURE_SEARCH_ENDPOINT"]
-credential = AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"])
 index_name = os.getenv("AZURE_SEARCH_INDEX", "threads-index")
+# 1536 for ada-002 / text-embedding-3-small; EMBED_DIMENSIONS when ingestion requests smaller vectors.
+# Azure AI Search cannot resize an existing vector field: a new size needs a new index.
+EMBED_DIMENSIONS = embed_dimensions()
 
-
-index_client = SearchIndexClient(endpoint=search_endpoint, credential=credential)
 fields = [
     SimpleField(
         name="id",
@@ -49,6 +53,28 @@ fields = [
         sortable=False,
         facetable=False,
     ),
+    SimpleField(
+        name="token_count",
+        type=SearchFieldDataType.Int32,
+        filterable=True,
+        sortable=False,
+        facetable=False,
+    ),
+    # Pre-truncated prompt text and its exact token count, computed at ingest
+    SimpleField(
+        name="snippet",
+        type=SearchFieldDataType.String,
+        filterable=False,
+        sortable=False,
+        facetable=False,
+    ),
+    SimpleField(
+        name="snippet_token_count",
+        type=SearchFieldDataType.Int32,
+        filterable=False,
+        sortable=False,
+        facetable=False,
+    ),
     SimpleField(
         name="source",
         type=SearchFieldDataType.String,
@@ -111,7 +137,7 @@ fields = [
         name="contentVector",
         type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
         searchable=True,  # must be True for vector fields
-        vector_search_dimensions=1536,
+        vector_search_dimensions=EMBED_DIMENSIONS,
         vector_search_profile_name="vdb",
     ),
 ]
@@ -129,11 +155,13 @@ vector_search = VectorSearch(
             },
         ),
     ],
+    # No scalar/binary compression here: the pinned azure-search-documents 11.6.0b1 has no
+    # compression models. Reduced EMBED_DIMENSIONS is what shrinks this index today.
     profiles=[VectorSearchProfile(name="vdb", algorithm_configuration_name="hnsw-config")],
 )
 
 semantic_config = SemanticConfiguration(
-    name="my-semantic-config",
+    name=SEMANTIC_CONFIG_NAME,
     prioritized_fields=SemanticPrioritizedFields(
         title_field=SemanticField(field_name="title"),
         keywords_fields=[SemanticField(field_name="topics")],
@@ -147,13 +175,13 @@ semantic_search = SemanticSearch(configurations=[semantic_config])
 
 scoring_profiles = [
     ScoringProfile(  
-        name="my-scoring-profile",
+        name=SCORING_PROFILE_NAME,
         functions=[
             TagScoringFunction(
                 field_name="topics",
                 boost=5.0,
                 parameters=TagScoringParameters(
-                    tags_parameter="tags",
+                    tags_parameter=TAGS_PARAMETER,
                 ),
             )
         ]
@@ -161,12 +189,36 @@ scoring_profiles = [
 ]
 
 
-index = SearchIndex(
-    name=index_name,
-    fields=fields,
-    vector_search=vector_search,
-    semantic_search=semantic_search,
-    scoring_profiles=scoring_profiles
-)
-result = index_client.create_or_update_index(index)
-print(f"Index '{index_name}' updated")
+def create_azure_index() -> None:
+    if not INDEX_NAME_RE.match(index_name):
+        raise SystemExit(f"Invalid index name {index_name!r}")
+    search_endpoint = os.environ["AZURE_SEARCH_ENDPOINT"]
+    credential = AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"])
+    index_client = SearchIndexClient(endpoint=search_endpoint, credential=credential)
+
+    index = SearchIndex(
+        name=index_name,
+        fields=fields,
+        vector_search=vector_search,
+        semantic_search=semantic_search,
+        scoring_profiles=scoring_profiles
+    )
+    index_client.create_or_update_index(index)
+    print(f"Index '{index_name}' updated")
+
+
+def create_local_index(path: Path) -> None:
+    LocalVectorIndex.create(path, EMBED_DIMENSIONS)
+    print(f"Local index created at {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or update the search index")
+    parser.add_argument("--backend", choices=["azure", "local"], default=os.getenv("RETRIEVER_BACKEND", "azure"))
+    parser.add_argument("--local-dir", type=Path, default=Path(os.getenv("LOCAL_INDEX_DIR", str(DEFAULT_INDEX_DIR))))
+    args = parser.parse_args()
+
+    if args.backend == "local":
+        create_local_index(args.local_dir)
+    else:
+        create_azure_index()
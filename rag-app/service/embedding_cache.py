@@ -0,0 +1,192 @@
+"""Append-only, memory-mapped embedding cache used by ingestion.
+
+Vectors live in ``<name>.f32`` as raw float32 rows and are memory-mapped on
+read, so opening the cache costs only the size of the index, not the vectors.
+A cache created with ``quantization="int8"`` stores each row as a float32
+scale followed by int8 codes instead (about a quarter of the size) and hands
+back ``codes * scale``; the codec is recorded in the header, so an existing
+cache keeps the one it was created with. Binary codes cannot be turned back
+into vectors to upload, so they are not offered here.
+``<name>.idx`` holds a small header followed by one 16-byte MD5 digest per
+row: record ``i`` of the index is row ``i`` of the vector file.
+
+New entries are appended to both files (vector first, then its digest) and
+never rewrite existing data. On open, both files are truncated to the number
+of rows present in both, which discards a half-written tail left behind by a
+crash mid-run.
+
+Migrate the legacy JSON cache once with:
+
+    python embedding_cache.py embeddings_cache.json
+"""
+import argparse
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from quantization import quantize_int8
+
+MAGIC = b"EMBC"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")  # magic, version, dimensions, codec (0 in caches that predate it)
+DIGEST_SIZE = 16
+CODECS = {"none": 0, "int8": 1}
+
+DEFAULT_CACHE_PATH = Path(__file__).parent / "embeddings_cache"
+LEGACY_JSON_PATH = Path(__file__).parent / "embeddings_cache.json"
+
+
+class EmbeddingCache:
+    """Mapping of MD5 hex digest -> embedding backed by a float32 (or int8) memmap."""
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, dim: Optional[int] = None, quantization: str = "none"):
+        if quantization not in CODECS:
+            raise ValueError(f"quantization must be one of {', '.join(CODECS)}, got {quantization!r}")
+        path = Path(path)
+        self.vectors_path = path.with_suffix(".f32")
+        self.index_path = path.with_suffix(".idx")
+        self.dim = dim
+        self.quantization = quantization
+        self._rows: Dict[bytes, int] = {}
+        self._mmap: Optional[np.memmap] = None
+        self._vectors_file = None
+        self._index_file = None
+        self._open()
+
+    def _open(self) -> None:
+        if not self.index_path.exists():
+            return
+
+        with open(self.index_path, "rb") as f:
+            magic, version, dim, codec = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or codec not in CODECS.values():
+                raise ValueError(f"{self.index_path} is not an embedding cache index")
+            if self.dim is not None and self.dim != dim:
+                raise ValueError(f"Cache has {dim} dimensions, expected {self.dim}")
+            self.dim = dim
+            self.quantization = next(name for name, value in CODECS.items() if value == codec)
+            digests = f.read()
+
+        row_bytes = self._row_dtype().itemsize
+        vectors_size = self.vectors_path.stat().st_size if self.vectors_path.exists() else 0
+        rows = min(len(digests) // DIGEST_SIZE, vectors_size // row_bytes)
+
+        # Drop any partially written tail so index record i always matches vector row i
+        if len(digests) != rows * DIGEST_SIZE:
+            os.truncate(self.index_path, HEADER.size + rows * DIGEST_SIZE)
+        if vectors_size != rows * row_bytes:
+            with open(self.vectors_path, "ab"):
+                pass
+            os.truncate(self.vectors_path, rows * row_bytes)
+
+        self._rows = {digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: i for i in range(rows)}
+
+    def _create(self, dim: int) -> None:
+        self.dim = dim
+        with open(self.index_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, dim, CODECS[self.quantization]))
+        open(self.vectors_path, "wb").close()
+
+    def _row_dtype(self) -> np.dtype:
+        if self.quantization == "int8":
+            return np.dtype([("scale", "<f4"), ("codes", "i1", (self.dim,))])
+        return np.dtype(("<f4", (self.dim,)))
+
+    def _encode(self, array: np.ndarray) -> bytes:
+        if self.quantization == "int8":
+            codes, scale = quantize_int8(array)
+            return scale.tobytes() + codes.tobytes()
+        return array.tobytes()
+
+    def _vectors(self) -> np.memmap:
+        if self._mmap is None or len(self._mmap) < len(self._rows):
+            if self._vectors_file is not None:
+                self._vectors_file.flush()
+            self._mmap = np.memmap(self.vectors_path, dtype=self._row_dtype(), mode="r", shape=(len(self._rows),))
+        return self._mmap
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return bytes.fromhex(key) in self._rows
+
+    def __getitem__(self, key: str) -> List[float]:
+        return self.get_array(key).tolist()
+
+    def __setitem__(self, key: str, vector: List[float]) -> None:
+        self.put_many([(key, vector)])
+
+    def get_array(self, key: str) -> np.ndarray:
+        """Return the cached vector: a read-only float32 view, or a dequantized copy."""
+        row = self._vectors()[self._rows[bytes.fromhex(key)]]
+        if self.quantization == "int8":
+            return row["codes"].astype(np.float32) * row["scale"]
+        return row
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]) -> int:
+        """Append (hash, vector) pairs that are not cached yet; return how many were added."""
+        added = 0
+        for key, vector in items:
+            digest = bytes.fromhex(key)
+            if digest in self._rows:
+                continue
+            array = np.asarray(vector, dtype=np.float32)
+            if self._vectors_file is None:
+                if not self.index_path.exists():
+                    self._create(self.dim or len(array))
+                self._vectors_file = open(self.vectors_path, "ab")
+                self._index_file = open(self.index_path, "ab")
+            if array.shape != (self.dim,):
+                raise ValueError(f"Expected a {self.dim}-dimensional vector, got shape {array.shape}")
+            # Vector before digest: a crash can leave an orphan row, never a dangling index record
+            self._vectors_file.write(self._encode(array))
+            self._index_file.write(digest)
+            self._rows[digest] = len(self._rows)
+            added += 1
+        return added
+
+    def flush(self) -> None:
+        """Persist appended entries to disk."""
+        for f in (self._vectors_file, self._index_file):
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        for f in (self._vectors_file, self._index_file):
+            if f is not None:
+                f.close()
+        self._vectors_file = self._index_file = None
+        self._mmap = None
+
+
+def migrate_json(json_path: Path, cache: EmbeddingCache) -> int:
+    """Copy every entry of a legacy ``embeddings_cache.json`` into ``cache``."""
+    with open(json_path, "r") as f:
+        legacy: Dict[str, List[float]] = json.load(f)
+    added = cache.put_many(legacy.items())
+    cache.flush()
+    return added
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate a JSON embedding cache to the binary format")
+    parser.add_argument("json_path", nargs="?", type=Path, default=LEGACY_JSON_PATH)
+    parser.add_argument("--out", type=Path, default=DEFAULT_CACHE_PATH, help="cache path without suffix")
+    parser.add_argument("--quantization", choices=list(CODECS), default="none", help="codec of a new cache")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.out, quantization=args.quantization)
+    added = migrate_json(args.json_path, cache)
+    cache.close()
+    print(f"Migrated {added} embeddings to {cache.vectors_path} ({len(cache)} total)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Which search indexes a query runs against, and the retrievers that reach them.
+
+One deployment serves several corpora. A query names them with
+``indexes`` or picks a ``tenant`` (which stands for its list of indexes);
+neither means ``AZURE_SEARCH_INDEX``. Only configured indexes are served:
+
+- ``SEARCH_INDEXES``: comma-separated indexes besides the default; with the
+  default, the only ones a query without a tenant may name
+- ``SEARCH_TENANTS``: JSON object, tenant -> list of indexes, e.g.
+  ``{"payments": ["payments-docs", "shared-kb"], "search": ["search-docs"]}``;
+  a tenant's queries may only name its own indexes
+
+With ``RETRIEVER_BACKEND=local`` the default index is ``LOCAL_INDEX_DIR`` and
+any other index ``<LOCAL_INDEX_ROOT>/<name>`` (default: next to ``LOCAL_INDEX_DIR``).
+
+``RetrieverPool`` holds at most ``SEARCH_CLIENT_POOL_SIZE`` retrievers,
+created on first use and closed once idle for ``SEARCH_CLIENT_IDLE_SECONDS``
+or when the least recently used one has to make room. The default index is
+never evicted, and a retriever is never closed while a search holds it. On
+Azure, every index's ``SearchClient`` shares one connection pool (they all
+talk to the same service), so a new index costs no new connections.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from retrievers import Retriever, retriever_source_from_env
+from search_schema import INDEX_NAME_RE
+
+
+class UnknownIndex(ValueError):
+    pass
+
+
+class IndexRouter:
+    def __init__(self, default: str, indexes: Sequence[str] = (), tenants: Optional[Dict[str, Sequence[str]]] = None):
+        self.default = default
+        self.tenants = {tenant: tuple(sorted(set(names))) for tenant, names in (tenants or {}).items()}
+        # What queries without a tenant may search; tenants' own indexes stay theirs
+        self.untenanted = tuple(sorted({default, *indexes}))
+        self.indexes = {*self.untenanted, *(name for names in self.tenants.values() for name in names)}
+        for name in self.indexes:
+            if not INDEX_NAME_RE.match(name):
+                raise ValueError(f"Invalid index name {name!r}")
+
+    def resolve(self, indexes: Optional[Sequence[str]] = None, tenant: Optional[str] = None) -> Tuple[str, ...]:
+        """The sorted indexes a query searches; raises ``UnknownIndex`` for anything not configured."""
+        if tenant is not None and tenant not in self.tenants:
+            raise UnknownIndex(f"Unknown tenant {tenant!r}")
+        allowed = self.tenants[tenant] if tenant is not None else self.untenanted
+        if not indexes:
+            return allowed if tenant is not None else (self.default,)
+        unknown = sorted(set(indexes) - set(allowed))
+        if unknown:
+            scope = f" for tenant {tenant!r}" if tenant is not None else ""
+            raise UnknownIndex(f"Unknown index{'es' if len(unknown) > 1 else ''}{scope}: {', '.join(unknown)}")
+        return tuple(sorted(set(indexes)))
+
+
+def router_from_env() -> IndexRouter:
+    return IndexRouter(
+        default=os.getenv("AZURE_SEARCH_INDEX") or "default",
+        indexes=[name.strip() for name in os.getenv("SEARCH_INDEXES", "").split(",") if name.strip()],
+        tenants=json.loads(os.getenv("SEARCH_TENANTS") or "{}"),
+    )
+
+
+@dataclass
+class _Pooled:
+    retriever: Retriever
+    last_used: float
+    in_use: int = 0
+
+
+class RetrieverPool:
+    def __init__(
+        self,
+        create: Callable[[str], Awaitable[Retriever]],
+        max_size: int = 8,
+        idle_seconds: float = 600.0,
+        pinned: Sequence[str] = (),
+        close: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.create = create
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.pinned = set(pinned)
+        self._close = close
+        self._entries: "OrderedDict[str, _Pooled]" = OrderedDict()
+        self._creating: Dict[str, asyncio.Future] = {}
+        self.created = 0
+        self.evicted = 0
+
+    async def _open(self, index: str) -> _Pooled:
+        entry = self._entries[index] = _Pooled(await self.create(index), time.monotonic())
+        self.created += 1
+        return entry
+
+    async def _acquire(self, index: str) -> _Pooled:
+        """The pooled entry of ``index``, counted as in use before anything can evict it."""
+        while True:
+            entry = self._entries.get(index)
+            if entry is not None:
+                entry.in_use += 1
+                self._entries.move_to_end(index)
+                return entry
+            # Concurrent first queries of an index share one creation, which completes
+            # (and is pooled) even if the query that started it is cancelled
+            opening = self._creating.get(index)
+            if opening is None:
+                opening = self._creating[index] = asyncio.ensure_future(self._open(index))
+                opening.add_done_callback(lambda _: self._creating.pop(index, None))
+            await asyncio.shield(opening)
+            # Look again: another lease may have evicted the new entry before this one resumed
+
+    @asynccontextmanager
+    async def lease(self, index: str) -> AsyncIterator[Retriever]:
+        """The retriever of ``index``, kept open until the block exits."""
+        entry = await self._acquire(index)
+        try:
+            yield entry.retriever
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            await self._evict()
+
+    async def _evict(self) -> None:
+        now = time.monotonic()
+        victims = []
+        size = len(self._entries)
+        for index, entry in self._entries.items():  # least recently used first
+            if index in self.pinned or entry.in_use:
+                continue
+            if size > self.max_size or now - entry.last_used > self.idle_seconds:
+                victims.append(index)
+                size -= 1
+        # Out of the pool before the first await, so no search can lease them while they close
+        closing = [self._entries.pop(index) for index in victims]
+        self.evicted += len(closing)
+        for entry in closing:
+            await entry.retriever.close()
+
+    async def warm_up(self, index: str) -> None:
+        async with self.lease(index) as retriever:
+            await retriever.warm_up()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "in_use": sum(1 for entry in self._entries.values() if entry.in_use),
+            "created": self.created,
+            "evicted": self.evicted,
+        }
+
+    async def close(self) -> None:
+        while self._entries:
+            _, entry = self._entries.popitem()
+            await entry.retriever.close()
+        if self._close is not None:
+            await self._close()
+
+
+def pool_from_env(default: str) -> RetrieverPool:
+    source = retriever_source_from_env(default)
+    return RetrieverPool(
+        source.retriever,
+        max_size=int(os.getenv("SEARCH_CLIENT_POOL_SIZE", "8")),
+        idle_seconds=float(os.getenv("SEARCH_CLIENT_IDLE_SECONDS", "600")),
+        pinned=[default],
+        close=source.close,
+    )
@@ -0,0 +1,101 @@
+"""Record of what the last ingestion run wrote to the index.
+
+For every source file (keyed by its path relative to the data root) the
+manifest keeps the MD5 of the raw file and, for every chunk document built
+from it, a hash of all of the document's fields except ``contentVector``.
+Comparing a fresh parse against it tells ``ingest_so`` which files can be
+skipped, which chunks must be re-uploaded and which chunk ids went stale.
+
+The manifest belongs to one index: loading it for a different index name
+yields an empty manifest, so switching indexes forces a full ingest. Loading
+it with a different chunker id keeps the chunk hashes but forgets the file
+hashes, so every file is re-chunked and only chunks that actually changed
+are re-uploaded (and ids the new chunker no longer produces are deleted).
+
+Streamed exports (``so_dump``) also leave a checkpoint per export: the byte
+offset to resume from and a fingerprint of the export's first bytes, so a
+checkpoint is never applied to a different export. Checkpoints are
+forgotten with the file hashes when the chunker changes.
+"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+MANIFEST_VERSION = 1
+DEFAULT_MANIFEST_PATH = Path(__file__).parent / "ingest_manifest.json"
+
+
+def hash_chunk(doc: Dict[str, Any]) -> str:
+    """Hash of a chunk document's searchable fields (the vector follows from ``content``)."""
+    fields = {k: v for k, v in doc.items() if k != "contentVector"}
+    return hashlib.md5(json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class FileEntry:
+    file_hash: str
+    chunks: Dict[str, str] = field(default_factory=dict)  # doc id -> chunk hash
+
+
+@dataclass
+class Checkpoint:
+    offset: int
+    fingerprint: str
+
+
+class IngestManifest:
+    def __init__(self, path: Path = DEFAULT_MANIFEST_PATH, index_name: str = "", chunker: str = ""):
+        self.path = Path(path)
+        self.index_name = index_name
+        self.chunker = chunker
+        self._files: Dict[str, FileEntry] = {}
+        self._checkpoints: Dict[str, Checkpoint] = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION and data.get("index") == index_name:
+                self._files = {key: FileEntry(**entry) for key, entry in data["files"].items()}
+                self._checkpoints = {key: Checkpoint(**c) for key, c in data.get("checkpoints", {}).items()}
+                if data.get("chunker") != chunker:
+                    for entry in self._files.values():
+                        entry.file_hash = ""
+                    self._checkpoints = {}
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def get(self, key: str) -> Optional[FileEntry]:
+        return self._files.get(key)
+
+    def files(self) -> List[str]:
+        return list(self._files)
+
+    def update(self, key: str, entry: FileEntry) -> None:
+        self._files[key] = entry
+
+    def remove(self, key: str) -> None:
+        self._files.pop(key, None)
+
+    def checkpoint(self, source: str, fingerprint: str) -> int:
+        """Offset to resume ``source`` from; 0 if it has none or it belongs to another export."""
+        checkpoint = self._checkpoints.get(source)
+        return checkpoint.offset if checkpoint is not None and checkpoint.fingerprint == fingerprint else 0
+
+    def set_checkpoint(self, source: str, offset: int, fingerprint: str) -> None:
+        self._checkpoints[source] = Checkpoint(offset, fingerprint)
+
+    def save(self) -> None:
+        data = {
+            "version": MANIFEST_VERSION,
+            "index": self.index_name,
+            "chunker": self.chunker,
+            "files": {key: vars(entry) for key, entry in sorted(self._files.items())},
+            "checkpoints": {key: vars(c) for key, c in sorted(self._checkpoints.items())},
+        }
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.path)
@@ -1,48 +1,82 @@
+import argparse
 import glob
 import hashlib
-import json
 import os
+import queue
 import re
+import socket
+import threading
 import time
-from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
-import tiktoken
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
+import httpx
 import yaml
 from azure.core.credentials import AzureKeyCredential
 from azure.core.pipeline.policies import RetryPolicy
 from azure.search.documents import SearchClient
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, RateLimitError
 from tqdm import tqdm
 from tenacity import retry, wait_exponential, stop_after_attempt
 
-
-# Global request throttle state
-request_timestamps = deque()
-
-
-def throttle_requests(max_rpm=60):
-    now = time.time()
-    window_start = now - 60
-    while request_timestamps and request_timestamps[0] < window_start:
-        request_timestamps.popleft()
-    if len(request_timestamps) >= max_rpm:
-        wait_time = 60 - (now - request_timestamps[0])
-        # print(f"Throttling to stay within {max_rpm} RPM. Sleeping {wait_time:.2f}s")
-        time.sleep(wait_time)
-    request_timestamps.append(time.time())
-
+from chunking import SNIPPET_TOKENS, chunk_text, prompt_fields
+from embedding_cache import LEGACY_JSON_PATH, EmbeddingCache, migrate_json
+from ingest_manifest import DEFAULT_MANIFEST_PATH, FileEntry, IngestManifest, hash_chunk
+from local_index import DEFAULT_INDEX_DIR, local_index_from_env
+from quantization import NATIVE_DIMENSIONS, dimensions_param, embed_dimensions
+from rate_limiter import limiter_for
+from so_dump import DEFAULT_MAX_OPEN, DEFAULT_WINDOW, DumpReader, DumpThread, OffsetTracker, fingerprint
+from tokens import DEFAULT_MODEL, count_batch_tokens
+from uploader import BulkUploader, pooled_transport, upload_concurrency, uploader_from_env
 
 load_dotenv(Path(__file__).parent.parent / ".env")
 
 DATA_ROOT = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "data_samples", "stack_overflow")
 )
-INDEX_NAME = os.environ["AZURE_SEARCH_INDEX"]
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "azure")
+LOCAL_INDEX_DIR = Path(os.getenv("LOCAL_INDEX_DIR", str(DEFAULT_INDEX_DIR)))
+INDEX_NAME = str(LOCAL_INDEX_DIR) if RETRIEVER_BACKEND == "local" else os.environ["AZURE_SEARCH_INDEX"]
 DEPLOYMENT_NAME = os.environ["AZURE_OPENAI_EMBED_DEPLOYMENT"]
-CACHE_FILE = Path(__file__).parent / "embeddings_cache.json"
+# EMBED_DIMENSIONS (``dimensions`` of text-embedding-3-*); must match the index's contentVector
+EMBED_PARAMS = dimensions_param()
+EMBED_DIMENSIONS = embed_dimensions()
+# Reduced-size vectors get their own cache; EMBED_CACHE_QUANTIZATION=int8 stores new caches as int8
+CACHE_PATH = Path(__file__).parent / (
+    "embeddings_cache" if EMBED_DIMENSIONS == NATIVE_DIMENSIONS else f"embeddings_cache_{EMBED_DIMENSIONS}"
+)
+CACHE_QUANTIZATION = os.getenv("EMBED_CACHE_QUANTIZATION", "none")
+MANIFEST_PATH = Path(os.getenv("INGEST_MANIFEST_PATH", str(DEFAULT_MANIFEST_PATH)))
+
+# Pipeline sizing and the Azure OpenAI quota it paces against
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "256"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+EMBED_BATCH_TOKENS = int(os.getenv("INGEST_EMBED_BATCH_TOKENS", "8000"))
+# How often a streamed export's resume offset is written to the manifest
+CHECKPOINT_SECONDS = float(os.getenv("INGEST_CHECKPOINT_SECONDS", "60"))
+
+CHUNK_MAX_TOKENS = 300
+CHUNK_OVERLAP = 50
+# Changing this (the chunking algorithm or the fields built per chunk) re-plans every file
+CHUNKER_ID = f"code-blocks/v2/{CHUNK_MAX_TOKENS}/{CHUNK_OVERLAP}/{SNIPPET_TOKENS}/{DEFAULT_MODEL}" + (
+    f"/{EMBED_DIMENSIONS}d" if EMBED_PARAMS else ""
+)
+
+# Comma-separated API base URLs whose answer caches must forget re-ingested chunks. An
+# http:// host is called at every address it resolves to, so the headless Service
+# (http://rag-api-headless:8000) reaches every replica
+CACHE_INVALIDATE_URLS = [u.strip() for u in os.getenv("RAG_CACHE_INVALIDATE_URLS", "").split(",") if u.strip()]
+# Shared secret the API expects in X-Cache-Invalidate-Token
+CACHE_INVALIDATE_TOKEN = os.getenv("RAG_CACHE_INVALIDATE_TOKEN", "")
+# Ids per invalidation request, and how long one replica may take to answer it
+CACHE_INVALIDATE_BATCH = int(os.getenv("RAG_CACHE_INVALIDATE_BATCH", "500"))
+CACHE_INVALIDATE_TIMEOUT = float(os.getenv("RAG_CACHE_INVALIDATE_TIMEOUT", "2"))
+
+# Paces embeddings requests against AZURE_OPENAI_EMBED_RPM / AZURE_OPENAI_EMBED_TPM (when set)
+embed_limiter = limiter_for(DEPLOYMENT_NAME, "AZURE_OPENAI_EMBED")
 
 # Configure retry policy for Azure Search
 search_retry_policy = RetryPolicy(
@@ -52,12 +86,18 @@ search_retry_policy = RetryPolicy(
     retry_on_status_codes=[429, 503, 504]
 )
 
-SEARCH_CLIENT = SearchClient(
-    endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
-    index_name=INDEX_NAME,
-    credential=AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"]),
-    retry_policy=search_retry_policy
-)
+if RETRIEVER_BACKEND == "local":
+    # Same upload/merge/delete surface as SearchClient, persisted on close()
+    SEARCH_CLIENT = local_index_from_env(LOCAL_INDEX_DIR)
+else:
+    SEARCH_CLIENT = SearchClient(
+        endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
+        index_name=INDEX_NAME,
+        credential=AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"]),
+        retry_policy=search_retry_policy,
+        # One connection per upload in flight, plus one for deletes
+        transport=pooled_transport(upload_concurrency() + 1),
+    )
 
 # No retry policy for OpenAI client - we'll use Tenacity instead
 client = AzureOpenAI(
@@ -69,19 +109,17 @@ client = AzureOpenAI(
 FRONT_MATTER_RE = re.compile(r"^---\n(.*?)\n---\n*", re.DOTALL)
 
 
-def load_cache() -> Dict[str, List[float]]:
-    if CACHE_FILE.exists():
-        try:
-            with open(CACHE_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return {}
-    return {}
+def load_cache() -> EmbeddingCache:
+    cache = EmbeddingCache(CACHE_PATH, dim=EMBED_DIMENSIONS, quantization=CACHE_QUANTIZATION)
+    # One-shot migration from the legacy JSON cache (full-size ada-002 vectors)
+    if len(cache) == 0 and LEGACY_JSON_PATH.exists() and EMBED_DIMENSIONS == NATIVE_DIMENSIONS:
+        added = migrate_json(LEGACY_JSON_PATH, cache)
+        print(f"Migrated {added} cached embeddings from {LEGACY_JSON_PATH.name}")
+    return cache
 
 
-def save_cache(cache: Dict[str, List[float]]) -> None:
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache, f)
+def save_cache(cache: EmbeddingCache) -> None:
+    cache.close()
 
 
 def hash_text(text: str) -> str:
@@ -107,77 +145,22 @@ def chunk_preserve_code_tokens(text: str, max_tokens: int = 300, overlap: int =
     Split text into chunks capped at max_tokens using tiktoken.
     Preserves code blocks as atomic units (never split inside ```...```).
     """
-    enc = tiktoken.encoding_for_model(model)
-    parts = []
-    buffer_tokens = []
-
-    # Split text into alternating text + code block segments
-    segments = re.split(r"(```.*?```)", text, flags=re.DOTALL)
-
-    for seg in segments:
-        seg_tokens = enc.encode(seg)
-        # If adding this segment would overflow max_tokens, flush buffer
-        if len(buffer_tokens) + len(seg_tokens) > max_tokens:
-            if buffer_tokens:
-                parts.append(enc.decode(buffer_tokens))
-            # Start new buffer, keep some overlap
-            buffer_tokens = buffer_tokens[-overlap:] + seg_tokens
-            # If still too long (e.g. single giant code block), force split
-            while len(buffer_tokens) > max_tokens:
-                parts.append(enc.decode(buffer_tokens[:max_tokens]))
-                buffer_tokens = buffer_tokens[max_tokens - overlap:]
-        else:
-            buffer_tokens.extend(seg_tokens)
-
-    if buffer_tokens:
-        parts.append(enc.decode(buffer_tokens))
-
-    return [p.strip() for p in parts if p.strip()]
+    return chunk_text(text, max_tokens=max_tokens, overlap=overlap, model=model)
 
 
 @retry(wait=wait_exponential(multiplier=1, min=2, max=15), stop=stop_after_attempt(5))
-def embed_batch_with_tenacity(texts: List[str]) -> List[List[float]]:
+def embed_batch_with_tenacity(texts: List[str], tokens: Optional[int] = None) -> List[List[float]]:
     """Use Tenacity for retry logic on OpenAI embeddings"""
-    throttle_requests()  # Apply throttling before each attempt
-    resp = client.embeddings.create(input=texts, model=DEPLOYMENT_NAME)
-    return [d.embedding for d in resp.data]
-
-
-def embed_with_retry_batch(texts: List[str], batch_size: int = 2) -> List[List[float]]:
-    """Process texts in batches with Tenacity retry logic"""
-    out = []
-    for i in range(0, len(texts), batch_size):
-        chunk = texts[i:i + batch_size]
-        embeddings = embed_batch_with_tenacity(chunk)
-        out.extend(embeddings)
-        time.sleep(0.1)  # Small delay between batches
-    return out
-
-
-def get_embeddings_with_cache(texts: List[str], cache: Dict[str, List[float]]) -> List[List[float]]:
-    embeddings = []
-    texts_to_embed = []
-    text_indices = []
-    
-    for i, text in enumerate(texts):
-        text_hash = hash_text(text)
-        if text_hash in cache:
-            embeddings.append(cache[text_hash])
-        else:
-            texts_to_embed.append(text)
-            text_indices.append(i)
-    
-    if texts_to_embed:
-        new_embeddings = embed_with_retry_batch(texts_to_embed)
-        
-        for i, (text, embedding) in enumerate(zip(texts_to_embed, new_embeddings)):
-            text_hash = hash_text(text)
-            cache[text_hash] = embedding
-            embeddings.insert(text_indices[i], embedding)
-        
-        time.sleep(0.5)  # Polite delay between batches
-    
-    return embeddings
+    if tokens is None:
+        tokens = count_batch_tokens(texts)
+    embed_limiter.acquire(tokens)  # Apply throttling before each attempt
+    try:
+        raw = client.embeddings.with_raw_response.create(input=texts, model=DEPLOYMENT_NAME, **EMBED_PARAMS)
+    except RateLimitError as e:
+        embed_limiter.update_from_headers(e.response.headers)
+        raise
+    embed_limiter.update_from_headers(raw.headers)
+    return [d.embedding for d in raw.parse().data]
 
 
 def make_doc_id(slug: str, idx: int) -> str:
@@ -189,9 +172,11 @@ def slug_from_path(p: str) -> str:
     return base.lower()
 
 
-def to_docs(path: str, cache: Dict[str, List[float]]) -> List[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        raw = f.read()
+def chunk_docs(path: str, raw: Optional[str] = None, slug: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Parse and chunk one thread into index documents that still lack ``contentVector``."""
+    if raw is None:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = f.read()
     meta, body = parse_front_matter(raw)
 
     assert meta.get("source") and meta.get(
@@ -201,19 +186,16 @@ def to_docs(path: str, cache: Dict[str, List[float]]) -> List[Dict[str, Any]]:
 
     body = re.sub(r"^# RAW_THREAD\s*\n", "", body.strip())
 
-    chunks = chunk_preserve_code_tokens(body, max_tokens=300, overlap=50)
-    print(f"{path} → {len(chunks)} chunks")
-    slug = slug_from_path(path)
-
-    vectors = get_embeddings_with_cache(chunks, cache)
+    chunks = chunk_preserve_code_tokens(body, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP)
+    slug = slug or slug_from_path(path)
 
     docs = []
-    for i, (txt, vec) in enumerate(zip(chunks, vectors)):
+    for i, (txt, prompt) in enumerate(zip(chunks, prompt_fields(chunks))):
         docs.append(
             {
                 "id": make_doc_id(slug, i),
                 "content": txt,
-                "contentVector": vec,
+                **prompt,
                 "source": meta.get("source", ""),
                 "title": meta.get("title", ""),
                 "topics": meta.get("topics") or meta.get("topic") or [],
@@ -227,32 +209,582 @@ def to_docs(path: str, cache: Dict[str, List[float]]) -> List[Dict[str, Any]]:
     return docs
 
 
-def upload_batch(docs: List[Dict[str, Any]]) -> None:
-    result = SEARCH_CLIENT.upload_documents(docs)
+def send_documents(docs: List[Dict[str, Any]]) -> List[Any]:
+    if RETRIEVER_BACKEND == "local":
+        return SEARCH_CLIENT.merge_or_upload_documents(docs)
+    # BulkUploader retries the failed keys and backs off on throttling itself
+    return SEARCH_CLIENT.merge_or_upload_documents(docs, retry_total=0)
+
+
+def make_uploader() -> BulkUploader:
+    # LocalVectorIndex is not thread-safe: one batch at a time, sent from the upload stage
+    return uploader_from_env(send_documents, max_concurrency=1 if RETRIEVER_BACKEND == "local" else None)
+
+
+def delete_chunks(doc_ids: List[str]) -> None:
+    result = SEARCH_CLIENT.delete_documents([{"id": doc_id} for doc_id in doc_ids])
     failed = [r for r in result if not r.succeeded]
     if failed:
-        raise RuntimeError(f"Failed uploads: {failed[:3]} ... total={len(failed)}")
+        raise RuntimeError(f"Failed deletes: {failed[:3]} ... total={len(failed)}")
+    notify_reingested(doc_ids)
 
 
-def main() -> None:
-    cache = load_cache()
-    
-    paths = iter_md_files()
-    print(f"Found {len(paths)} .md files under {DATA_ROOT}")
-    total_docs = 0
-    
-    for p in tqdm(paths, desc="Ingesting"):
+def invalidation_targets(base_url: str) -> List[str]:
+    """``base_url`` once per address its host resolves to (one per pod behind a headless Service)."""
+    url = httpx.URL(base_url)
+    if url.scheme != "http":
+        # Certificates name the host, not its addresses
+        return [base_url]
+    try:
+        infos = socket.getaddrinfo(url.host, url.port or 80, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        return [base_url]
+    return [str(url.copy_with(host=address)) for address in sorted({info[4][0] for info in infos})]
+
+
+class CacheInvalidator:
+    """Sends re-ingested chunk ids to the API replicas from a background thread.
+
+    Ids queue up while a request is out and go in batches of ``batch_size``, so
+    a slow or unreachable replica delays invalidation, never the upload stage.
+    """
+
+    def __init__(self, urls: List[str], token: str, batch_size: int = 500, timeout: float = 2.0):
+        self.urls = urls
+        self.headers = {"X-Cache-Invalidate-Token": token}
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._pending: Dict[str, None] = {}  # insertion-ordered set
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, doc_ids: List[str]) -> None:
+        if not self.urls or not doc_ids:
+            return
+        with self._cond:
+            self._pending.update(dict.fromkeys(doc_ids))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        with httpx.Client(timeout=self.timeout, headers=self.headers) as http:
+            while True:
+                with self._cond:
+                    while not self._pending and not self._closed:
+                        self._cond.wait()
+                    if not self._pending:
+                        return
+                    batch = list(self._pending)[:self.batch_size]
+                    for doc_id in batch:
+                        del self._pending[doc_id]
+                self._send(http, batch)
+
+    def _send(self, http: httpx.Client, doc_ids: List[str]) -> None:
+        for base_url in self.urls:
+            for target in invalidation_targets(base_url):
+                try:
+                    http.post(f"{target.rstrip('/')}/api/v1/cache/invalidate", json={"ids": doc_ids}).raise_for_status()
+                except httpx.HTTPError as e:
+                    print(f"Error invalidating {len(doc_ids)} cached chunk ids at {target}: {e}")
+
+    def close(self) -> None:
+        """Send what is still queued and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+
+cache_invalidator = CacheInvalidator(
+    CACHE_INVALIDATE_URLS, CACHE_INVALIDATE_TOKEN, CACHE_INVALIDATE_BATCH, CACHE_INVALIDATE_TIMEOUT
+)
+
+
+def notify_reingested(doc_ids: List[str]) -> None:
+    """Queue ``doc_ids`` for the API replicas to drop from their caches (see ``CacheInvalidator``)."""
+    cache_invalidator.add(doc_ids)
+
+
+# ==== Change detection ====
+# The manifest remembers each file's hash and the hash of every chunk built
+# from it. Unchanged files are skipped before chunking, only new or changed
+# chunks are embedded and uploaded, and chunk ids that a file no longer
+# produces (e.g. after it shrank) are deleted. Threads streamed from an
+# export (--dump) are tracked the same way, keyed "<export>#<question id>"
+# and hashed as rendered.
+
+# A Markdown file path, or a thread streamed from an export
+Source = Union[str, DumpThread]
+
+
+def manifest_key(path: str) -> str:
+    return os.path.relpath(path, DATA_ROOT)
+
+
+@dataclass
+class FileDelta:
+    """What re-ingesting one source file changes in the index."""
+    key: str
+    entry: FileEntry
+    upserts: List[Dict[str, Any]]
+    new: int = 0
+    unchanged: int = 0
+    stale_ids: List[str] = field(default_factory=list)
+    pending: int = 0
+    failed: bool = False
+    offset: Optional[int] = None  # position in a streamed export
+
+    @property
+    def changed(self) -> int:
+        return len(self.upserts) - self.new
+
+
+def plan_file(path: str, manifest: IngestManifest, full: bool = False) -> Optional[FileDelta]:
+    """Diff one file against the manifest; ``None`` if its bytes are unchanged."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return plan_source(manifest_key(path), data, manifest, full, path=path)
+
+
+def plan_thread(thread: DumpThread, manifest: IngestManifest, full: bool = False) -> Optional[FileDelta]:
+    delta = plan_source(thread.key, thread.text.encode("utf-8"), manifest, full, path=thread.key, slug=thread.slug)
+    if delta is not None:
+        delta.offset = thread.offset
+    return delta
+
+
+def plan(source: Source, manifest: IngestManifest, full: bool = False) -> Optional[FileDelta]:
+    if isinstance(source, DumpThread):
+        return plan_thread(source, manifest, full)
+    return plan_file(source, manifest, full)
+
+
+def plan_source(
+    key: str, data: bytes, manifest: IngestManifest, full: bool, path: str, slug: Optional[str] = None
+) -> Optional[FileDelta]:
+    file_hash = hashlib.md5(data).hexdigest()
+    previous = manifest.get(key)
+    if previous is not None and previous.file_hash == file_hash and not full:
+        return None
+
+    docs = chunk_docs(path, data.decode("utf-8"), slug)
+    entry = FileEntry(file_hash, {doc["id"]: hash_chunk(doc) for doc in docs})
+    old = previous.chunks if previous is not None else {}
+    upserts = [doc for doc in docs if full or old.get(doc["id"]) != entry.chunks[doc["id"]]]
+    return FileDelta(
+        key,
+        entry,
+        upserts,
+        new=sum(1 for doc in upserts if doc["id"] not in old),
+        unchanged=len(docs) - len(upserts),
+        stale_ids=[doc_id for doc_id in old if doc_id not in entry.chunks],
+    )
+
+
+def removed_files(paths: List[str], manifest: IngestManifest) -> List[str]:
+    """Manifest keys whose source file no longer exists (streamed threads are never removed)."""
+    current = {manifest_key(p) for p in paths}
+    return [key for key in manifest.files() if key.endswith(".md") and key not in current]
+
+
+def delete_removed(paths: List[str], manifest: IngestManifest) -> int:
+    """Delete the chunks of files that disappeared; a file whose delete fails stays in the manifest."""
+    deleted = 0
+    for key in removed_files(paths, manifest):
+        doc_ids = list(manifest.get(key).chunks)
         try:
-            docs = to_docs(p, cache)
-            upload_batch(docs)
-            total_docs += len(docs)
-            time.sleep(5)  # Rate limiting between files
+            delete_chunks(doc_ids)
         except Exception as e:
-            print(f"Error processing {p}: {e}")
+            # Kept, so the next run tries again
+            print(f"Error deleting {len(doc_ids)} chunks of removed file {key}: {e}")
+            continue
+        deleted += len(doc_ids)
+        manifest.remove(key)
+    return deleted
+
+
+# ==== Pipeline ====
+# parse/chunk workers -> chunk queue -> embed stage -> doc queue -> upload stage
+# Queues are bounded so a slow downstream stage applies back-pressure instead of
+# letting chunks and vectors pile up in memory.
+
+_DONE = object()
+
+
+@dataclass
+class PendingChunk:
+    doc: Dict[str, Any]
+    text_hash: str
+    tokens: int
+    file: FileDelta
+
+
+@dataclass
+class IngestStats:
+    files: int = 0
+    skipped_files: int = 0
+    failed_files: int = 0
+    unchanged: int = 0
+    embedded: int = 0
+    cached: int = 0
+    failed_chunks: int = 0
+    uploaded: int = 0
+    failed_uploads: int = 0
+    upload_requests: int = 0
+    throttled: int = 0
+    retried_uploads: int = 0
+    deleted: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **counts: int) -> None:
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+def parse_stage(
+    paths: "queue.Queue",
+    chunks: "queue.Queue",
+    manifest: IngestManifest,
+    full: bool,
+    stats: IngestStats,
+    progress: tqdm,
+    tracker: Optional[OffsetTracker] = None,
+) -> None:
+    while True:
+        path = paths.get()
+        if path is _DONE:
+            chunks.put(_DONE)
+            return
+        try:
+            delta = plan(path, manifest, full)
+            if delta is None:
+                if tracker is not None:
+                    tracker.done(path.offset)
+                stats.add(skipped_files=1)
+                progress.update(1)
+                continue
+            delta.pending = len(delta.upserts)
+            if not delta.upserts:
+                # Nothing to embed; the upload stage still deletes stale ids and records the file
+                chunks.put(delta)
+            for doc in delta.upserts:
+                chunks.put(PendingChunk(doc, hash_text(doc["content"]), doc["token_count"], delta))
+            stats.add(files=1, unchanged=delta.unchanged)
+        except Exception as e:
+            key = path.key if isinstance(path, DumpThread) else path
+            print(f"Error processing {key}: {e}")
+            stats.add(failed_files=1)
+            if tracker is not None:
+                # A parse error repeats on every run: don't hold the checkpoint back for it
+                tracker.done(path.offset)
+        progress.update(1)
+
+
+def embed_stage(chunks: "queue.Queue", docs: "queue.Queue", cache: EmbeddingCache, producers: int, stats: IngestStats) -> None:
+    """Pack chunks from many files into large embedding requests."""
+    batch: List[PendingChunk] = []
+    batch_tokens = 0
+
+    def flush() -> None:
+        nonlocal batch, batch_tokens
+        # De-duplicate identical chunk texts inside the batch
+        unique: Dict[str, PendingChunk] = {}
+        for item in batch:
+            unique.setdefault(item.text_hash, item)
+        try:
+            vectors = embed_batch_with_tenacity([i.doc["content"] for i in unique.values()], tokens=batch_tokens)
+            cache.put_many(zip(unique, vectors))
+            cache.flush()
+            stats.add(embedded=len(unique))
+            for item in batch:
+                item.doc["contentVector"] = cache[item.text_hash]
+                docs.put(item)
+        except Exception as e:
+            print(f"Error embedding batch of {len(batch)} chunks: {e}")
+            stats.add(failed_chunks=len(batch))
+            for item in batch:
+                # Still forwarded so the upload stage can account for the file
+                item.file.failed = True
+                docs.put(item)
+        batch, batch_tokens = [], 0
+
+    finished = 0
+    while finished < producers:
+        try:
+            item = chunks.get(timeout=0.5)
+        except queue.Empty:
+            # Producers are slow; don't hold a partial batch hostage
+            if batch:
+                flush()
             continue
-    
-    save_cache(cache)
-    print(f"Uploaded {total_docs} chunks to index '{INDEX_NAME}'")
+        if item is _DONE:
+            finished += 1
+            continue
+        if isinstance(item, FileDelta):
+            docs.put(item)
+            continue
+        if item.text_hash in cache:
+            item.doc["contentVector"] = cache[item.text_hash]
+            stats.add(cached=1)
+            docs.put(item)
+            continue
+        if batch and (len(batch) >= EMBED_BATCH_SIZE or batch_tokens + item.tokens > EMBED_BATCH_TOKENS):
+            flush()
+        batch.append(item)
+        batch_tokens += item.tokens
+
+    if batch:
+        flush()
+    docs.put(_DONE)
+
+
+def upload_stage(
+    docs: "queue.Queue",
+    manifest: IngestManifest,
+    stats: IngestStats,
+    tracker: Optional[OffsetTracker] = None,
+    checkpoint: Optional[Callable[[], None]] = None,
+) -> None:
+    """Upload documents through a ``BulkUploader`` and record finished files in the manifest."""
+    uploader = make_uploader()
+    next_checkpoint = time.monotonic() + CHECKPOINT_SECONDS
+
+    def finish(delta: FileDelta) -> None:
+        nonlocal next_checkpoint
+        if delta.failed:
+            # Left out of the manifest, so the next run retries the whole file; a streamed
+            # thread also keeps the checkpoint at or before its offset
+            return
+        if delta.stale_ids:
+            try:
+                delete_chunks(delta.stale_ids)
+                stats.add(deleted=len(delta.stale_ids))
+            except Exception as e:
+                print(f"Error deleting {len(delta.stale_ids)} stale chunks of {delta.key}: {e}")
+                return
+        manifest.update(delta.key, delta.entry)
+        if tracker is not None:
+            tracker.done(delta.offset)
+        if checkpoint is not None and time.monotonic() >= next_checkpoint:
+            # Written from this thread, the only one that updates the manifest
+            checkpoint()
+            next_checkpoint = time.monotonic() + CHECKPOINT_SECONDS
+
+    def done(delta: FileDelta) -> None:
+        delta.pending -= 1
+        if delta.pending == 0:
+            finish(delta)
+
+    def record(outcomes: List[Tuple[PendingChunk, Optional[str]]]) -> None:
+        """Account for uploads the uploader has finished with (called on this thread only)."""
+        succeeded = [item.doc["id"] for item, error in outcomes if error is None]
+        stats.add(uploaded=len(succeeded), failed_uploads=len(outcomes) - len(succeeded))
+        if succeeded:
+            notify_reingested(succeeded)
+        for item, error in outcomes:
+            if error is not None and not item.file.failed:
+                print(f"Error uploading {item.doc['id']} of {item.file.key}: {error}")
+                item.file.failed = True
+            done(item.file)
+
+    while True:
+        try:
+            item = docs.get(timeout=0.5)
+        except queue.Empty:
+            # Upstream is slow; don't hold a partial batch hostage
+            uploader.flush()
+            record(uploader.drain())
+            continue
+        if item is _DONE:
+            break
+        if isinstance(item, FileDelta):
+            finish(item)
+        elif item.file.failed:
+            done(item.file)
+        else:
+            uploader.add(item.doc, item)
+        record(uploader.drain())
+    record(uploader.close())
+    stats.add(upload_requests=uploader.requests, throttled=uploader.throttled, retried_uploads=uploader.retried)
+
+
+def feed_stage(sources: Iterable[Source], paths: "queue.Queue", workers: int) -> None:
+    try:
+        for source in sources:
+            paths.put(source)
+    except Exception as e:
+        print(f"Error reading sources: {e}")
+    finally:
+        for _ in range(workers):
+            paths.put(_DONE)
+
+
+def run_pipeline(
+    sources: Iterable[Source],
+    cache: EmbeddingCache,
+    manifest: IngestManifest,
+    full: bool = False,
+    workers: int = PARSE_WORKERS,
+    tracker: Optional[OffsetTracker] = None,
+    checkpoint: Optional[Callable[[], None]] = None,
+) -> IngestStats:
+    """Ingest ``sources``: a list of Markdown paths, or a stream of threads (read as the pipeline drains)."""
+    stats = IngestStats()
+    # Bounded, so a streamed export is read no faster than it is ingested
+    path_q: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+    chunk_q: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+    doc_q: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+
+    total = len(sources) if isinstance(sources, list) else None
+    with tqdm(total=total, desc="Ingesting") as progress:
+        threads = [threading.Thread(target=feed_stage, args=(sources, path_q, workers), daemon=True)]
+        threads += [
+            threading.Thread(
+                target=parse_stage, args=(path_q, chunk_q, manifest, full, stats, progress, tracker), daemon=True
+            )
+            for _ in range(workers)
+        ]
+        threads.append(threading.Thread(target=embed_stage, args=(chunk_q, doc_q, cache, workers, stats), daemon=True))
+        threads.append(
+            threading.Thread(target=upload_stage, args=(doc_q, manifest, stats, tracker, checkpoint), daemon=True)
+        )
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return stats
+
+
+def dry_run(sources: Iterable[Source], manifest: IngestManifest, full: bool = False, removed: bool = True) -> None:
+    """Print the delta a real run would apply, without embedding or touching the index."""
+    skipped = new = changed = unchanged = stale = total = 0
+    paths = []
+    for source in sources:
+        total += 1
+        if not isinstance(source, DumpThread):
+            paths.append(source)
+        delta = plan(source, manifest, full)
+        if delta is None:
+            skipped += 1
+            continue
+        if delta.upserts or delta.stale_ids:
+            print(f"  {delta.key}: +{delta.new} new, ~{delta.changed} changed, -{len(delta.stale_ids)} stale")
+        new += delta.new
+        changed += delta.changed
+        unchanged += delta.unchanged
+        stale += len(delta.stale_ids)
+    removed = removed_files(paths, manifest) if removed else []
+    for key in removed:
+        print(f"  {key}: removed, -{len(manifest.get(key).chunks)} stale")
+        stale += len(manifest.get(key).chunks)
+    print(
+        f"Dry run: {total - skipped} changed files, {skipped} unchanged, {len(removed)} removed; "
+        f"{new} new + {changed} changed chunks to upload, {unchanged} unchanged, {stale} stale to delete"
+    )
+
+
+def ingest_dump(args: argparse.Namespace, manifest: IngestManifest) -> None:
+    """Stream threads from a Stack Exchange export, resuming from the manifest's checkpoint."""
+    export = Path(args.dump)
+    export_fingerprint = fingerprint(export)
+    start = 0 if args.restart or args.full else manifest.checkpoint(export.name, export_fingerprint)
+    reader = DumpReader(
+        export,
+        start=start,
+        window=args.window,
+        max_open=args.max_open,
+        tags=[t for t in args.tags.split(",") if t] if args.tags else None,
+        min_answers=args.min_answers,
+        site=args.site,
+    )
+    print(f"Streaming {export} from byte {start:,} ({len(manifest)} threads/files in manifest)")
+
+    if args.dry_run:
+        dry_run(reader, manifest, args.full, removed=False)
+        return
+
+    def checkpoint() -> None:
+        offset = reader.tracker.checkpoint
+        if RETRIEVER_BACKEND == "local":
+            # The local index only persists on save(); it must hold everything before the checkpoint
+            SEARCH_CLIENT.save()
+        manifest.set_checkpoint(export.name, offset, export_fingerprint)
+        manifest.save()
+
+    cache = load_cache()
+    try:
+        stats = run_pipeline(reader, cache, manifest, args.full, tracker=reader.tracker, checkpoint=checkpoint)
+    finally:
+        save_cache(cache)
+        SEARCH_CLIENT.close()
+        checkpoint()
+        cache_invalidator.close()
+
+    print(
+        f"Read {reader.posts:,} posts: {reader.threads:,} threads, {reader.filtered:,} filtered, "
+        f"{reader.orphans:,} orphaned answers, {reader.bad_lines:,} unparsable lines; "
+        f"checkpoint at byte {reader.tracker.checkpoint:,}"
+    )
+    report(stats)
+
+
+def report(stats: IngestStats) -> None:
+    print(
+        f"Uploaded {stats.uploaded} chunks to index '{INDEX_NAME}' "
+        f"({stats.embedded} embedded, {stats.cached} from cache, {stats.unchanged} unchanged, "
+        f"{stats.deleted} stale deleted; {stats.skipped_files} files unchanged; "
+        f"{stats.failed_files} files / {stats.failed_chunks} chunks / {stats.failed_uploads} uploads failed)"
+    )
+    if stats.upload_requests:
+        print(
+            f"Upload requests: {stats.upload_requests} ({stats.throttled} throttled, "
+            f"{stats.retried_uploads} chunk uploads retried)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ingest the Stack Overflow samples into the search index.")
+    parser.add_argument("--dry-run", action="store_true", help="report the planned delta and exit")
+    parser.add_argument("--full", action="store_true", help="re-upload every chunk, ignoring the manifest")
+    dump = parser.add_argument_group("streamed export", "ingest a Stack Exchange Posts.xml / JSONL export (.gz ok)")
+    dump.add_argument("--dump", help="export to stream instead of the Markdown samples")
+    dump.add_argument("--restart", action="store_true", help="ignore the checkpoint and read from the start")
+    dump.add_argument("--tags", help="comma-separated: only questions with any of these tags")
+    dump.add_argument("--min-answers", type=int, default=1, help="skip threads with fewer answers")
+    dump.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="posts to wait for a question's answers")
+    dump.add_argument("--max-open", type=int, default=DEFAULT_MAX_OPEN, help="threads held open at once")
+    dump.add_argument("--site", default="stackoverflow.com", help="site the export comes from, for source links")
+    args = parser.parse_args()
+
+    manifest = IngestManifest(MANIFEST_PATH, INDEX_NAME, CHUNKER_ID)
+    if args.dump:
+        ingest_dump(args, manifest)
+        return
+
+    paths = iter_md_files()
+    print(f"Found {len(paths)} .md files under {DATA_ROOT} ({len(manifest)} in manifest)")
+
+    if args.dry_run:
+        dry_run(paths, manifest, args.full)
+        return
+
+    cache = load_cache()
+    try:
+        deleted = delete_removed(paths, manifest)
+        stats = run_pipeline(paths, cache, manifest, args.full)
+        stats.deleted += deleted
+    finally:
+        save_cache(cache)
+        SEARCH_CLIENT.close()
+        manifest.save()
+        cache_invalidator.close()
+
+    report(stats)
 
 
 if __name__ == "__main__":
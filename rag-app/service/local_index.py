@@ -0,0 +1,424 @@
+"""In-process vector index: an offline / small-corpus alternative to Azure AI Search.
+
+An index directory holds:
+
+- ``vectors.npy``: L2-normalised float32 matrix, one row per chunk, opened with
+  ``mmap_mode="r"`` so startup does not read it into memory
+- ``docs.json``: the chunk fields (everything except ``contentVector``), row-aligned
+- ``hnsw.bin``: optional HNSW graph (requires the ``hnswlib`` extra), built on
+  ``save()`` once the index holds at least ``hnsw_min_docs`` chunks
+- ``vectors.int8.npy`` + ``scales.npy`` or ``vectors.binary.npy``: quantized
+  codes of the same rows, written on ``save()`` by an index opened with
+  ``quantization="int8"`` / ``"binary"``
+
+Queries are answered by exact cosine similarity (one matrix-vector product)
+unless a current HNSW graph exists; a ``topics`` filter always searches the
+matching rows exactly. With quantization, that scan runs over the in-memory
+codes instead and only the best ``top * rescore_factor`` rows are rescored
+against the memory-mapped float32 vectors, so the full matrix is never paged
+in. Codes missing on disk (an index saved without quantization) are built on
+first search. ``keyword_search`` ranks ``title`` + ``content`` with BM25 over
+an inverted index built on first use, and multiplies the score of chunks
+tagged with any of ``boost_tags`` by ``TAG_BOOST``, like the index's tag
+scoring profile. The write methods mirror the subset of
+``SearchClient`` that ingestion uses (``upload_documents``,
+``merge_or_upload_documents``, ``delete_documents``); changes are kept in
+memory until ``save()``/``close()``.
+"""
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from quantization import binary_scores, check_quantization, int8_scores, quantize
+
+try:
+    import hnswlib
+except ImportError:  # optional: exact search only
+    hnswlib = None
+
+DEFAULT_INDEX_DIR = Path(__file__).parent / "local_index"
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+
+# BM25 parameters (Azure AI Search defaults) and the tag scoring profile's boost
+BM25_K1 = 1.2
+BM25_B = 0.75
+TAG_BOOST = 5.0
+
+WORD_RE = re.compile(r"\w+")
+
+
+def terms(text: str) -> List[str]:
+    return WORD_RE.findall(text.lower())
+
+
+@dataclass
+class LocalIndexingResult:
+    """Shape-compatible with ``azure.search.documents.models.IndexingResult``."""
+    key: str
+    succeeded: bool = True
+    status_code: int = 200
+    error_message: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class TextIndex:
+    """BM25 postings (term -> rows, term frequencies), document lengths and topic -> rows."""
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    doc_lengths: np.ndarray
+    topic_rows: Dict[str, np.ndarray]
+
+
+CODE_FILES = {"int8": ("vectors.int8.npy", "scales.npy"), "binary": ("vectors.binary.npy",)}
+
+
+class LocalVectorIndex:
+    def __init__(
+        self,
+        path: Path = DEFAULT_INDEX_DIR,
+        hnsw_min_docs: int = 50_000,
+        ef_search: int = 128,
+        quantization: str = "none",
+        rescore_factor: int = 4,
+    ):
+        self.path = Path(path)
+        self.hnsw_min_docs = hnsw_min_docs
+        self.ef_search = ef_search
+        self.quantization = check_quantization(quantization)
+        self.rescore_factor = rescore_factor
+        self.dim: Optional[int] = None
+        self._vectors: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+        self._docs: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._hnsw = None
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._dirty = False
+        # Built on first text or topic query, from a worker thread; replaced as a whole
+        self._text: Optional[TextIndex] = None
+        self._text_lock = threading.Lock()
+        self._load()
+
+    # ---- persistence ----
+
+    @classmethod
+    def create(cls, path: Path, dim: int) -> "LocalVectorIndex":
+        """Create (or reset) an empty index directory for ``dim``-dimensional vectors."""
+        index = cls(path)
+        index.dim = dim
+        index._vectors = np.zeros((0, dim), dtype=np.float32)
+        index._docs, index._rows, index._hnsw = [], {}, None
+        index._dirty = True
+        index.save()
+        return index
+
+    def _load(self) -> None:
+        vectors_path = self.path / "vectors.npy"
+        if not vectors_path.exists():
+            return
+        self._vectors = np.load(vectors_path, mmap_mode="r")
+        self.dim = self._vectors.shape[1]
+        with open(self.path / "docs.json", "r", encoding="utf-8") as f:
+            self._docs = json.load(f)
+        self._rows = {doc["id"]: i for i, doc in enumerate(self._docs)}
+        self._codes = self._scales = None
+        if self.quantization != "none":
+            paths = [self.path / name for name in CODE_FILES[self.quantization]]
+            if all(p.exists() for p in paths):
+                arrays = [np.load(p) for p in paths]
+                if all(len(a) == len(self._docs) for a in arrays):
+                    self._codes, self._scales = arrays[0], arrays[1] if len(arrays) > 1 else None
+        hnsw_path = self.path / "hnsw.bin"
+        if hnswlib is not None and hnsw_path.exists() and len(self._docs):
+            self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+            self._hnsw.load_index(str(hnsw_path), max_elements=len(self._docs))
+            self._hnsw.set_ef(self.ef_search)
+
+    def save(self) -> None:
+        """Write the index atomically (temp files + rename), then re-map it read-only."""
+        if not self._dirty:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        vectors = np.ascontiguousarray(self._vectors, dtype=np.float32)
+        tmp_vectors = self.path / "vectors.npy.tmp"
+        with open(tmp_vectors, "wb") as f:
+            np.save(f, vectors)
+        tmp_docs = self.path / "docs.json.tmp"
+        with open(tmp_docs, "w", encoding="utf-8") as f:
+            json.dump(self._docs, f)
+
+        hnsw_path = self.path / "hnsw.bin"
+        if hnswlib is not None and len(self._docs) >= self.hnsw_min_docs:
+            graph = hnswlib.Index(space="ip", dim=self.dim)
+            graph.init_index(max_elements=len(self._docs), M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+            graph.add_items(vectors, np.arange(len(self._docs)))
+            graph.save_index(str(hnsw_path) + ".tmp")
+            os.replace(str(hnsw_path) + ".tmp", hnsw_path)
+        elif hnsw_path.exists():
+            os.remove(hnsw_path)
+
+        codes, scales = self._quantized() if self.quantization != "none" else (None, None)
+        # Old codes go first: a crash below leaves none (rebuilt on load), never stale ones
+        for names in CODE_FILES.values():
+            for name in names:
+                if (self.path / name).exists():
+                    os.remove(self.path / name)
+        os.replace(tmp_vectors, self.path / "vectors.npy")
+        os.replace(tmp_docs, self.path / "docs.json")
+        if codes is not None:
+            for name, array in zip(CODE_FILES[self.quantization], (codes, scales)):
+                with open(self.path / (name + ".tmp"), "wb") as f:
+                    np.save(f, array)
+                os.replace(self.path / (name + ".tmp"), self.path / name)
+        self._dirty = False
+        self._hnsw = None
+        self._load()
+
+    def close(self) -> None:
+        self.save()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # ---- writes (SearchClient-compatible subset) ----
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _writable(self) -> None:
+        self._text = None
+        self._codes = self._scales = None
+        if not self._dirty:
+            # Leave the memory map; mutations work on a private copy until save()
+            self._vectors = np.array(self._vectors, dtype=np.float32)
+            self._hnsw = None
+            self._dirty = True
+
+    def upload_documents(self, documents: List[Dict[str, Any]]) -> List[LocalIndexingResult]:
+        """Insert or fully replace documents; each must carry ``contentVector``."""
+        self._writable()
+        results: List[LocalIndexingResult] = []
+        new_rows: List[np.ndarray] = []
+        for doc in documents:
+            vector = doc.get("contentVector")
+            if vector is None:
+                results.append(LocalIndexingResult(doc["id"], False, 400, "contentVector is required"))
+                continue
+            vector = self._normalize(np.asarray(vector, dtype=np.float32))
+            if self.dim is None:
+                self.dim = len(vector)
+                self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+            if len(vector) != self.dim:
+                results.append(LocalIndexingResult(doc["id"], False, 400, f"expected {self.dim} dimensions"))
+                continue
+            fields = {k: v for k, v in doc.items() if k != "contentVector"}
+            row = self._rows.get(doc["id"])
+            if row is None:
+                self._rows[doc["id"]] = len(self._docs)
+                self._docs.append(fields)
+                new_rows.append(vector)
+            else:
+                self._docs[row] = fields
+                if row < len(self._vectors):
+                    self._vectors[row] = vector
+                else:
+                    new_rows[row - len(self._vectors)] = vector
+            results.append(LocalIndexingResult(doc["id"]))
+        if new_rows:
+            self._vectors = np.vstack([self._vectors, np.stack(new_rows)])
+        return results
+
+    def merge_or_upload_documents(self, documents: List[Dict[str, Any]]) -> List[LocalIndexingResult]:
+        """Update the given fields of existing documents, inserting unknown ones."""
+        self._writable()
+        merged = []
+        for doc in documents:
+            row = self._rows.get(doc["id"])
+            if row is not None and "contentVector" not in doc:
+                doc = {**self._docs[row], **doc, "contentVector": self._vectors[row]}
+            merged.append(doc)
+        return self.upload_documents(merged)
+
+    def delete_documents(self, documents: List[Dict[str, Any]]) -> List[LocalIndexingResult]:
+        self._writable()
+        doomed = {doc["id"] for doc in documents if doc["id"] in self._rows}
+        if doomed:
+            keep = [i for i, doc in enumerate(self._docs) if doc["id"] not in doomed]
+            self._vectors = self._vectors[keep]
+            self._docs = [self._docs[i] for i in keep]
+            self._rows = {doc["id"]: i for i, doc in enumerate(self._docs)}
+        return [LocalIndexingResult(doc["id"]) for doc in documents]
+
+    def get_document(self, key: str) -> Dict[str, Any]:
+        return dict(self._docs[self._rows[key]])
+
+    # ---- search ----
+
+    def _text_index(self) -> TextIndex:
+        text = self._text
+        if text is None:
+            with self._text_lock:
+                text = self._text
+                if text is None:
+                    text = self._text = self._build_text_index()
+        return text
+
+    def _build_text_index(self) -> TextIndex:
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = np.zeros(len(self._docs), dtype=np.float32)
+        topic_rows: Dict[str, List[int]] = {}
+        for row, doc in enumerate(self._docs):
+            counts = Counter(terms(f"{doc.get('title') or ''} {doc.get('content') or ''}"))
+            lengths[row] = sum(counts.values())
+            for term, tf in counts.items():
+                rows, tfs = postings.setdefault(term, ([], []))
+                rows.append(row)
+                tfs.append(tf)
+            for topic in doc.get("topics") or []:
+                topic_rows.setdefault(topic, []).append(row)
+        return TextIndex(
+            postings={
+                term: (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+                for term, (rows, tfs) in postings.items()
+            },
+            doc_lengths=lengths,
+            topic_rows={topic: np.asarray(rows, dtype=np.int64) for topic, rows in topic_rows.items()},
+        )
+
+    def _rows_with_topics(self, topics: Sequence[str]) -> np.ndarray:
+        topic_rows = self._text_index().topic_rows
+        matches = [topic_rows[t] for t in topics if t in topic_rows]
+        return np.unique(np.concatenate(matches)) if matches else np.zeros(0, dtype=np.int64)
+
+    def _hits(self, rows: np.ndarray, scores: np.ndarray, select: Optional[List[str]]) -> List[Dict[str, Any]]:
+        hits = []
+        for row, score in zip(rows, scores):
+            doc = self._docs[int(row)]
+            hit = {k: doc.get(k) for k in select} if select else dict(doc)
+            if select and "contentVector" in select:
+                # Vectors live in the (normalised) matrix, not in docs.json
+                hit["contentVector"] = self._vectors[int(row)].tolist()
+            hit["@search.score"] = float(score)
+            hits.append(hit)
+        return hits
+
+    def _quantized(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self._codes is None:
+            self._codes, self._scales = quantize(self._vectors, self.quantization)
+        return self._codes, self._scales
+
+    def _shortlist_scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        codes, scales = self._quantized()
+        if rows is not None:
+            codes = codes[rows]
+            scales = scales[rows] if scales is not None else None
+        if self.quantization == "binary":
+            return binary_scores(codes, query)
+        return int8_scores(codes, scales, query)
+
+    def _rescored(self, query: np.ndarray, top: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Shortlist by quantized score, then rank the shortlist by full-precision cosine."""
+        shortlist = self._top_rows(self._shortlist_scores(query, rows), top * self.rescore_factor)
+        if rows is not None:
+            shortlist = rows[shortlist]
+        # Sorted row order reads the memory map front to back
+        shortlist = np.sort(shortlist)
+        scores = self._vectors[shortlist] @ query
+        order = self._top_rows(scores, top)
+        return shortlist[order], scores[order]
+
+    @staticmethod
+    def _top_rows(scores: np.ndarray, top: int) -> np.ndarray:
+        top = min(top, len(scores))
+        rows = np.argpartition(-scores, top - 1)[:top]
+        return rows[np.argsort(-scores[rows], kind="stable")]
+
+    def search(
+        self,
+        vector: List[float],
+        top: int = 3,
+        select: Optional[List[str]] = None,
+        exact: bool = False,
+        topics: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Top-``top`` chunks by cosine similarity, with ``@search.score`` like Azure.
+
+        ``exact`` skips both the HNSW graph and the quantized first pass.
+        """
+        if not self._docs or top <= 0:
+            return []
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+        quantized = self.quantization != "none" and not exact
+
+        if topics:
+            candidates = self._rows_with_topics(topics)
+            if not len(candidates):
+                return []
+            if quantized:
+                return self._hits(*self._rescored(query, top, candidates), select)
+            scores = self._vectors[candidates] @ query
+            order = self._top_rows(scores, top)
+            return self._hits(candidates[order], scores[order], select)
+
+        if self._hnsw is not None and not exact:
+            labels, distances = self._hnsw.knn_query(query, k=min(top, len(self._docs)))
+            return self._hits(labels[0].astype(np.int64), 1.0 - distances[0], select)
+
+        if quantized:
+            return self._hits(*self._rescored(query, top), select)
+        scores = self._vectors @ query
+        rows = self._top_rows(scores, top)
+        return self._hits(rows, scores[rows], select)
+
+    def keyword_search(
+        self,
+        text: str,
+        top: int = 3,
+        select: Optional[List[str]] = None,
+        topics: Optional[Sequence[str]] = None,
+        boost_tags: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Top-``top`` chunks by BM25 over ``title`` and ``content``; only chunks matching a term are returned."""
+        if not self._docs or top <= 0:
+            return []
+        index = self._text_index()
+        n = len(self._docs)
+        avg_length = float(index.doc_lengths.mean()) or 1.0
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(terms(text)):
+            posting = index.postings.get(term)
+            if posting is None:
+                continue
+            rows, tf = posting
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * index.doc_lengths[rows] / avg_length)
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        if boost_tags:
+            scores[self._rows_with_topics(boost_tags)] *= TAG_BOOST
+        if topics:
+            allowed = np.zeros(n, dtype=bool)
+            allowed[self._rows_with_topics(topics)] = True
+            scores[~allowed] = 0
+
+        matched = np.flatnonzero(scores > 0)
+        order = self._top_rows(scores[matched], top) if len(matched) else matched
+        return self._hits(matched[order], scores[matched][order], select)
+
+
+def local_index_from_env(path: Optional[Path] = None) -> LocalVectorIndex:
+    return LocalVectorIndex(
+        path or Path(os.getenv("LOCAL_INDEX_DIR", str(DEFAULT_INDEX_DIR))),
+        quantization=os.getenv("LOCAL_INDEX_QUANTIZATION", "none"),
+        rescore_factor=int(os.getenv("LOCAL_INDEX_RESCORE_FACTOR", "4")),
+    )
@@ -1,18 +1,108 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from openai import APITimeoutError
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 
-from models import QueryRequest, QueryResponse
+from admission import DeadlineExceeded, Overloaded, Ticket, limiter_from_env, set_deadline
+from index_router import UnknownIndex
+from metrics import RequestContextMiddleware, StatsCollector
+from models import (
+    BatchQueryRequest,
+    BatchQueryResponse,
+    BatchQueryResult,
+    ChatRequest,
+    ChatResponse,
+    InvalidateRequest,
+    InvalidateResponse,
+    QueryRequest,
+    QueryResponse,
+    RetrievalParams,
+)
 from rag_service import RAGService
+from retrievers import SearchOptions
 
 # Load environment variables
 load_dotenv()
 
+# Request trace lines (metrics.py) are logged at INFO; LOG_LEVEL=WARNING silences them
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(message)s")
+
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "500"))
+MAX_BATCH_CONCURRENCY = int(os.getenv("MAX_BATCH_CONCURRENCY", "16"))
+# Time budget of one /api/v1/query, queueing and upstream retries included
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+# Shared secret of /api/v1/cache/invalidate (disabled while unset)
+CACHE_INVALIDATE_TOKEN = os.getenv("RAG_CACHE_INVALIDATE_TOKEN", "")
+
+# Adaptive cap on queries in flight (see admission.py)
+admission = limiter_from_env()
+
+# Global service instance, built by lifespan so importing this module stays cheap
+rag_service: Optional[RAGService] = None
+
+
+def service_collectors(service: RAGService) -> List[StatsCollector]:
+    return [
+        StatsCollector(
+            "rag_query_embedding_cache", service.embedding_cache.stats,
+            counters=("hits", "shared_hits", "misses", "evictions", "expirations", "shared_errors"), gauges=("size",),
+        ),
+        StatsCollector(
+            "rag_answer_cache", service.answer_caches.stats,
+            counters=("hits", "misses", "evictions", "invalidations"), gauges=("size",), label="index",
+        ),
+        StatsCollector(
+            "rag_search_clients", service.retrievers.stats, counters=("created", "evicted"), gauges=("size", "in_use"),
+        ),
+        StatsCollector(
+            "rag_chat_sessions", service.sessions.stats,
+            counters=("created", "expired", "evicted", "invalidations", "shared_errors"), gauges=("size",),
+        ),
+        StatsCollector("rag_rerank", service.reranker.stats, counters=("runs", "timeouts", "errors")),
+        StatsCollector(
+            "rag_singleflight", service.in_flight.stats, counters=("leaders", "coalesced"), gauges=("in_flight",),
+        ),
+        StatsCollector(
+            "rag_admission", admission.stats,
+            counters=("admitted", "queued", "rejected"), gauges=("limit", "in_flight", "queue_length"),
+        ),
+    ]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global rag_service
+    rag_service = RAGService()
+    collectors = service_collectors(rag_service)
+    for collector in collectors:
+        REGISTRY.register(collector)
+    # Warm up in the background: the port opens (and /health answers) at once,
+    # /ready turns 200 when the tokenizer and upstream connections are ready
+    warm_up = asyncio.create_task(rag_service.warm_up())
+    yield
+    warm_up.cancel()
+    for collector in collectors:
+        REGISTRY.unregister(collector)
+    # Close pooled connections on shutdown
+    await rag_service.close()
+
+
 app = FastAPI(
     title="RAG AI App",
     description="Retrieval-Augmented Generation AI Application",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -22,10 +112,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
-
-# Global service instance
-rag_service = RAGService()
+# Outermost, so the request id and timings cover everything below it
+app.add_middleware(RequestContextMiddleware)
 
 
 def get_rag_service() -> RAGService:
@@ -43,26 +133,233 @@ async def health_check():
     return {"status": "healthy", "service": "rag-ai-app"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    if rag_service is None or not rag_service.ready:
+        steps = rag_service.warm_state if rag_service is not None else {}
+        return JSONResponse(status_code=503, content={"status": "warming_up", "steps": steps})
+    return {"status": "ready", "steps": rag_service.warm_state}
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/api/v1/status")
 async def api_status():
     return {
         "status": "operational",
         "version": "1.0.0",
-        "service": "rag-ai-backend"
+        "service": "rag-ai-backend",
+        "query_embedding_cache": rag_service.embedding_cache.stats(),
+        "answer_cache": rag_service.answer_caches.stats(),
+        "search_clients": rag_service.retrievers.stats(),
+        "chat_sessions": rag_service.sessions.stats(),
+        "rerank": rag_service.reranker.stats(),
+        "coalescing": rag_service.in_flight.stats(),
+        "admission": admission.stats(),
     }
 
 
+def search_options(request: RetrievalParams) -> SearchOptions:
+    overrides: Dict[str, Any] = {}
+    if request.mode:
+        overrides["mode"] = request.mode
+    if request.rerank:
+        overrides["rerank"] = request.rerank
+    try:
+        indexes = rag_service.router.resolve(request.indexes, request.tenant)
+    except UnknownIndex as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return SearchOptions(
+        k=request.k,
+        topics=tuple(request.topics or ()),
+        boost_tags=tuple(request.boost_tags or ()),
+        indexes=indexes,
+        **overrides,
+    )
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Frees the admission slot when the response ends, even if the stream never started."""
+
+    def __init__(self, *args, ticket: Ticket, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(self.ticket)
+
+
+async def admit() -> Ticket:
+    set_deadline(REQUEST_DEADLINE)
+    try:
+        return await admission.acquire()
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503, detail="Too many queries in flight", headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+def batch_error(error: Exception) -> str:
+    if isinstance(error, Overloaded):
+        return "Too many queries in flight"
+    if isinstance(error, (DeadlineExceeded, APITimeoutError)):
+        return f"No answer within {REQUEST_DEADLINE:g}s"
+    return str(error)
+
+
+async def stream_rag(
+    request: QueryRequest, options: SearchOptions, http_request: Request, ticket: Ticket
+) -> AsyncIterator[str]:
+    events = rag_service.query_stream(
+        query=request.query,
+        top=request.top,
+        max_tokens=request.max_tokens,
+        context_tokens=request.context_tokens,
+        options=options,
+    )
+    try:
+        async for event in events:
+            # Stop generating (and paying for) tokens nobody will read
+            if await http_request.is_disconnected():
+                break
+            if event["event"] == "token" and ticket.first_byte is None:
+                ticket.first_byte = time.monotonic()
+            yield sse_event(event["event"], event["data"])
+        else:
+            yield sse_event("done", {})
+    except Exception as e:
+        ticket.ok = False
+        yield sse_event("error", {"detail": str(e)})
+    finally:
+        await events.aclose()
+
+
 @app.post("/api/v1/query", response_model=QueryResponse)
-async def query_rag(request: QueryRequest):
+async def query_rag(request: QueryRequest, http_request: Request):
+    # Unknown indexes are refused before taking an admission slot
+    options = search_options(request)
+    ticket = await admit()
+    if request.stream:
+        return AdmittedStreamingResponse(
+            stream_rag(request, options, http_request, ticket),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            ticket=ticket,
+        )
     try:
-        answer = rag_service.query(
+        result = await rag_service.answer(
             query=request.query,
             top=request.top,
-            max_tokens=request.max_tokens
+            max_tokens=request.max_tokens,
+            context_tokens=request.context_tokens,
+            options=options,
         )
-        return QueryResponse(answer=answer)
+        return QueryResponse(answer=result.answer, sources=result.sources)
+    except (DeadlineExceeded, APITimeoutError):
+        ticket.ok = False
+        raise HTTPException(status_code=504, detail=f"No answer within {REQUEST_DEADLINE:g}s")
     except Exception as e:
+        ticket.ok = False
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release(ticket)
+
+
+@app.post("/api/v1/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """One turn of a conversation kept server-side; omit ``session_id`` to start one."""
+    options = search_options(request)
+    session = None
+    if request.session_id:
+        session = await rag_service.sessions.get(request.session_id, request.tenant)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired session")
+    ticket = await admit()
+    try:
+        if session is None:
+            session = rag_service.sessions.create(request.tenant)
+        result = await rag_service.chat(
+            session,
+            request.message,
+            top=request.top,
+            max_tokens=request.max_tokens,
+            context_tokens=request.context_tokens,
+            options=options,
+        )
+        return ChatResponse(
+            session_id=session.id,
+            answer=result.answer,
+            sources=result.sources,
+            query=result.query,
+            retrieved=result.retrieved,
+            turn=session.answered,
+        )
+    except (DeadlineExceeded, APITimeoutError):
+        ticket.ok = False
+        raise HTTPException(status_code=504, detail=f"No answer within {REQUEST_DEADLINE:g}s")
+    except Exception as e:
+        ticket.ok = False
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release(ticket)
+
+
+@app.delete("/api/v1/chat/{session_id}")
+async def end_chat(session_id: str, tenant: Optional[str] = None):
+    if not await rag_service.sessions.delete(session_id, tenant):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"deleted": session_id}
+
+
+@app.post("/api/v1/query/batch", response_model=BatchQueryResponse)
+async def query_rag_batch(request: BatchQueryRequest):
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    options = search_options(request)
+    # Bounds the shared embeddings step; each query then gets a deadline and admission slot of its own
+    set_deadline(REQUEST_DEADLINE)
+    outcomes = await rag_service.query_batch(
+        queries=request.queries,
+        top=request.top,
+        max_tokens=request.max_tokens,
+        concurrency=max(1, min(request.concurrency, MAX_BATCH_CONCURRENCY)),
+        context_tokens=request.context_tokens,
+        options=options,
+        admission=admission,
+        deadline=REQUEST_DEADLINE,
+    )
+    return BatchQueryResponse(
+        results=[
+            BatchQueryResult(error=batch_error(o)) if isinstance(o, Exception) else BatchQueryResult(answer=o)
+            for o in outcomes
+        ]
+    )
+
+
+@app.post("/api/v1/cache/invalidate", response_model=InvalidateResponse)
+async def invalidate_cache(
+    request: InvalidateRequest, token: Optional[str] = Header(None, alias="X-Cache-Invalidate-Token")
+):
+    """Drop cached answers that cite re-ingested chunk ids.
+
+    Each replica only forgets its own entries; ingestion calls every pod
+    through the headless Service. Needs ``RAG_CACHE_INVALIDATE_TOKEN``.
+    """
+    if not CACHE_INVALIDATE_TOKEN:
+        raise HTTPException(status_code=403, detail="Cache invalidation is disabled")
+    if token is None or not hmac.compare_digest(token.encode(), CACHE_INVALIDATE_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Missing or wrong X-Cache-Invalidate-Token")
+    return InvalidateResponse(invalidated=await rag_service.invalidate_chunks(request.ids))
 
 
 if __name__ == "__main__":
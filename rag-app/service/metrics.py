@@ -0,0 +1,175 @@
+"""Prometheus metrics and per-request tracing for the query service.
+
+Stage latencies, token counts, upstream retries and cache counters are served
+on ``/metrics``. ``RequestContextMiddleware`` gives every request an id,
+forwards it to Azure and logs the request's stage timings.
+"""
+import contextvars
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "x-request-id"
+# Paths hit by probes and scrapers are counted but not logged
+QUIET_PATHS = ("/health", "/ready", "/metrics")
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Time spent in each stage of answering a query",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+TOKENS = Counter("rag_tokens", "Tokens reported by Azure OpenAI", ["kind"])
+UPSTREAM_RETRIES = Counter("rag_upstream_retries", "Retried upstream calls", ["dependency"])
+UPSTREAM_THROTTLED = Counter("rag_upstream_throttled", "Upstream responses with status 429", ["dependency"])
+HTTP_REQUESTS = Counter("rag_http_requests", "HTTP requests served", ["route", "method", "status"])
+INDEX_SEARCH_SECONDS = Histogram(
+    "rag_index_search_seconds",
+    "Time spent searching one index",
+    ["index"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+INDEX_SEARCH_ERRORS = Counter("rag_index_search_errors", "Failed searches of one index", ["index"])
+CHAT_TURNS = Counter("rag_chat_turns", "Conversation turns by where their sources came from", ["sources"])
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_stages_var: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stages", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    return request_id_var.get()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a stage into ``rag_stage_seconds`` and the current request's trace line."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        stages = _stages_var.get()
+        if stages is not None:
+            # Batch requests run stages concurrently; their trace line shows the sum
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def collect_stages() -> Iterator[Dict[str, float]]:
+    """Collect the ``span`` timings of the code run inside the block, stage -> seconds."""
+    stages: Dict[str, float] = {}
+    token = _stages_var.set(stages)
+    try:
+        yield stages
+    finally:
+        _stages_var.reset(token)
+
+
+def record_usage(usage: Any) -> None:
+    """Count the tokens of an OpenAI ``usage`` object (chat or embeddings)."""
+    if usage is None:
+        return
+    completion = getattr(usage, "completion_tokens", None)
+    if completion is None:
+        TOKENS.labels("embedding").inc(usage.prompt_tokens)
+        return
+    TOKENS.labels("prompt").inc(usage.prompt_tokens)
+    TOKENS.labels("completion").inc(completion)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached:
+        TOKENS.labels("cached").inc(cached)
+
+
+def count_retry(dependency: str) -> Callable[[Any], None]:
+    """tenacity ``before_sleep`` hook counting the retries of ``dependency``."""
+    def before_sleep(retry_state: Any) -> None:
+        UPSTREAM_RETRIES.labels(dependency).inc()
+    return before_sleep
+
+
+class StatsCollector:
+    """Export a ``stats()`` dict as ``<prefix>_<key>`` metrics at scrape time.
+
+    With ``label``, ``stats()`` returns one dict per value of that label.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        stats: Callable[[], Dict[str, Any]],
+        counters: Sequence[str],
+        gauges: Sequence[str] = (),
+        label: Optional[str] = None,
+    ):
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = counters
+        self.gauges = gauges
+        self.label = label
+
+    def collect(self):
+        stats = self.stats()
+        groups = stats if self.label else {None: stats}
+        labels = [self.label] if self.label else None
+        for family, keys in ((CounterMetricFamily, self.counters), (GaugeMetricFamily, self.gauges)):
+            for key in keys:
+                metric = family(f"{self.prefix}_{key}", f"{self.prefix} {key}", labels=labels)
+                for value, group in groups.items():
+                    metric.add_metric([value] if self.label else [], group[key])
+                yield metric
+
+
+class RequestContextMiddleware:
+    """ASGI middleware: request id, request counter and a trace line per request.
+
+    Plain ASGI rather than ``BaseHTTPMiddleware`` so streamed responses pass
+    through untouched and the trace line is logged once the stream ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")[:128] or uuid.uuid4().hex
+        request_token = request_id_var.set(request_id)
+        stages: Dict[str, float] = {}
+        stages_token = _stages_var.set(stages)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), request_id.encode("latin-1"))]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            # Label by route template, not raw path, to keep label cardinality bounded
+            HTTP_REQUESTS.labels(getattr(route, "path", "unmatched"), scope["method"], str(status)).inc()
+            if scope["path"] not in QUIET_PATHS and logger.isEnabledFor(logging.INFO):
+                timings = "".join(f" {stage}={seconds * 1e3:.1f}ms" for stage, seconds in stages.items())
+                logger.info(
+                    "request_id=%s %s %s %s %.1fms%s",
+                    request_id, scope["method"], scope["path"], status, elapsed * 1e3, timings,
+                )
+            _stages_var.reset(stages_token)
+            request_id_var.reset(request_token)
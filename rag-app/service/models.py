@@ -1,12 +1,93 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 
+RetrievalMode = Literal["vector", "keyword", "hybrid", "semantic"]
+RerankStrategy = Literal["none", "bm25", "mmr", "cross-encoder"]
 
-class QueryRequest(BaseModel):
+
+class RetrievalParams(BaseModel):
+    # Default: RETRIEVAL_MODE
+    mode: Optional[RetrievalMode] = None
+    # Nearest neighbours for the vector query, independent of top
+    k: Optional[int] = Field(None, ge=1)
+    # Only retrieve chunks tagged with any of these topics
+    topics: Optional[List[str]] = None
+    # Boost chunks tagged with these topics (tag scoring profile, full-text part only)
+    boost_tags: Optional[List[str]] = None
+    # Rescore over-fetched hits locally before packing (default: RERANK_STRATEGY)
+    rerank: Optional[RerankStrategy] = None
+    # Indexes to search, merged by score (default: the tenant's indexes, else AZURE_SEARCH_INDEX)
+    indexes: Optional[List[str]] = None
+    # Tenant whose indexes to search (SEARCH_TENANTS)
+    tenant: Optional[str] = None
+
+
+class QueryRequest(RetrievalParams):
     query: str
-    top: Optional[int] = 3
-    max_tokens: Optional[int] = 300
+    top: int = Field(3, ge=1)
+    max_tokens: int = Field(300, ge=1)
+    stream: Optional[bool] = False
+    # Prompt tokens to spend on sources (default: PROMPT_TOKEN_BUDGET)
+    context_tokens: Optional[int] = Field(None, ge=1)
+
+
+class SourceUsage(BaseModel):
+    id: str
+    ids: List[str]
+    title: str
+    source: str
+    chunk_index: int
+    score: float
+    tokens: int
+    truncated: bool
+    index: Optional[str] = None
 
 
 class QueryResponse(BaseModel):
     answer: str
+    sources: List[SourceUsage] = []
+
+
+class BatchQueryRequest(RetrievalParams):
+    queries: List[str]
+    top: int = Field(3, ge=1)
+    max_tokens: int = Field(300, ge=1)
+    concurrency: int = Field(8, ge=1)
+    context_tokens: Optional[int] = Field(None, ge=1)
+
+
+class BatchQueryResult(BaseModel):
+    answer: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+
+
+class ChatRequest(RetrievalParams):
+    message: str
+    # Omit to start a conversation; then pass the session_id of the response
+    session_id: Optional[str] = None
+    top: int = Field(3, ge=1)
+    max_tokens: int = Field(300, ge=1)
+    context_tokens: Optional[int] = Field(None, ge=1)
+
+
+class ChatResponse(BaseModel):
+    session_id: str
+    answer: str
+    sources: List[SourceUsage] = []
+    # The standalone query the message was condensed into
+    query: str
+    # False when the previous turn's sources covered the message and were reused
+    retrieved: bool
+    turn: int
+
+
+class InvalidateRequest(BaseModel):
+    ids: List[str]
+
+
+class InvalidateResponse(BaseModel):
+    invalidated: int
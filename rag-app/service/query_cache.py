@@ -0,0 +1,145 @@
+"""Cache of query embeddings for RAGService.
+
+Entries are keyed by the embedding deployment plus the normalized query text
+(lower-cased, whitespace collapsed), so case and spacing variants of the same
+question share one embeddings call. The in-process tier is a size-bounded LRU
+with a TTL; an optional shared tier (``SharedEmbeddingStore``) lets several
+replicas reuse each other's hits.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Protocol, Tuple
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class SharedEmbeddingStore(Protocol):
+    async def get(self, key: str) -> Optional[List[float]]:
+        ...
+
+    async def set(self, key: str, vector: List[float], ttl: int) -> None:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class RedisEmbeddingStore:
+    """Shared tier backed by Redis; vectors are stored as float32 bytes.
+
+    Requires the optional ``redis`` dependency (``uv sync --extra redis``).
+    """
+
+    def __init__(self, url: str, prefix: str = "qemb:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        raw = await self.client.get(self.prefix + key)
+        return np.frombuffer(raw, dtype=np.float32).tolist() if raw is not None else None
+
+    async def set(self, key: str, vector: List[float], ttl: int) -> None:
+        await self.client.set(self.prefix + key, np.asarray(vector, dtype=np.float32).tobytes(), ex=ttl)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class QueryEmbeddingCache:
+    def __init__(self, maxsize: int = 1024, ttl: int = 3600, shared: Optional[SharedEmbeddingStore] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self._entries: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_errors = 0
+
+    @staticmethod
+    def key(query: str, deployment: str) -> str:
+        return hashlib.sha1(f"{deployment}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, vector = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return vector
+
+    def _put_local(self, key: str, vector: List[float]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, query: str, deployment: str) -> Optional[List[float]]:
+        key = self.key(query, deployment)
+        vector = self._get_local(key)
+        if vector is not None:
+            self.hits += 1
+            return vector
+
+        if self.shared is not None:
+            try:
+                vector = await self.shared.get(key)
+            except Exception:
+                # The shared tier is an optimisation; never fail a query because of it
+                self.shared_errors += 1
+                vector = None
+            if vector is not None:
+                self.shared_hits += 1
+                self._put_local(key, vector)
+                return vector
+
+        self.misses += 1
+        return None
+
+    async def put(self, query: str, deployment: str, vector: List[float]) -> None:
+        key = self.key(query, deployment)
+        self._put_local(key, vector)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, vector, self.ttl)
+            except Exception:
+                self.shared_errors += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "shared_errors": self.shared_errors,
+        }
+
+    async def close(self) -> None:
+        if self.shared is not None:
+            await self.shared.close()
+
+
+def query_cache_from_env() -> QueryEmbeddingCache:
+    redis_url = os.getenv("QUERY_EMBED_CACHE_REDIS_URL")
+    return QueryEmbeddingCache(
+        maxsize=int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1024")),
+        ttl=int(os.getenv("QUERY_EMBED_CACHE_TTL", "3600")),
+        shared=RedisEmbeddingStore(redis_url) if redis_url else None,
+    )
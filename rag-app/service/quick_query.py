@@ -6,13 +6,18 @@ from azure.core.credentials import AzureKeyCredential
 from azure.core.pipeline.policies import RetryPolicy
 from azure.search.documents import SearchClient
 from azure.search.documents.models import VectorizedQuery
-from openai import AzureOpenAI
+from openai import AzureOpenAI, RateLimitError
 from tenacity import retry, wait_exponential, stop_after_attempt
-import tiktoken
+
+from local_index import local_index_from_env
+from quantization import dimensions_param
+from rate_limiter import limiter_for
+from tokens import count_tokens, truncate_to_tokens
 
 load_dotenv(Path(__file__).parent.parent / ".env")
 
-INDEX = os.environ["AZURE_SEARCH_INDEX"]
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "azure")
+INDEX = os.getenv("AZURE_SEARCH_INDEX", "")
 
 # Configure retry policy for Azure Search
 search_retry_policy = RetryPolicy(
@@ -22,12 +27,15 @@ search_retry_policy = RetryPolicy(
     retry_on_status_codes=[429, 503, 504]
 )
 
-search_client = SearchClient(
-    endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
-    index_name=INDEX,
-    credential=AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"]),
-    retry_policy=search_retry_policy
-)
+if RETRIEVER_BACKEND == "local":
+    local_index = local_index_from_env()
+else:
+    search_client = SearchClient(
+        endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
+        index_name=INDEX,
+        credential=AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"]),
+        retry_policy=search_retry_policy
+    )
 
 
 openai_client = AzureOpenAI(
@@ -39,17 +47,16 @@ openai_client = AzureOpenAI(
 deployment_name = os.environ["AZURE_OPENAI_EMBED_DEPLOYMENT"]
 CHAT_DEPLOYMENT = os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"]
 
+# Same RPM/TPM budgets as the API (share them with RATE_LIMIT_STATE_FILE)
+embed_limiter = limiter_for(deployment_name, "AZURE_OPENAI_EMBED")
+chat_limiter = limiter_for(CHAT_DEPLOYMENT, "AZURE_OPENAI_CHAT")
+
 # ==== Request & Token Tracking ====
 call_id = itertools.count(1)
 total_requests = 0
 total_tokens = 0
 
 
-def count_tokens(text: str):
-    enc = tiktoken.encoding_for_model("gpt-35-turbo")
-    return len(enc.encode(text))
-
-
 def log_request(req_type: str, prompt: str, max_tokens=0):
     global total_requests, total_tokens
     # n = next(call_id)  # Commented out since print is disabled
@@ -77,15 +84,30 @@ Question: {query}
 """
 
 
+def limited_call(limiter, tokens, create, **kwargs):
+    limiter.acquire(tokens)
+    try:
+        raw = create(**kwargs)
+    except RateLimitError as e:
+        limiter.update_from_headers(e.response.headers)
+        raise
+    limiter.update_from_headers(raw.headers)
+    return raw.parse()
+
+
 def tracked_embeddings(query):
-    log_request("Embedding", query)
-    return openai_client.embeddings.create(input=query, model=deployment_name)
+    est_tokens = log_request("Embedding", query)
+    return limited_call(
+        embed_limiter, est_tokens, openai_client.embeddings.with_raw_response.create,
+        input=query, model=deployment_name, **dimensions_param(),
+    )
 
 
 @retry(wait=wait_exponential(multiplier=1, min=2, max=15), stop=stop_after_attempt(5))
 def tracked_chat(prompt, max_tokens=300):
     est_tokens = log_request("Chat", prompt, max_tokens=max_tokens)
-    return openai_client.chat.completions.create(
+    return limited_call(
+        chat_limiter, est_tokens, openai_client.chat.completions.with_raw_response.create,
         messages=[{"role": "user", "content": prompt}],
         model=CHAT_DEPLOYMENT,
         max_tokens=max_tokens,
@@ -98,25 +120,22 @@ query = "ArgoCD app-of-apps created but nothing shows in the UI. What's wrong?"
 # Embedding call
 embed = tracked_embeddings(query).data[0].embedding
 
-# create VectorizedQuery with the embedding
-vector_query = VectorizedQuery(vector=embed, k_nearest_neighbors=5, fields="contentVector", kind="vector")
-
-# search using the query
-result = search_client.search(
-    search_text=None,
-    vector_queries=[vector_query],
-    select=["id", "title", "source", "chunk_index", "content", "topics"],
-    top=3,
-)
-
+if RETRIEVER_BACKEND == "local":
+    result = local_index.search(embed, top=3, select=["id", "title", "source", "chunk_index", "content", "topics", "snippet"])
+else:
+    # create VectorizedQuery with the embedding
+    vector_query = VectorizedQuery(vector=embed, k_nearest_neighbors=5, fields="contentVector", kind="vector")
 
-def truncate_to_tokens(text: str, max_tokens: int = 250):
-    enc = tiktoken.encoding_for_model("gpt-35-turbo")
-    tokens = enc.encode(text)
-    return enc.decode(tokens[:max_tokens])
+    # search using the query
+    result = search_client.search(
+        search_text=None,
+        vector_queries=[vector_query],
+        select=["id", "title", "source", "chunk_index", "content", "topics", "snippet"],
+        top=3,
+    )
 
 
-sources_formatted = "=================\n".join([f"TITLE: {document['title']}, CONTENT: {truncate_to_tokens(document['content'], 250)}" for document in result])
+sources_formatted = "=================\n".join([f"TITLE: {document['title']}, CONTENT: {document.get('snippet') or truncate_to_tokens(document['content'], 250)}" for document in result])
 
 # Chat call
 response, used_tokens = tracked_chat(
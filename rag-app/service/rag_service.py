@@ -1,43 +1,98 @@
+import asyncio
 import os
+import time
+from functools import cached_property
 from pathlib import Path
-from typing import Any, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
-from azure.core.credentials import AzureKeyCredential
-from azure.core.pipeline.policies import RetryPolicy
-from azure.search.documents import SearchClient
-from azure.search.documents.models import VectorizedQuery
-from openai import AzureOpenAI
-from tenacity import retry, wait_exponential, stop_after_attempt
-import tiktoken
+import httpx
+from openai import AsyncAzureOpenAI, AsyncStream, RateLimitError
+from tenacity import retry, wait_exponential
+
+from admission import AdaptiveLimiter, remaining, set_deadline, stop_at_deadline, within_deadline
+from answer_cache import CachedAnswer, SemanticAnswerCache, answer_caches_from_env
+from context_packer import PackedContext, pack_context
+from index_router import pool_from_env, router_from_env
+from metrics import (
+    INDEX_SEARCH_ERRORS,
+    INDEX_SEARCH_SECONDS,
+    CHAT_TURNS,
+    TOKENS,
+    UPSTREAM_THROTTLED,
+    count_retry,
+    current_request_id,
+    record_usage,
+    span,
+)
+from quantization import dimensions_param
+from query_cache import normalize_query, query_cache_from_env
+from rate_limiter import RateLimiter, limiter_for
+from rerank import DEFAULT_RERANK, reranker_from_env
+from retrievers import SearchOptions, merge_by_score
+from sessions import ChatAnswer, Session, Turn, coverage, sessions_from_env
+from singleflight import SingleFlight
+from tokens import count_batch_tokens, count_tokens, get_encoding, token_byte_lengths
 
 load_dotenv(Path(__file__).parent.parent / ".env")
 
-INDEX = os.environ["AZURE_SEARCH_INDEX"]
+# Size of the connection pool behind the OpenAI client
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
 
-# Configure retry policy for Azure Search
-search_retry_policy = RetryPolicy(
-    retry_total=3,
-    retry_backoff_factor=1.0,
-    retry_backoff_max=60,
-    retry_on_status_codes=[429, 503, 504]
-)
+# Queries per embeddings request in RAGService.query_batch
+QUERY_BATCH_EMBED_SIZE = int(os.getenv("QUERY_BATCH_EMBED_SIZE", "64"))
 
-search_client = SearchClient(
-    endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
-    index_name=INDEX,
-    credential=AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"]),
-    retry_policy=search_retry_policy
-)
+# Default prompt tokens spent on sources, and the chat model's context window
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "800"))
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "16385"))
 
+# Conversations (RAGService.chat): how follow-ups become standalone queries (llm: a short
+# completion; last: prefixed with the previous question; none: as asked), the share of a
+# query's words the previous sources must contain to be reused, and the prompt tokens
+# replayed as history
+CHAT_CONDENSE = os.getenv("CHAT_CONDENSE", "llm")
+CHAT_SOURCE_COVERAGE = float(os.getenv("CHAT_SOURCE_COVERAGE", "1.0"))
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+CONDENSE_MAX_TOKENS = 64
+CONDENSE_TURNS = 3
+CONDENSE_ANSWER_CHARS = 400
+
+# Per-step timeout and the longest pause between retries of RAGService.warm_up
+WARM_UP_TIMEOUT = float(os.getenv("WARM_UP_TIMEOUT", "10"))
+WARM_UP_MAX_BACKOFF = 30.0
+
+
+def http_client_from_env() -> httpx.AsyncClient:
+    """Connection pool shared by every OpenAI call made from this process."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+
+
+def openai_client_from_env(http_client: httpx.AsyncClient) -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        api_key=os.environ["AZURE_OPENAI_API_KEY"],
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
+        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+        http_client=http_client,
+        # Retries are ours (upstream_retry), so they stay within the request deadline
+        max_retries=0,
+    )
 
-openai_client = AzureOpenAI(
-    api_key=os.environ["AZURE_OPENAI_API_KEY"],
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
-    azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-)
 
-deployment_name = os.environ["AZURE_OPENAI_EMBED_DEPLOYMENT"]
-CHAT_DEPLOYMENT = os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"]
+def upstream_retry(dependency: str):
+    """Exponential back-off until the request deadline (5 attempts outside a request)."""
+    return retry(
+        wait=wait_exponential(multiplier=1, min=2, max=15),
+        stop=stop_at_deadline(5),
+        before_sleep=count_retry(dependency),
+        reraise=True,
+    )
+
 
 GROUNDED_PROMPT = """
 You are an AI assistant.
@@ -52,58 +107,587 @@ Sources:
 Question: {query}
 """
 
+# Conversations put everything that stays the same between turns first (instructions,
+# then sources), then the turns so far, then the new question, so a follow-up that reuses
+# the sources repeats the previous prompt as its prefix and Azure OpenAI's prompt cache
+# (1024 tokens and up) serves it
+CHAT_SYSTEM_PROMPT = """
+You are an AI assistant in a conversation.
+Answer the latest question using only the sources provided and the conversation so far.
+- Use bullet points if there are multiple facts.
+- If the answer is longer than 3 sentences, give a short summary.
+- Always cite the source.
+- If the sources don’t have enough info, say “I don’t know.”
+Sources:
+{sources}
+"""
+
+CONDENSE_PROMPT = """
+Rewrite the last question of this conversation as a standalone search query.
+Use the conversation only to resolve what the question refers to. Reply with the query alone.
 
-def truncate_to_tokens(text: str, max_tokens: int = 250):
-    enc = tiktoken.encoding_for_model("gpt-35-turbo")
-    tokens = enc.encode(text)
-    return enc.decode(tokens[:max_tokens])
+{history}
+
+Last question: {question}
+"""
 
 
 class RAGService:
-    def __init__(self):
-        self.index = os.environ["AZURE_SEARCH_INDEX"]
+    """Async RAG pipeline: embed the query, search the index, ground a chat completion.
+
+    All network calls go through the async OpenAI client and the configured
+    retrievers so a slow completion never blocks the event loop; the clients
+    keep a pooled connection set shared by every request of this process.
+    A query searches ``SearchOptions.indexes`` (the default index when
+    empty), in parallel when there are several. ``chat`` answers the turns
+    of a server-side conversation (``sessions.py``).
+    """
 
-        # Configure retry policy for Azure Search
-        self.search_client = search_client
-        self.openai_client = openai_client
+    def __init__(self):
+        # Allowed indexes and tenants, and a retriever per index (Azure AI Search,
+        # or local vector indexes with RETRIEVER_BACKEND=local) created on first use
+        self.router = router_from_env()
+        self.index = self.router.default
+        self.retrievers = pool_from_env(self.index)
+        self.http_client = http_client_from_env()
+        self.openai_client = openai_client_from_env(self.http_client)
         self.deployment_name = os.environ["AZURE_OPENAI_EMBED_DEPLOYMENT"]
+        # EMBED_DIMENSIONS: vectors of the size the index was built with
+        self.embed_params = dimensions_param()
+        # Query-embedding cache namespace; a different size must not reuse cached vectors
+        self.embedding_model = (
+            f"{self.deployment_name}@{self.embed_params['dimensions']}" if self.embed_params else self.deployment_name
+        )
         self.chat_deployment = os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"]
+        # Per-deployment RPM/TPM budgets (AZURE_OPENAI_EMBED_* / AZURE_OPENAI_CHAT_*), unlimited when unset
+        self.embed_limiter = limiter_for(self.deployment_name, "AZURE_OPENAI_EMBED")
+        self.chat_limiter = limiter_for(self.chat_deployment, "AZURE_OPENAI_CHAT")
+        # Query vectors do not depend on the index; answers are cached per set of indexes
+        self.embedding_cache = query_cache_from_env()
+        self.answer_caches = answer_caches_from_env()
+        # Conversations of /api/v1/chat: turns so far and the sources of the latest answer
+        self.sessions = sessions_from_env()
+        self.reranker = reranker_from_env()
+        # Identical concurrent answer() calls share one embed/search/chat pass
+        self.in_flight = SingleFlight()
+        # Step -> {"status": "pending" | "ok" | "error", ...}, reported by /ready
+        self.warm_state: Dict[str, Dict[str, Any]] = {}
+
+    @cached_property
+    def template_tokens(self) -> int:
+        return count_tokens(GROUNDED_PROMPT.format(query="", sources=""))
+
+    @cached_property
+    def chat_template_tokens(self) -> int:
+        # + role markup of the system message and the new question
+        return count_tokens(CHAT_SYSTEM_PROMPT.format(sources="")) + 8
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.warm_state) and all(step["status"] == "ok" for step in self.warm_state.values())
+
+    def _load_tokenizer(self) -> None:
+        get_encoding()
+        token_byte_lengths()  # used when pack_context cuts a source
+        self.template_tokens
+        self.chat_template_tokens
+
+    async def _open_openai_connection(self) -> None:
+        # Any HTTP response means DNS, TCP and TLS are done and the connection
+        # is back in the pool; only transport errors fail this step
+        await self.http_client.get(str(self.openai_client.base_url), timeout=WARM_UP_TIMEOUT)
+
+    async def _warm_step(self, name: str, warm: Callable[[], Awaitable[None]]) -> None:
+        backoff = 1.0
+        while True:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(warm(), WARM_UP_TIMEOUT)
+            except Exception as e:
+                self.warm_state[name] = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, WARM_UP_MAX_BACKOFF)
+            else:
+                self.warm_state[name] = {"status": "ok", "seconds": round(time.perf_counter() - start, 3)}
+                return
+
+    async def warm_up(self) -> None:
+        """Load the tokenizer and open upstream connections before taking traffic.
+
+        Failed steps are retried with backoff until they succeed; ``ready`` is
+        true once every step has.
+        """
+        steps: Dict[str, Callable[[], Awaitable[None]]] = {
+            "tokenizer": lambda: asyncio.to_thread(self._load_tokenizer),
+            "retriever": lambda: self.retrievers.warm_up(self.index),
+            "openai": self._open_openai_connection,
+        }
+        if DEFAULT_RERANK == "cross-encoder":
+            steps["cross_encoder"] = lambda: asyncio.to_thread(self.reranker.cross_encoder.load)
+        self.warm_state = {name: {"status": "pending"} for name in steps}
+        await asyncio.gather(*(self._warm_step(name, warm) for name, warm in steps.items()))
+
+    async def _limited(self, dependency: str, limiter: RateLimiter, tokens: int, create, **kwargs) -> Any:
+        """Run an OpenAI ``with_raw_response`` call inside ``limiter``'s budget."""
+        await within_deadline(limiter.acquire_async(tokens))
+        left = remaining()
+        if left is not None:
+            kwargs["timeout"] = left
+        request_id = current_request_id()
+        if request_id:
+            kwargs["extra_headers"] = {"x-ms-client-request-id": request_id}
+        try:
+            raw = await create(**kwargs)
+        except RateLimitError as e:
+            UPSTREAM_THROTTLED.labels(dependency).inc()
+            await limiter.update_from_headers_async(e.response.headers)
+            raise
+        await limiter.update_from_headers_async(raw.headers)
+        response = raw.parse()
+        # Streams carry no usage; query_stream counts their tokens itself
+        record_usage(getattr(response, "usage", None))
+        return response
+
+    async def _get_embeddings(self, query: str) -> List[float]:
+        with span("embed"):
+            embedding = await self.embedding_cache.get(query, self.embedding_model)
+            if embedding is None:
+                embedding = await self._embed(query)
+                await self.embedding_cache.put(query, self.embedding_model, embedding)
+        return embedding
+
+    async def _get_embeddings_batch(self, queries: List[str]) -> List[Any]:
+        """Embed many queries with as few API calls as possible.
+
+        Returns one vector per query, or the exception raised for the batch it
+        was part of, so one failed call only fails the queries it carried.
+        """
+        results: List[Any] = [None] * len(queries)
+        # Cache key -> positions, so case/whitespace variants are embedded once
+        missing: Dict[str, List[int]] = {}
+        for i, q in enumerate(queries):
+            embedding = await self.embedding_cache.get(q, self.embedding_model)
+            if embedding is not None:
+                results[i] = embedding
+            else:
+                missing.setdefault(self.embedding_cache.key(q, self.embedding_model), []).append(i)
+
+        positions = list(missing.values())
+        for start in range(0, len(positions), QUERY_BATCH_EMBED_SIZE):
+            batch = positions[start:start + QUERY_BATCH_EMBED_SIZE]
+            texts = [queries[p[0]] for p in batch]
+            try:
+                embeddings = await self._embed_many(texts)
+            except Exception as e:
+                embeddings = [e] * len(batch)
+            for text, embedding, group in zip(texts, embeddings, batch):
+                if not isinstance(embedding, Exception):
+                    await self.embedding_cache.put(text, self.embedding_model, embedding)
+                for i in group:
+                    results[i] = embedding
+        return results
+
+    @upstream_retry("openai_embeddings")
+    async def _embed_many(self, texts: List[str]) -> List[List[float]]:
+        response = await self._limited(
+            "openai_embeddings",
+            self.embed_limiter,
+            count_batch_tokens(texts),
+            self.openai_client.embeddings.with_raw_response.create,
+            input=texts,
+            model=self.deployment_name,
+            **self.embed_params,
+        )
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+    @upstream_retry("openai_embeddings")
+    async def _embed(self, query: str) -> List[float]:
+        response = await self._limited(
+            "openai_embeddings",
+            self.embed_limiter,
+            count_tokens(query),
+            self.openai_client.embeddings.with_raw_response.create,
+            input=query,
+            model=self.deployment_name,
+            **self.embed_params,
+        )
+        return response.data[0].embedding
+
+    async def _search_docs(
+        self,
+        embedding: List[float],
+        top: int = 3,
+        query: Optional[str] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> List[Dict[str, Any]]:
+        options = options or SearchOptions()
+        fetch = self.reranker.fetch_size(top, options.rerank)
+        with span("search"):
+            results = await within_deadline(self._search_indexes(embedding, fetch, query, options))
+        if options.rerank == "none":
+            return results
+        with span("rerank"):
+            results = await self.reranker.rerank(options.rerank, query or "", embedding, results, top)
+        for hit in results:
+            hit.pop("contentVector", None)
+        return results
+
+    def _targets(self, options: SearchOptions) -> Tuple[str, ...]:
+        return options.indexes or (self.index,)
 
-    def _get_embeddings(self, query: str):
-        return self.openai_client.embeddings.create(input=query, model=self.deployment_name).data[0].embedding
+    def _answer_cache(self, options: SearchOptions) -> SemanticAnswerCache:
+        return self.answer_caches.get("+".join(self._targets(options)))
 
-    def _search_docs(self, embedding, top: int = 3):
-        vector_query = VectorizedQuery(vector=embedding, k_nearest_neighbors=5, fields="contentVector", kind="vector")
+    async def _search_index(
+        self, index: str, embedding: List[float], top: int, query: Optional[str], options: SearchOptions
+    ) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            async with self.retrievers.lease(index) as retriever:
+                hits = await retriever.search(embedding, top=top, query=query, options=options)
+        except Exception:
+            INDEX_SEARCH_ERRORS.labels(index).inc()
+            raise
+        finally:
+            INDEX_SEARCH_SECONDS.labels(index).observe(time.perf_counter() - start)
+        for hit in hits:
+            hit["index"] = index
+        return hits
 
-        result = search_client.search(
-            search_text=None,
-            vector_queries=[vector_query],
-            select=["id", "title", "source", "chunk_index", "content", "topics"],
-            top=top,
+    async def _search_indexes(
+        self, embedding: List[float], top: int, query: Optional[str], options: SearchOptions
+    ) -> List[Dict[str, Any]]:
+        """Search every target index at once and merge the hits by score.
+
+        An index that fails is left out (and counted in
+        ``rag_index_search_errors_total``) as long as another one answered.
+        """
+        targets = self._targets(options)
+        if len(targets) == 1:
+            return await self._search_index(targets[0], embedding, top, query, options)
+        outcomes = await asyncio.gather(
+            *(self._search_index(index, embedding, top, query, options) for index in targets), return_exceptions=True
+        )
+        rankings = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+        if not rankings:
+            raise outcomes[0]
+        return merge_by_score(*rankings, top=top)
+
+    @upstream_retry("openai_chat")
+    async def _complete(self, messages: List[Dict[str, str]], max_tokens: int = 300, temperature: float = 0.2) -> Any:
+        return await self._limited(
+            "openai_chat",
+            self.chat_limiter,
+            sum(count_tokens(m["content"]) for m in messages) + max_tokens,
+            self.openai_client.chat.completions.with_raw_response.create,
+            messages=messages,
+            model=self.chat_deployment,
+            max_tokens=max_tokens,
+            temperature=temperature,
         )
 
-        return result
+    async def _chat(self, prompt: str, max_tokens: int = 300) -> Any:
+        return await self._complete([{"role": "user", "content": prompt}], max_tokens)
 
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=15), stop=stop_after_attempt(5))
-    def _chat(self, prompt: str, max_tokens: int = 300) -> Tuple[Any, int]:
-        return self.openai_client.chat.completions.create(
+    @upstream_retry("openai_chat")
+    async def _chat_stream(self, prompt: str, max_tokens: int = 300) -> AsyncStream:
+        # Only opening the stream is retried; once tokens flow they go straight to the client
+        return await self._limited(
+            "openai_chat",
+            self.chat_limiter,
+            count_tokens(prompt) + max_tokens,
+            self.openai_client.chat.completions.with_raw_response.create,
             messages=[{"role": "user", "content": prompt}],
             model=self.chat_deployment,
             max_tokens=max_tokens,
             temperature=0.2,
+            stream=True,
         )
 
-    def query(self, query: str, top: int = 3, max_tokens: int = 300):
-        embedding = self._get_embeddings(query)
-        results = self._search_docs(embedding, top=top)
+    def _context_budget(
+        self,
+        query: str,
+        max_tokens: int,
+        context_tokens: Optional[int] = None,
+        history_tokens: int = 0,
+        template_tokens: Optional[int] = None,
+    ) -> int:
+        """Prompt tokens for sources: the requested budget, capped by what the context window leaves.
 
-        sources_formatted = "=================\n".join([f"TITLE: {document['title']}, CONTENT: {truncate_to_tokens(document['content'], 250)}" for document in results])
+        ``template_tokens`` is the cost of the prompt around the sources, by default ``GROUNDED_PROMPT``'s.
+        """
+        if template_tokens is None:
+            template_tokens = self.template_tokens
+        room = CHAT_CONTEXT_TOKENS - max_tokens - template_tokens - count_tokens(query) - history_tokens
+        return max(0, min(context_tokens or PROMPT_TOKEN_BUDGET, room))
+
+    @staticmethod
+    def _sources(context: PackedContext) -> List[Dict[str, Any]]:
+        return [source.to_dict() for source in context.sources]
+
+    @staticmethod
+    def _build_prompt(query: str, context: PackedContext) -> str:
+        return GROUNDED_PROMPT.format(query=query, sources=context.text)
+
+    async def _answer(
+        self,
+        query: str,
+        embedding: List[float],
+        top: int,
+        max_tokens: int,
+        context_tokens: Optional[int] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> CachedAnswer:
+        options = options or SearchOptions()
+        budget = self._context_budget(query, max_tokens, context_tokens)
+
+        # Paraphrases of an already answered question skip search and chat entirely
+        answer_cache = self._answer_cache(options)
+        cached = answer_cache.lookup(embedding, top, max_tokens, budget, options.cache_key)
+        if cached is not None:
+            return cached
+
+        results = await self._search_docs(embedding, top=top, query=query, options=options)
+        with span("pack"):
+            context = pack_context(results, budget)
 
         # Chat call
-        response = self._chat(
-            GROUNDED_PROMPT.format(query=query, sources=sources_formatted),
-            max_tokens=max_tokens
+        prompt = self._build_prompt(query, context)
+        with span("chat"):
+            response = await self._chat(prompt, max_tokens=max_tokens)
+
+        answer = response.choices[0].message.content
+        sources = self._sources(context)
+        answer_cache.put(embedding, sources, answer, top, max_tokens, budget, options.cache_key)
+        return CachedAnswer(answer, sources)
+
+    async def answer(
+        self,
+        query: str,
+        top: int = 3,
+        max_tokens: int = 300,
+        context_tokens: Optional[int] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> CachedAnswer:
+        """Answer ``query`` along with the sources it was grounded on and their token usage.
+
+        Concurrent calls for the same normalized query and parameters are
+        coalesced: one computes the answer and every caller receives it.
+        """
+        options = options or SearchOptions()
+        key = (normalize_query(query), top, max_tokens, context_tokens, options.cache_key)
+
+        async def compute() -> CachedAnswer:
+            embedding = await self._get_embeddings(query)
+            return await self._answer(query, embedding, top, max_tokens, context_tokens, options)
+
+        with span("total"):
+            return await self.in_flight.do(key, compute)
+
+    async def query(
+        self,
+        query: str,
+        top: int = 3,
+        max_tokens: int = 300,
+        context_tokens: Optional[int] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> str:
+        return (await self.answer(query, top, max_tokens, context_tokens, options)).answer
+
+    async def query_batch(
+        self,
+        queries: List[str],
+        top: int = 3,
+        max_tokens: int = 300,
+        concurrency: int = 8,
+        context_tokens: Optional[int] = None,
+        options: Optional[SearchOptions] = None,
+        admission: Optional[AdaptiveLimiter] = None,
+        deadline: Optional[float] = None,
+    ) -> List[Any]:
+        """Answer many queries, returning an answer or an exception per query, in order.
+
+        Embeddings are requested in batches, then at most ``concurrency``
+        queries are answered at once. With ``admission``, each of them takes
+        a slot like a single query would (``Overloaded`` when refused), and
+        with ``deadline`` each gets that many seconds from when it starts.
+        """
+        with span("embed"):
+            embeddings = await self._get_embeddings_batch(queries)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def answer_one(query: str, embedding: Any) -> str:
+            if isinstance(embedding, Exception):
+                raise embedding
+            async with slots:
+                # Each query runs in its own task, so this deadline is its own
+                if deadline is not None:
+                    set_deadline(deadline)
+                ticket = await admission.acquire() if admission is not None else None
+                try:
+                    return (await self._answer(query, embedding, top, max_tokens, context_tokens, options)).answer
+                except Exception:
+                    if ticket is not None:
+                        ticket.ok = False
+                    raise
+                finally:
+                    if ticket is not None:
+                        admission.release(ticket)
+
+        return await asyncio.gather(
+            *(answer_one(q, e) for q, e in zip(queries, embeddings)), return_exceptions=True
         )
 
-        # print("💬 Model response:", response.choices[0].message.content)
-        return response.choices[0].message.content
+    async def query_stream(
+        self,
+        query: str,
+        top: int = 3,
+        max_tokens: int = 300,
+        context_tokens: Optional[int] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield ``sources`` first, then ``token`` events as the model emits them.
+
+        Closing the generator (e.g. because the client disconnected) closes the
+        upstream completion stream, so no more tokens are generated or billed.
+        """
+        with span("total"):
+            options = options or SearchOptions()
+            embedding = await self._get_embeddings(query)
+            budget = self._context_budget(query, max_tokens, context_tokens)
+
+            answer_cache = self._answer_cache(options)
+            cached = answer_cache.lookup(embedding, top, max_tokens, budget, options.cache_key)
+            if cached is not None:
+                yield {"event": "sources", "data": cached.sources}
+                yield {"event": "token", "data": cached.answer}
+                return
+
+            results = await self._search_docs(embedding, top=top, query=query, options=options)
+            with span("pack"):
+                context = pack_context(results, budget)
+            sources = self._sources(context)
+            yield {"event": "sources", "data": sources}
+
+            prompt = self._build_prompt(query, context)
+            parts: List[str] = []
+            completed = False
+            with span("chat"):
+                stream = await self._chat_stream(prompt, max_tokens=max_tokens)
+                try:
+                    async for chunk in stream:
+                        # Azure sends content-filter chunks without choices
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            yield {"event": "token", "data": delta}
+                    completed = True
+                finally:
+                    await stream.close()
+                    # Streamed completions carry no usage; count what was sent and received
+                    TOKENS.labels("prompt").inc(count_tokens(prompt))
+                    TOKENS.labels("completion").inc(count_tokens("".join(parts)))
+
+            if completed:
+                answer_cache.put(embedding, sources, "".join(parts), top, max_tokens, budget, options.cache_key)
+
+    async def _condense(self, session: Session, message: str) -> str:
+        """``message`` as a query that can be searched without the conversation."""
+        if not session.turns or CHAT_CONDENSE == "none":
+            return message
+        if CHAT_CONDENSE == "last":
+            return f"{session.turns[-1].question} {message}"
+        history = "\n".join(
+            f"User: {turn.question}\nAssistant: {turn.answer[:CONDENSE_ANSWER_CHARS]}"
+            for turn in list(session.turns)[-CONDENSE_TURNS:]
+        )
+        prompt = CONDENSE_PROMPT.format(history=history, question=message)
+        with span("condense"):
+            response = await self._complete([{"role": "user", "content": prompt}], CONDENSE_MAX_TOKENS, temperature=0.0)
+        return (response.choices[0].message.content or "").strip() or message
+
+    @staticmethod
+    def _chat_messages(context: PackedContext, history: List[Turn], message: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT.format(sources=context.text)}]
+        for turn in history:
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.answer})
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    async def chat(
+        self,
+        session: Session,
+        message: str,
+        top: int = 3,
+        max_tokens: int = 300,
+        context_tokens: Optional[int] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> ChatAnswer:
+        """Answer the next turn of ``session``.
+
+        A follow-up is condensed into a standalone query first. When the
+        sources of the previous answer still cover that query (same retrieval
+        options, see ``sessions.coverage``) they are reused, skipping embed
+        and search; otherwise the query is retrieved like ``answer`` does.
+        Conversations bypass the answer cache: an answer depends on the turns
+        before it.
+        """
+        options = options or SearchOptions()
+        async with session.lock:
+            with span("total"):
+                history = session.history(CHAT_HISTORY_TOKENS)
+                query = await self._condense(session, message)
+                retrieval_key = (options.cache_key, top)
+                context = session.context
+                reuse = (
+                    context is not None
+                    and session.retrieval_key == retrieval_key
+                    and coverage(query, session.covered) >= CHAT_SOURCE_COVERAGE
+                )
+                if not reuse:
+                    history_tokens = sum(turn.tokens for turn in history)
+                    budget = self._context_budget(
+                        message, max_tokens, context_tokens, history_tokens, self.chat_template_tokens
+                    )
+                    embedding = await self._get_embeddings(query)
+                    results = await self._search_docs(embedding, top=top, query=query, options=options)
+                    with span("pack"):
+                        context = pack_context(results, budget)
+                CHAT_TURNS.labels("reused" if reuse else "retrieved").inc()
+
+                with span("chat"):
+                    response = await self._complete(self._chat_messages(context, history, message), max_tokens)
+                answer = response.choices[0].message.content or ""
+                sources = self._sources(context)
+                session.turns.append(
+                    Turn(
+                        question=message,
+                        query=query,
+                        answer=answer,
+                        source_ids=[doc_id for source in context.sources for doc_id in source.ids],
+                        tokens=count_tokens(message) + count_tokens(answer) + 8,  # + role markup of two messages
+                    )
+                )
+                session.answered += 1
+                if not reuse:
+                    session.set_sources(query, context, retrieval_key)
+                await self.sessions.save(session)
+        return ChatAnswer(answer, sources, query, retrieved=not reuse)
+
+    async def invalidate_chunks(self, doc_ids: List[str]) -> int:
+        """Forget cached answers citing any of ``doc_ids`` (called after re-ingestion).
+
+        Conversations citing them lose their sources too, so their next turn retrieves.
+        """
+        await self.sessions.invalidate(doc_ids)
+        return self.answer_caches.invalidate(doc_ids)
+
+    async def close(self) -> None:
+        """Release the pooled connections held by the shared clients."""
+        await self.retrievers.close()
+        await self.openai_client.close()
+        await self.embedding_cache.close()
+        await self.sessions.close()
@@ -0,0 +1,278 @@
+"""Request- and token-aware rate limiting for Azure OpenAI deployments.
+
+Azure OpenAI enforces both requests per minute (RPM) and tokens per minute
+(TPM) per deployment. ``RateLimiter`` keeps one token bucket for each, refilled
+continuously, and makes callers wait until a request of a given token cost
+fits both. It works from threads (``acquire``) and coroutines
+(``acquire_async``), and tightens its budget from the
+``x-ratelimit-remaining-*`` and ``retry-after`` response headers
+(``update_from_headers`` / ``update_from_headers_async``).
+
+A budget is opt-in: ``limiter_for`` reads ``<prefix>_RPM`` / ``<prefix>_TPM``,
+and a limit that is not set is not enforced (with neither set, the limiter
+lets everything through). Set them to a share of the deployment's quota
+when several pods or processes draw from it.
+
+Bucket state lives in a backend. ``LocalBackend`` is per-process;
+``FileBackend`` keeps the state in a locked file so several processes on one
+host (ingestion workers, uvicorn workers) draw from the same budget. Anything
+implementing ``RateLimitBackend`` (e.g. a Redis script) can be plugged in to
+share it across hosts. A backend that does I/O sets ``blocking``; the async
+methods then call it from a worker thread so it never stalls the event loop.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Protocol, Tuple
+
+# Per key: [request level, token level, last refill time, blocked until]
+BucketState = List[float]
+
+
+def _refill(state: Optional[BucketState], rpm: int, tpm: int, now: float) -> BucketState:
+    if state is None:
+        return [float(rpm), float(tpm), now, 0.0]
+    requests, tokens, updated, blocked_until = state
+    elapsed = max(0.0, now - updated)
+    return [
+        min(float(rpm), requests + elapsed * rpm / 60),
+        min(float(tpm), tokens + elapsed * tpm / 60),
+        now,
+        blocked_until,
+    ]
+
+
+def _reserve(state: BucketState, requests: int, tokens: int, rpm: int, tpm: int, now: float) -> float:
+    """Deduct the cost from ``state`` and return 0, or return how long to wait."""
+    if now < state[3]:
+        return state[3] - now
+    tokens = min(tokens, tpm)  # a single oversized call must still be able to pass
+    if state[0] >= requests and state[1] >= tokens:
+        state[0] -= requests
+        state[1] -= tokens
+        return 0.0
+    return max((requests - state[0]) * 60 / rpm, (tokens - state[1]) * 60 / tpm, 0.01)
+
+
+def _clamp(
+    state: BucketState,
+    remaining_requests: Optional[int],
+    remaining_tokens: Optional[int],
+    retry_after: Optional[float],
+    now: float,
+) -> None:
+    if remaining_requests is not None:
+        state[0] = min(state[0], float(remaining_requests))
+    if remaining_tokens is not None:
+        state[1] = min(state[1], float(remaining_tokens))
+    if retry_after is not None:
+        state[3] = max(state[3], now + retry_after)
+
+
+class RateLimitBackend(Protocol):
+    blocking: bool  # True when calls may block on I/O or other processes
+
+    def reserve(self, key: str, requests: int, tokens: int, rpm: int, tpm: int) -> float:
+        """Atomically take ``requests``/``tokens`` from ``key``; return 0 or seconds to wait."""
+
+    def clamp(
+        self,
+        key: str,
+        rpm: int,
+        tpm: int,
+        remaining_requests: Optional[int],
+        remaining_tokens: Optional[int],
+        retry_after: Optional[float],
+    ) -> None:
+        """Lower the buckets of ``key`` to what the service reports as remaining."""
+
+
+class LocalBackend:
+    """In-process bucket state shared by every thread and coroutine."""
+
+    blocking = False
+
+    def __init__(self):
+        self._state: Dict[str, BucketState] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, requests: int, tokens: int, rpm: int, tpm: int) -> float:
+        with self._lock:
+            now = time.time()
+            state = self._state[key] = _refill(self._state.get(key), rpm, tpm, now)
+            return _reserve(state, requests, tokens, rpm, tpm, now)
+
+    def clamp(self, key, rpm, tpm, remaining_requests, remaining_tokens, retry_after) -> None:
+        with self._lock:
+            now = time.time()
+            state = self._state[key] = _refill(self._state.get(key), rpm, tpm, now)
+            _clamp(state, remaining_requests, remaining_tokens, retry_after, now)
+
+
+class FileBackend:
+    """Bucket state in a JSON file guarded by ``flock``, shared by processes on one host.
+
+    Point it at a tmpfs path (e.g. ``/dev/shm/rag-ratelimit.json``) to keep it
+    in shared memory.
+    """
+
+    blocking = True
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch(exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _update(self, key: str, rpm: int, tpm: int, apply) -> float:
+        with self._lock, open(self.path, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                raw = f.read()
+                all_state = json.loads(raw) if raw else {}
+                now = time.time()
+                state = _refill(all_state.get(key), rpm, tpm, now)
+                result = apply(state, now)
+                all_state[key] = state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(all_state))
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reserve(self, key: str, requests: int, tokens: int, rpm: int, tpm: int) -> float:
+        return self._update(key, rpm, tpm, lambda state, now: _reserve(state, requests, tokens, rpm, tpm, now))
+
+    def clamp(self, key, rpm, tpm, remaining_requests, remaining_tokens, retry_after) -> None:
+        self._update(
+            key, rpm, tpm,
+            lambda state, now: _clamp(state, remaining_requests, remaining_tokens, retry_after, now),
+        )
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """Enforce an RPM and TPM budget for one deployment; ``None`` leaves that dimension unlimited."""
+
+    def __init__(
+        self,
+        rpm: Optional[int],
+        tpm: Optional[int],
+        key: str = "default",
+        backend: Optional[RateLimitBackend] = None,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.key = key
+        self.backend = backend or LocalBackend()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rpm is not None or self.tpm is not None
+
+    def _cost(self, tokens: int) -> Tuple[int, int, int, int]:
+        # An unlimited dimension costs nothing out of a bucket that never runs dry
+        requests, rpm = (1, self.rpm) if self.rpm is not None else (0, 1)
+        tokens, tpm = (tokens, self.tpm) if self.tpm is not None else (0, 1)
+        return requests, tokens, rpm, tpm
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block the calling thread until a request costing ``tokens`` fits the budget."""
+        if not self.enabled:
+            return
+        while True:
+            wait = self.backend.reserve(self.key, *self._cost(tokens))
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        """Like ``acquire`` but yields to the event loop while waiting."""
+        if not self.enabled:
+            return
+        while True:
+            if self.backend.blocking:
+                wait = await asyncio.to_thread(self.backend.reserve, self.key, *self._cost(tokens))
+            else:
+                wait = self.backend.reserve(self.key, *self._cost(tokens))
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Adapt the budget to ``x-ratelimit-remaining-*`` and ``retry-after`` headers."""
+        clamp = self._clamp_args(headers)
+        if clamp is not None:
+            self.backend.clamp(self.key, *clamp)
+
+    async def update_from_headers_async(self, headers: Mapping[str, str]) -> None:
+        """Like ``update_from_headers`` but keeps a blocking backend off the event loop."""
+        clamp = self._clamp_args(headers)
+        if clamp is None:
+            return
+        if self.backend.blocking:
+            await asyncio.to_thread(self.backend.clamp, self.key, *clamp)
+        else:
+            self.backend.clamp(self.key, *clamp)
+
+    def _clamp_args(
+        self, headers: Mapping[str, str]
+    ) -> Optional[Tuple[int, int, Optional[int], Optional[int], Optional[float]]]:
+        """``clamp`` arguments after ``key`` for ``headers``, or ``None`` when there is nothing to apply."""
+        if not self.enabled:
+            return None
+        remaining_requests = _header_number(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_number(headers, "x-ratelimit-remaining-tokens")
+        retry_after = _header_number(headers, "retry-after-ms")
+        if retry_after is not None:
+            retry_after /= 1000
+        else:
+            retry_after = _header_number(headers, "retry-after")
+        if remaining_requests is None and remaining_tokens is None and retry_after is None:
+            return None
+        _, _, rpm, tpm = self._cost(0)
+        return (
+            rpm,
+            tpm,
+            int(remaining_requests) if remaining_requests is not None and self.rpm is not None else None,
+            int(remaining_tokens) if remaining_tokens is not None and self.tpm is not None else None,
+            retry_after,
+        )
+
+
+_default_backend: Optional[RateLimitBackend] = None
+
+
+def backend_from_env() -> RateLimitBackend:
+    """Share one backend per process; ``RATE_LIMIT_STATE_FILE`` selects the file backend."""
+    global _default_backend
+    if _default_backend is None:
+        state_file = os.getenv("RATE_LIMIT_STATE_FILE")
+        _default_backend = FileBackend(Path(state_file)) if state_file else LocalBackend()
+    return _default_backend
+
+
+def limiter_for(deployment: str, prefix: str) -> RateLimiter:
+    """Build the limiter for a deployment from ``<prefix>_RPM`` / ``<prefix>_TPM`` (unset: unlimited)."""
+    rpm, tpm = os.getenv(f"{prefix}_RPM"), os.getenv(f"{prefix}_TPM")
+    return RateLimiter(
+        rpm=int(rpm) if rpm else None,
+        tpm=int(tpm) if tpm else None,
+        key=deployment,
+        backend=backend_from_env(),
+    )
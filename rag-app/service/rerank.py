@@ -0,0 +1,195 @@
+"""Optional local rerank stage between retrieval and context packing.
+
+RAGService over-fetches ``RERANK_CANDIDATES`` hits and rescores them here:
+
+- ``bm25``: BM25 over the candidates' title + content (statistics from the
+  candidate set), fused with the retriever's order by Reciprocal Rank Fusion
+  so lexical matches sharpen, rather than replace, the vector ranking
+- ``mmr``: Maximal Marginal Relevance on the returned ``contentVector``s,
+  trading query similarity against redundancy with already picked hits
+- ``cross-encoder``: a small CPU cross-encoder scoring (query, chunk) pairs;
+  needs ``sentence-transformers`` (not in the lockfile, it pulls in torch)
+
+Every rerank runs in a worker thread under ``RERANK_BUDGET_MS``. Scorers
+check the deadline between steps, and the caller stops waiting when it
+passes; either way the retriever's original order is used instead.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import numpy as np
+
+from local_index import BM25_B, BM25_K1, terms
+
+logger = logging.getLogger(__name__)
+
+# Failures are counted in rag_rerank_errors_total; at most one is logged per interval
+ERROR_LOG_INTERVAL = 60.0
+
+RERANK_STRATEGIES = ("none", "bm25", "mmr", "cross-encoder")
+DEFAULT_RERANK = os.getenv("RERANK_STRATEGY", "none")
+RRF_K = 60
+
+
+class RerankTimeout(Exception):
+    pass
+
+
+def _check(deadline: float) -> None:
+    if time.monotonic() > deadline:
+        raise RerankTimeout()
+
+
+def bm25_order(query: str, hits: List[Dict[str, Any]], deadline: float) -> List[int]:
+    docs = [Counter(terms(f"{h.get('title') or ''} {h.get('content') or ''}")) for h in hits]
+    _check(deadline)
+    lengths = np.array([sum(d.values()) for d in docs], dtype=np.float32)
+    avg_length = float(lengths.mean()) or 1.0
+    scores = np.zeros(len(hits), dtype=np.float32)
+    for term in set(terms(query)):
+        tf = np.array([d.get(term, 0) for d in docs], dtype=np.float32)
+        df = int((tf > 0).sum())
+        if not df:
+            continue
+        idf = math.log(1 + (len(hits) - df + 0.5) / (df + 0.5))
+        scores += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length))
+    lexical_rank = np.empty(len(hits), dtype=np.int64)
+    lexical_rank[np.argsort(-scores, kind="stable")] = np.arange(1, len(hits) + 1)
+    fused = [1 / (RRF_K + i + 1) + 1 / (RRF_K + lexical_rank[i]) for i in range(len(hits))]
+    return sorted(range(len(hits)), key=lambda i: fused[i], reverse=True)
+
+
+def mmr_order(embedding: List[float], hits: List[Dict[str, Any]], top: int, deadline: float, lambda_: float) -> List[int]:
+    if any(h.get("contentVector") is None for h in hits):
+        raise ValueError("MMR needs contentVector on every candidate")
+    vectors = np.asarray([h["contentVector"] for h in hits], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(embedding, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    picked: List[int] = []
+    remaining = list(range(len(hits)))
+    redundancy = np.full(len(hits), -np.inf, dtype=np.float32)
+    while remaining and len(picked) < top:
+        _check(deadline)
+        penalty = np.where(np.isinf(redundancy[remaining]), 0.0, redundancy[remaining])
+        scores = lambda_ * relevance[remaining] - (1 - lambda_) * penalty
+        best = remaining.pop(int(np.argmax(scores)))
+        picked.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked + remaining
+
+
+class CrossEncoderScorer:
+    """Lazily loaded ``sentence_transformers.CrossEncoder``."""
+
+    def __init__(self, model_name: str, batch_size: int = 8):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+
+                self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def order(self, query: str, hits: List[Dict[str, Any]], deadline: float) -> List[int]:
+        model = self.load()
+        scores: List[float] = []
+        for start in range(0, len(hits), self.batch_size):
+            _check(deadline)
+            batch = hits[start:start + self.batch_size]
+            scores.extend(float(s) for s in model.predict([(query, h.get("content") or "") for h in batch]))
+        return sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)
+
+
+class Reranker:
+    def __init__(
+        self,
+        candidates: int = 20,
+        budget_ms: float = 150,
+        mmr_lambda: float = 0.7,
+        cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    ):
+        self.candidates = candidates
+        self.budget = budget_ms / 1000
+        self.mmr_lambda = mmr_lambda
+        self.cross_encoder = CrossEncoderScorer(cross_encoder_model)
+        self.runs = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self._error_logged_at = float("-inf")
+
+    def fetch_size(self, top: int, strategy: str) -> int:
+        """How many hits to retrieve so the reranker has something to choose from."""
+        return top if strategy == "none" else max(top, self.candidates)
+
+    def _order(self, strategy: str, query: str, embedding: List[float], hits: List[Dict[str, Any]], top: int, deadline: float) -> List[int]:
+        if strategy == "bm25":
+            return bm25_order(query, hits, deadline)
+        if strategy == "mmr":
+            return mmr_order(embedding, hits, top, deadline, self.mmr_lambda)
+        return self.cross_encoder.order(query, hits, deadline)
+
+    async def rerank(
+        self, strategy: str, query: str, embedding: List[float], hits: List[Dict[str, Any]], top: int
+    ) -> List[Dict[str, Any]]:
+        """Return the best ``top`` hits, or the first ``top`` in retriever order if the budget runs out."""
+        if strategy == "none" or len(hits) <= 1:
+            return hits[:top]
+
+        self.runs += 1
+        start = time.monotonic()
+        try:
+            order = await asyncio.wait_for(
+                asyncio.to_thread(self._order, strategy, query, embedding, hits, top, start + self.budget),
+                timeout=self.budget,
+            )
+        except (asyncio.TimeoutError, RerankTimeout):
+            self.timeouts += 1
+            return hits[:top]
+        except Exception:
+            self.errors += 1
+            if start - self._error_logged_at >= ERROR_LOG_INTERVAL:
+                self._error_logged_at = start
+                logger.warning(
+                    "Rerank (%s) failed, keeping retriever order (%d failures so far)",
+                    strategy, self.errors, exc_info=True,
+                )
+            return hits[:top]
+        finally:
+            self.total_seconds += time.monotonic() - start
+        return [hits[i] for i in order[:top]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "default": DEFAULT_RERANK,
+            "candidates": self.candidates,
+            "budget_ms": self.budget * 1000,
+            "runs": self.runs,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "avg_ms": round(1000 * self.total_seconds / self.runs, 2) if self.runs else 0.0,
+        }
+
+
+def reranker_from_env() -> Reranker:
+    return Reranker(
+        candidates=int(os.getenv("RERANK_CANDIDATES", "20")),
+        budget_ms=float(os.getenv("RERANK_BUDGET_MS", "150")),
+        mmr_lambda=float(os.getenv("RERANK_MMR_LAMBDA", "0.7")),
+        cross_encoder_model=os.getenv("RERANK_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+    )
@@ -0,0 +1,292 @@
+"""Pluggable retrieval backends for RAGService.
+
+``RETRIEVER_BACKEND=azure`` (default) queries Azure AI Search;
+``RETRIEVER_BACKEND=local`` answers from a ``LocalVectorIndex`` directory
+(``LOCAL_INDEX_DIR``), with no network hop; ``LOCAL_INDEX_QUANTIZATION``
+(``int8`` / ``binary``) scans compact codes and rescores the shortlist.
+A retriever serves one index; ``index_router`` pools them per index and
+``merge_by_score`` combines the hits of a query sent to several.
+
+``SearchOptions.mode`` selects how chunks are retrieved:
+
+- ``vector``: k-nearest-neighbour search on ``contentVector`` only
+- ``keyword``: full-text (BM25) search on the searchable text fields
+- ``hybrid``: both, fused by Reciprocal Rank Fusion
+- ``semantic``: hybrid, re-ranked by the index's semantic configuration.
+  The local backend has no semantic ranker and serves it as ``hybrid``.
+
+``topics`` restricts results to chunks tagged with any of the topics and
+``boost_tags`` applies the index's tag scoring profile to the full-text part.
+``rerank`` is not a retriever setting: RAGService over-fetches and rescores
+the hits locally (rerank.py) before packing them into the prompt.
+"""
+import asyncio
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+import aiohttp
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.policies import AsyncRetryPolicy
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorizedQuery
+
+from local_index import DEFAULT_INDEX_DIR, LocalVectorIndex, local_index_from_env
+from metrics import UPSTREAM_RETRIES, UPSTREAM_THROTTLED, current_request_id
+from rerank import DEFAULT_RERANK, RERANK_STRATEGIES
+from search_schema import SCORING_PROFILE_NAME, SEMANTIC_CONFIG_NAME, TAGS_PARAMETER
+
+SELECT_FIELDS = ["id", "title", "source", "chunk_index", "content", "topics", "token_count", "snippet", "snippet_token_count"]
+
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid", "semantic")
+DEFAULT_RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+
+# Full-text candidates fed into hybrid fusion (Azure uses 50) and the RRF constant
+HYBRID_TEXT_CANDIDATES = 50
+RRF_K = 60
+
+
+@dataclass(frozen=True)
+class SearchOptions:
+    mode: str = DEFAULT_RETRIEVAL_MODE
+    k: Optional[int] = None  # nearest neighbours for the vector query; default max(top, 5)
+    topics: Tuple[str, ...] = ()
+    boost_tags: Tuple[str, ...] = ()
+    rerank: str = DEFAULT_RERANK  # applied by RAGService to over-fetched hits, see rerank.py
+    indexes: Tuple[str, ...] = ()  # searched by RAGService, merged by score; () is the default index
+
+    def __post_init__(self):
+        if self.mode not in RETRIEVAL_MODES:
+            raise ValueError(f"mode must be one of {', '.join(RETRIEVAL_MODES)}")
+        if self.rerank not in RERANK_STRATEGIES:
+            raise ValueError(f"rerank must be one of {', '.join(RERANK_STRATEGIES)}")
+
+    def neighbors(self, top: int) -> int:
+        return self.k or max(top, 5)
+
+    @property
+    def select_fields(self) -> List[str]:
+        # MMR compares candidates with each other, so it needs their vectors
+        return SELECT_FIELDS + ["contentVector"] if self.rerank == "mmr" else SELECT_FIELDS
+
+    @property
+    def cache_key(self) -> str:
+        topics, boost_tags = ",".join(sorted(self.topics)), ",".join(sorted(self.boost_tags))
+        return f"{self.mode}|{self.k}|{topics}|{boost_tags}|{self.rerank}|{'+'.join(self.indexes)}"
+
+
+def topics_filter(topics: Sequence[str]) -> str:
+    """OData filter matching chunks tagged with any of ``topics``."""
+    values = "|".join(topic.replace("'", "''") for topic in topics)
+    return f"topics/any(t: search.in(t, '{values}', '|'))"
+
+
+def reciprocal_rank_fusion(*rankings: List[Dict[str, Any]], top: int, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Fuse ranked hit lists by summing ``1 / (k + rank)``, as Azure's hybrid search does."""
+    hits: Dict[str, Dict[str, Any]] = {}
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            hits.setdefault(hit["id"], hit)
+            scores[hit["id"]] = scores.get(hit["id"], 0.0) + 1.0 / (k + rank)
+    best = sorted(scores, key=scores.get, reverse=True)[:top]
+    return [{**hits[doc_id], "@search.score": scores[doc_id]} for doc_id in best]
+
+
+def merge_by_score(*rankings: List[Dict[str, Any]], top: int) -> List[Dict[str, Any]]:
+    """Interleave the hits of several indexes by ``@search.score``, best first.
+
+    Scores of one query and mode are on the same scale in every index built
+    by create_index.py (cosine similarity, RRF, BM25 or the semantic
+    reranker's 0-4), so they are compared directly rather than re-fused.
+    """
+    hits = [hit for ranking in rankings for hit in ranking]
+    hits.sort(key=lambda hit: hit.get("@search.score") or 0.0, reverse=True)
+    return hits[:top]
+
+
+class Retriever(Protocol):
+    async def search(
+        self,
+        embedding: List[float],
+        top: int = 3,
+        query: Optional[str] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> List[Dict[str, Any]]:
+        """Return the ``top`` chunks for the query, best first, each with ``@search.score``."""
+
+    async def warm_up(self) -> None:
+        """Open connections / load the index so the first query does not pay for it."""
+
+    async def close(self) -> None:
+        ...
+
+
+class AzureSearchRetriever:
+    def __init__(self, client: SearchClient):
+        self.client = client
+
+    async def search(
+        self,
+        embedding: List[float],
+        top: int = 3,
+        query: Optional[str] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> List[Dict[str, Any]]:
+        options = options or SearchOptions()
+        search_text = query if options.mode != "vector" else None
+        kwargs: Dict[str, Any] = {"select": options.select_fields, "top": top}
+        if options.mode != "keyword":
+            kwargs["vector_queries"] = [
+                VectorizedQuery(vector=embedding, k_nearest_neighbors=options.neighbors(top), fields="contentVector", kind="vector")
+            ]
+        if options.mode == "semantic":
+            kwargs.update(query_type="semantic", semantic_configuration_name=SEMANTIC_CONFIG_NAME)
+        if options.topics:
+            kwargs["filter"] = topics_filter(options.topics)
+        if options.boost_tags and search_text:
+            # Scoring profiles only apply to the full-text part of a query
+            kwargs.update(
+                scoring_profile=SCORING_PROFILE_NAME,
+                scoring_parameters=[f"{TAGS_PARAMETER}-{','.join(options.boost_tags)}"],
+            )
+
+        request_id = current_request_id()
+        if request_id:
+            # Sent as x-ms-client-request-id by the SDK's RequestIdPolicy
+            kwargs["request_id"] = request_id
+
+        results = await self.client.search(search_text=search_text, **kwargs)
+        hits = [document async for document in results]
+        for hit in hits:
+            # Rank by the semantic reranker when it ran
+            if hit.get("@search.reranker_score") is not None:
+                hit["@search.score"] = hit["@search.reranker_score"]
+        return hits
+
+    async def warm_up(self) -> None:
+        # Opens the connection and fails fast on a wrong key or index name
+        await self.client.get_document_count()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class LocalRetriever:
+    def __init__(self, index: LocalVectorIndex):
+        self.index = index
+
+    def _search(self, embedding: List[float], top: int, query: Optional[str], options: SearchOptions) -> List[Dict[str, Any]]:
+        if options.mode == "vector":
+            # Like Azure, a pure vector query returns at most k results
+            return self.index.search(embedding, min(top, options.neighbors(top)), options.select_fields, topics=options.topics)
+
+        text_top = top if options.mode == "keyword" else max(top, HYBRID_TEXT_CANDIDATES)
+        text_hits = self.index.keyword_search(
+            query or "", text_top, options.select_fields, topics=options.topics, boost_tags=options.boost_tags
+        )
+        if options.mode == "keyword":
+            return text_hits
+        vector_hits = self.index.search(embedding, options.neighbors(top), options.select_fields, topics=options.topics)
+        return reciprocal_rank_fusion(vector_hits, text_hits, top=top)
+
+    async def search(
+        self,
+        embedding: List[float],
+        top: int = 3,
+        query: Optional[str] = None,
+        options: Optional[SearchOptions] = None,
+    ) -> List[Dict[str, Any]]:
+        # NumPy releases the GIL for the matrix product, so a worker thread keeps the loop free
+        return await asyncio.to_thread(self._search, embedding, top, query, options or SearchOptions())
+
+    async def warm_up(self) -> None:
+        # Page in the vectors and build the BM25 index used by keyword and hybrid queries
+        await asyncio.to_thread(self.index.keyword_search, "warm up", 1)
+        if len(self.index):
+            await asyncio.to_thread(self.index.search, [1.0] * self.index.dim, 1)
+
+    async def close(self) -> None:
+        pass
+
+
+class CountingRetryPolicy(AsyncRetryPolicy):
+    """``AsyncRetryPolicy`` that counts retries and 429s for ``/metrics``."""
+
+    def increment(self, settings, response=None, error=None) -> bool:
+        UPSTREAM_RETRIES.labels("azure_search").inc()
+        # ``response`` is the PipelineRequest when the attempt raised
+        http_response = getattr(response, "http_response", None)
+        if http_response is not None and http_response.status_code == 429:
+            UPSTREAM_THROTTLED.labels("azure_search").inc()
+        return super().increment(settings, response=response, error=error)
+
+
+def azure_search_client(index_name: str, transport: Optional[AioHttpTransport] = None) -> SearchClient:
+    # Configure retry policy for Azure Search
+    search_retry_policy = CountingRetryPolicy(
+        retry_total=3,
+        retry_backoff_factor=1.0,
+        retry_backoff_max=60,
+        retry_on_status_codes=[429, 503, 504]
+    )
+    return SearchClient(
+        endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
+        index_name=index_name,
+        credential=AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"]),
+        retry_policy=search_retry_policy,
+        **({"transport": transport} if transport is not None else {}),
+    )
+
+
+class RetrieverSource(Protocol):
+    async def retriever(self, index_name: str) -> Retriever:
+        """A new retriever for ``index_name``."""
+
+    async def close(self) -> None:
+        """Release what the retrievers share."""
+
+
+class AzureSearchSource:
+    """Retrievers for the indexes of one search service, sharing one aiohttp connection pool."""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def retriever(self, index_name: str) -> Retriever:
+        if self._session is None or self._session.closed:
+            # The settings AioHttpTransport gives its own sessions; azure-core decompresses itself
+            self._session = aiohttp.ClientSession(trust_env=True, cookie_jar=aiohttp.DummyCookieJar(), auto_decompress=False)
+        transport = AioHttpTransport(session=self._session, session_owner=False)
+        return AzureSearchRetriever(azure_search_client(index_name, transport))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+class LocalIndexSource:
+    """``LocalVectorIndex`` directories: LOCAL_INDEX_DIR for the default index, LOCAL_INDEX_ROOT/<name> for others."""
+
+    def __init__(self, default_index: str):
+        self.default_index = default_index
+        self.default_dir = Path(os.getenv("LOCAL_INDEX_DIR", str(DEFAULT_INDEX_DIR)))
+        self.root = Path(os.getenv("LOCAL_INDEX_ROOT", str(self.default_dir.parent)))
+
+    def path(self, index_name: str) -> Path:
+        return self.default_dir if index_name == self.default_index else self.root / index_name
+
+    async def retriever(self, index_name: str) -> Retriever:
+        # Loading reads the documents and maps the vectors: keep it off the event loop
+        return LocalRetriever(await asyncio.to_thread(local_index_from_env, self.path(index_name)))
+
+    async def close(self) -> None:
+        pass
+
+
+def retriever_source_from_env(default_index: str) -> RetrieverSource:
+    if os.getenv("RETRIEVER_BACKEND", "azure") == "local":
+        return LocalIndexSource(default_index)
+    return AzureSearchSource()
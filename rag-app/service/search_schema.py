@@ -0,0 +1,15 @@
+"""Names shared by the index definition and the queries that rely on it.
+
+``create_index.py`` creates the semantic configuration and scoring profile
+that ``retrievers.py`` asks for by name, and ``index_router.py`` only routes
+to index names ``INDEX_NAME_RE`` accepts. Kept free of dependencies so that
+creating an index does not import the async search stack.
+"""
+import re
+
+SEMANTIC_CONFIG_NAME = "my-semantic-config"
+SCORING_PROFILE_NAME = "my-scoring-profile"
+TAGS_PARAMETER = "tags"
+
+# Azure AI Search index names: lower-case letters, digits and dashes; also safe as a directory name
+INDEX_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9-]{0,127}$")
@@ -0,0 +1,311 @@
+"""Server-side conversation state for ``/api/v1/chat``.
+
+A session keeps its last turns and the sources of the latest answer, so a
+follow-up can reuse them instead of searching again. Sessions are evicted
+least-recently-used and expire ``ttl`` seconds after their last turn; with
+``CHAT_SESSION_REDIS_URL`` set they are also saved to Redis, so any replica
+can continue a conversation.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Protocol, Tuple
+
+from context_packer import PackedContext, PackedSource
+from local_index import terms
+
+# Shorter words are mostly function words, present in any source
+COVERAGE_MIN_LENGTH = 4
+
+
+@dataclass
+class Turn:
+    question: str
+    query: str  # standalone form of ``question``, what retrieval used
+    answer: str
+    source_ids: List[str]
+    tokens: int  # question + answer, as replayed in later prompts
+
+
+@dataclass
+class ChatAnswer:
+    answer: str
+    sources: List[Dict[str, Any]]
+    query: str
+    retrieved: bool  # False when the previous turn's sources were reused
+
+
+@dataclass
+class Session:
+    id: str
+    tenant: Optional[str]
+    turns: Deque[Turn]
+    expires_at: float
+    answered: int = 0  # turns so far, including those dropped from ``turns``
+    # Sources of the latest answer, the (retrieval options, top) they were fetched with
+    # and the words they cover (theirs and their query's)
+    context: Optional[PackedContext] = None
+    retrieval_key: Optional[Tuple[str, int]] = None
+    covered: FrozenSet[str] = frozenset()
+    sources_at: float = 0.0  # wall-clock time the sources were set, checked against invalidations
+    # One turn at a time: a turn reads the history the previous one wrote
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def history(self, max_tokens: int) -> List[Turn]:
+        """The most recent turns that fit in ``max_tokens``, oldest first."""
+        kept, used = [], 0
+        for turn in reversed(self.turns):
+            used += turn.tokens
+            if used > max_tokens:
+                break
+            kept.append(turn)
+        return kept[::-1]
+
+    @property
+    def source_ids(self) -> List[str]:
+        return [doc_id for source in self.context.sources for doc_id in source.ids] if self.context else []
+
+    def set_sources(self, query: str, context: PackedContext, retrieval_key: Tuple[str, int]) -> None:
+        self.context, self.retrieval_key = context, retrieval_key
+        self.covered = frozenset(terms(query)) | frozenset(terms(context.text))
+        self.sources_at = time.time()
+
+    def forget_sources(self) -> None:
+        self.context, self.retrieval_key, self.covered = None, None, frozenset()
+
+    def to_record(self) -> Dict[str, Any]:
+        """JSON-serializable state for the shared tier (everything but the id and lock)."""
+        return {
+            "tenant": self.tenant,
+            "turns": [asdict(turn) for turn in self.turns],
+            "answered": self.answered,
+            "context": asdict(self.context) if self.context else None,
+            "retrieval_key": list(self.retrieval_key) if self.retrieval_key else None,
+            "covered": sorted(self.covered),
+            "sources_at": self.sources_at,
+        }
+
+    @classmethod
+    def from_record(cls, session_id: str, record: Dict[str, Any], max_turns: int, expires_at: float) -> "Session":
+        context = record["context"]
+        return cls(
+            id=session_id,
+            tenant=record["tenant"],
+            turns=deque((Turn(**turn) for turn in record["turns"]), maxlen=max_turns),
+            expires_at=expires_at,
+            answered=record["answered"],
+            context=PackedContext(
+                sources=[PackedSource(**source) for source in context["sources"]], budget=context["budget"]
+            ) if context else None,
+            retrieval_key=tuple(record["retrieval_key"]) if record["retrieval_key"] else None,
+            covered=frozenset(record["covered"]),
+            sources_at=record["sources_at"],
+        )
+
+    def update_from(self, other: "Session") -> None:
+        """Take ``other``'s state, keeping this session's lock (callers may be waiting on it)."""
+        for f in fields(self):
+            if f.name != "lock":
+                setattr(self, f.name, getattr(other, f.name))
+
+
+def coverage(query: str, covered: FrozenSet[str]) -> float:
+    """Share of the query's content words among ``covered``."""
+    words = {term for term in terms(query) if len(term) >= COVERAGE_MIN_LENGTH}
+    if not words:
+        return 1.0
+    return len(words & covered) / len(words)
+
+
+class SharedSessionStore(Protocol):
+    async def load(self, session_id: str, ttl: int) -> Optional[Dict[str, Any]]:
+        """The session's record, pushing its expiry ``ttl`` seconds out; ``None`` if gone."""
+
+    async def save(self, session_id: str, record: Dict[str, Any], ttl: int) -> None:
+        ...
+
+    async def delete(self, session_id: str) -> None:
+        ...
+
+    async def mark_stale(self, doc_ids: List[str], ttl: int) -> None:
+        """Record that ``doc_ids`` were re-ingested now."""
+
+    async def stale_since(self, doc_ids: List[str]) -> float:
+        """Latest re-ingestion time of any of ``doc_ids``, 0 if none is marked."""
+
+    async def close(self) -> None:
+        ...
+
+
+class RedisSessionStore:
+    """Shared tier backed by Redis; sessions are stored as JSON.
+
+    Requires the optional ``redis`` dependency (``uv sync --extra redis``).
+    """
+
+    def __init__(self, url: str, prefix: str = "chat:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def load(self, session_id: str, ttl: int) -> Optional[Dict[str, Any]]:
+        raw = await self.client.getex(self.prefix + session_id, ex=ttl)
+        return json.loads(raw) if raw is not None else None
+
+    async def save(self, session_id: str, record: Dict[str, Any], ttl: int) -> None:
+        await self.client.set(self.prefix + session_id, json.dumps(record), ex=ttl)
+
+    async def delete(self, session_id: str) -> None:
+        await self.client.delete(self.prefix + session_id)
+
+    async def mark_stale(self, doc_ids: List[str], ttl: int) -> None:
+        now = time.time()
+        async with self.client.pipeline(transaction=False) as pipe:
+            for doc_id in doc_ids:
+                pipe.set(f"{self.prefix}stale:{doc_id}", now, ex=ttl)
+            await pipe.execute()
+
+    async def stale_since(self, doc_ids: List[str]) -> float:
+        if not doc_ids:
+            return 0.0
+        marks = await self.client.mget([f"{self.prefix}stale:{doc_id}" for doc_id in doc_ids])
+        return max((float(mark) for mark in marks if mark is not None), default=0.0)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class SessionStore:
+    def __init__(
+        self,
+        capacity: int = 10_000,
+        ttl: int = 1800,
+        max_turns: int = 20,
+        shared: Optional[SharedSessionStore] = None,
+    ):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.shared = shared
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidations = 0
+        self.shared_errors = 0
+
+    def _add(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        while len(self._sessions) > self.capacity:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def create(self, tenant: Optional[str] = None) -> Session:
+        """A new, empty session; it reaches the shared tier with its first ``save``."""
+        session = Session(uuid.uuid4().hex, tenant, deque(maxlen=self.max_turns), time.monotonic() + self.ttl)
+        self._add(session)
+        self.created += 1
+        return session
+
+    async def _load(self, session_id: str, session: Optional[Session]) -> Optional[Session]:
+        """Bring ``session`` (or a new local copy) up to date with the shared tier."""
+        try:
+            record = await self.shared.load(session_id, self.ttl)
+            if record is None:
+                # Expired or ended, possibly on another replica
+                self._sessions.pop(session_id, None)
+                return None
+            loaded = Session.from_record(session_id, record, self.max_turns, time.monotonic() + self.ttl)
+            if loaded.context is not None and await self.shared.stale_since(loaded.source_ids) > loaded.sources_at:
+                loaded.forget_sources()
+        except Exception:
+            # Redis unavailable: carry on with what this replica has
+            self.shared_errors += 1
+            return session
+        if session is None:
+            self._add(loaded)
+            return loaded
+        session.update_from(loaded)
+        return session
+
+    async def get(self, session_id: str, tenant: Optional[str] = None) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        # A session with a turn in flight here is newer than its shared copy
+        if self.shared is not None and (session is None or not session.lock.locked()):
+            session = await self._load(session_id, session)
+        if session is None or session.tenant != tenant:
+            return None
+        now = time.monotonic()
+        if session.expires_at < now:
+            del self._sessions[session_id]
+            self.expired += 1
+            return None
+        session.expires_at = now + self.ttl
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def save(self, session: Session) -> None:
+        """Write ``session`` to the shared tier, if any, after a turn."""
+        if self.shared is None:
+            return
+        # Turns are only serialized within a replica: if two replicas answer one session, the later save wins
+        try:
+            await self.shared.save(session.id, session.to_record(), self.ttl)
+        except Exception:
+            self.shared_errors += 1
+
+    async def delete(self, session_id: str, tenant: Optional[str] = None) -> bool:
+        if await self.get(session_id, tenant) is None:
+            return False
+        self._sessions.pop(session_id, None)
+        if self.shared is not None:
+            try:
+                await self.shared.delete(session_id)
+            except Exception:
+                self.shared_errors += 1
+        return True
+
+    async def invalidate(self, doc_ids: List[str]) -> int:
+        """Forget the sources (not the history) of sessions citing any of ``doc_ids``."""
+        stale = set(doc_ids)
+        dropped = 0
+        for session in self._sessions.values():
+            if session.context is not None and stale.intersection(session.source_ids):
+                session.forget_sources()
+                dropped += 1
+        self.invalidations += dropped
+        if self.shared is not None and doc_ids:
+            try:
+                await self.shared.mark_stale(doc_ids, self.ttl)
+            except Exception:
+                self.shared_errors += 1
+        return dropped
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._sessions),
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "invalidations": self.invalidations,
+            "shared_errors": self.shared_errors,
+        }
+
+    async def close(self) -> None:
+        if self.shared is not None:
+            await self.shared.close()
+
+
+def sessions_from_env() -> SessionStore:
+    redis_url = os.getenv("CHAT_SESSION_REDIS_URL")
+    return SessionStore(
+        capacity=int(os.getenv("CHAT_SESSION_CAPACITY", "10000")),
+        ttl=int(os.getenv("CHAT_SESSION_TTL", "1800")),
+        max_turns=int(os.getenv("CHAT_SESSION_MAX_TURNS", "20")),
+        shared=RedisSessionStore(redis_url) if redis_url else None,
+    )
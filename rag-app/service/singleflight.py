@@ -0,0 +1,40 @@
+"""Coalescing of identical in-flight calls ("single flight").
+
+The first caller for a key starts the computation as its own task; callers
+arriving with the same key while it runs await that task instead of starting
+another, and all of them get its result or its exception. The key is
+forgotten as soon as the task finishes, so nothing is cached here.
+
+Waiters await the task through ``asyncio.shield``: a cancelled caller (e.g.
+a client that disconnected) stops waiting without cancelling the work the
+others are waiting for.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if every waiter went away
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,315 @@
+"""Streaming source for ``ingest_so``: threads from a Stack Exchange export.
+
+Reads ``Posts.xml`` of the Stack Exchange data dump (one ``<row .../>`` per
+line) or a JSONL export with one post per line, optionally gzipped. Field
+names are matched case- and underscore-insensitively, so both the dump's
+``PostTypeId`` and a warehouse export's ``post_type_id`` work; records
+without a post type count as questions if they have a title.
+
+Posts are grouped into threads as they stream past. A question opens a
+thread and its answers join it; a thread is emitted once ``window`` posts
+have gone by since its question (answers usually follow within days, so
+within a window of an Id-ordered dump), when more than ``max_open`` threads
+are open, or at the end of the file. Memory is bounded by the open threads,
+never by the size of the export. Answers whose question is not open (too
+late, filtered out, or missing) are counted as ``orphans`` and dropped.
+
+Each thread is rendered like the files in ``data_samples/stack_overflow``
+(YAML front matter + ``# RAW_THREAD`` Markdown, with the HTML bodies turned
+into text and ``<pre>`` blocks into fenced code), so the existing chunking,
+embedding and upload path applies unchanged.
+
+Resuming: ``OffsetTracker`` keeps the byte offset of the oldest thread that
+is open or not yet recorded in the manifest. Everything before it is
+ingested, so ``ingest_so`` stores it in the manifest as the checkpoint and
+an interrupted run restarts from there. Threads between the checkpoint and
+the point of interruption are parsed again and skipped by the manifest, and
+answers past the checkpoint to threads finished before it count as orphans.
+"""
+import gzip
+import hashlib
+import html
+import json
+import re
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence
+
+DEFAULT_WINDOW = 200_000  # posts
+DEFAULT_MAX_OPEN = 20_000  # threads
+MAX_ANSWERS = 10
+# Bytes hashed to tell whether a checkpoint belongs to this export or an older one
+FINGERPRINT_BYTES = 64 * 1024
+
+TAGS_RE = re.compile(r"<([^<>]+)>|\|([^|]+)")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+class _TextExtractor(HTMLParser):
+    """Post HTML -> plain text; ``<pre>`` becomes a fenced code block, ``<code>`` inline code."""
+
+    BLOCKS = {"p", "div", "blockquote", "ul", "ol", "table", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "hr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.in_pre = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "pre":
+            self.in_pre = True
+            self.parts.append("\n\n```\n")
+        elif tag == "code" and not self.in_pre:
+            self.parts.append("`")
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag == "pre":
+            self.in_pre = False
+            if self.parts:
+                self.parts[-1] = self.parts[-1].rstrip("\n")
+            self.parts.append("\n```\n\n")
+        elif tag == "code" and not self.in_pre:
+            self.parts.append("`")
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def html_to_text(body: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(body or "")
+    parser.close()
+    return BLANK_LINES_RE.sub("\n\n", "".join(parser.parts)).strip()
+
+
+def parse_tags(tags: Any) -> List[str]:
+    """``<a><b>`` (older dumps), ``|a|b|`` (newer dumps) or a list."""
+    if isinstance(tags, list):
+        return [str(t) for t in tags]
+    return [a or b for a, b in TAGS_RE.findall(tags or "")]
+
+
+def normalize_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {key.replace("_", "").lower(): value for key, value in record.items()}
+
+
+def parse_line(line: bytes, fmt: str) -> Optional[Dict[str, Any]]:
+    """One post from one line of the export, or None for lines that are not posts."""
+    line = line.strip()
+    if fmt == "jsonl":
+        return normalize_record(json.loads(line)) if line else None
+    if not line.startswith(b"<row"):
+        return None  # XML declaration, <posts>, </posts>
+    return normalize_record(ET.fromstring(line).attrib)
+
+
+def post_type(post: Dict[str, Any]) -> str:
+    kind = str(post.get("posttypeid") or "")
+    if kind == "1" or (not kind and post.get("title")):
+        return "question"
+    if kind == "2" or (not kind and post.get("parentid")):
+        return "answer"
+    return "other"  # wiki, tag excerpts, ...
+
+
+def score(post: Dict[str, Any]) -> int:
+    try:
+        return int(post.get("score") or 0)
+    except ValueError:
+        return 0
+
+
+def author(post: Dict[str, Any]) -> str:
+    if post.get("ownerdisplayname"):
+        return str(post["ownerdisplayname"])
+    return f"user {post['owneruserid']}" if post.get("owneruserid") else "anonymous"
+
+
+@dataclass
+class DumpThread:
+    key: str  # manifest key: "<export file name>#<question id>"
+    slug: str  # chunk id prefix
+    text: str  # front matter + Markdown, like the sample files
+    offset: int  # byte offset of the question's line in the export
+
+
+@dataclass
+class _OpenThread:
+    question: Dict[str, Any]
+    offset: int
+    seen_at: int  # post count when the question was read
+    answers: List[Dict[str, Any]] = field(default_factory=list)
+
+    def add(self, answer: Dict[str, Any]) -> None:
+        self.answers.append(answer)
+        if len(self.answers) > MAX_ANSWERS:
+            # Drop the lowest-scored answer, never the accepted one
+            accepted = str(self.question.get("acceptedanswerid") or "")
+            droppable = [a for a in self.answers if str(a.get("id")) != accepted]
+            self.answers.remove(min(droppable, key=score))
+
+
+class OffsetTracker:
+    """Lowest byte offset of the export that is not fully ingested yet."""
+
+    def __init__(self, start: int = 0):
+        self._pending: "OrderedDict[int, None]" = OrderedDict()  # opened in offset order
+        self._position = start
+        self._lock = threading.Lock()
+
+    def opened(self, offset: int) -> None:
+        with self._lock:
+            self._pending[offset] = None
+
+    def advanced(self, position: int) -> None:
+        with self._lock:
+            self._position = position
+
+    def done(self, offset: int) -> None:
+        with self._lock:
+            self._pending.pop(offset, None)
+
+    @property
+    def checkpoint(self) -> int:
+        with self._lock:
+            return next(iter(self._pending), self._position)
+
+
+def open_export(path: Path) -> BinaryIO:
+    return gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")
+
+
+def export_format(path: Path) -> str:
+    name = path.name[:-3] if path.name.endswith(".gz") else path.name
+    return "jsonl" if name.endswith((".jsonl", ".json")) else "xml"
+
+
+def fingerprint(path: Path) -> str:
+    with open_export(path) as f:
+        return hashlib.md5(f.read(FINGERPRINT_BYTES)).hexdigest()
+
+
+class DumpReader:
+    """Iterate the threads of one export, starting at byte ``start``."""
+
+    def __init__(
+        self,
+        path: Path,
+        start: int = 0,
+        window: int = DEFAULT_WINDOW,
+        max_open: int = DEFAULT_MAX_OPEN,
+        tags: Optional[Sequence[str]] = None,
+        min_answers: int = 1,
+        site: str = "stackoverflow.com",
+    ):
+        self.path = Path(path)
+        self.format = export_format(self.path)
+        self.start = start
+        self.window = window
+        self.max_open = max_open
+        self.tags = set(tags or ())
+        self.min_answers = min_answers
+        self.site = site
+        self.tracker = OffsetTracker(start)
+        self.posts = 0
+        self.threads = 0
+        self.filtered = 0
+        self.orphans = 0
+        self.bad_lines = 0
+
+    def __iter__(self) -> Iterator[DumpThread]:
+        open_threads: "OrderedDict[str, _OpenThread]" = OrderedDict()
+        with open_export(self.path) as f:
+            # gzip seeks by decompressing up to the offset: slow, but still constant memory
+            f.seek(self.start)
+            offset = self.start
+            for line in f:
+                line_offset, offset = offset, offset + len(line)
+                try:
+                    post = parse_line(line, self.format)
+                except (ET.ParseError, ValueError):
+                    self.bad_lines += 1
+                    post = None
+                if post is not None:
+                    self.posts += 1
+                    self._add(post, line_offset, open_threads)
+                    while open_threads and (
+                        len(open_threads) > self.max_open
+                        or self.posts - next(iter(open_threads.values())).seen_at > self.window
+                    ):
+                        thread = self._close(open_threads.popitem(last=False)[1])
+                        if thread is not None:
+                            yield thread
+                self.tracker.advanced(offset)
+        while open_threads:
+            thread = self._close(open_threads.popitem(last=False)[1])
+            if thread is not None:
+                yield thread
+
+    def _add(self, post: Dict[str, Any], offset: int, open_threads: "OrderedDict[str, _OpenThread]") -> None:
+        kind = post_type(post)
+        if kind == "question":
+            if self.tags and not self.tags.intersection(parse_tags(post.get("tags"))):
+                self.filtered += 1
+                return
+            open_threads[str(post["id"])] = _OpenThread(post, offset, self.posts)
+            self.tracker.opened(offset)
+        elif kind == "answer":
+            thread = open_threads.get(str(post.get("parentid")))
+            if thread is None:
+                self.orphans += 1
+            else:
+                thread.add(post)
+
+    def _close(self, thread: _OpenThread) -> Optional[DumpThread]:
+        if len(thread.answers) < self.min_answers:
+            self.filtered += 1
+            self.tracker.done(thread.offset)
+            return None
+        self.threads += 1
+        question_id = str(thread.question["id"])
+        return DumpThread(
+            key=f"{self.path.name}#{question_id}",
+            slug=f"{self.site.split('.')[0]}-{question_id}",
+            text=self.render(thread),
+            offset=thread.offset,
+        )
+
+    def render(self, thread: _OpenThread) -> str:
+        question = thread.question
+        accepted = str(question.get("acceptedanswerid") or "")
+        answers = sorted(thread.answers, key=lambda a: (str(a.get("id")) != accepted, -score(a)))
+        posts = [question, *answers]
+        meta = {
+            "source": f"https://{self.site}/questions/{question['id']}",
+            "title": html.unescape(str(question.get("title") or "")),
+            "topics": parse_tags(question.get("tags")),
+            "captured_at": str(max(str(p.get("lastactivitydate") or p.get("creationdate") or "") for p in posts))[:10],
+            "license": str(question.get("contentlicense") or "CC BY-SA 4.0"),
+            "attribution": f"{self.site} users: "
+                           + ", ".join(dict.fromkeys([f"{author(question)} (asker)", *(author(a) for a in answers)])),
+        }
+        sections = [
+            "# RAW_THREAD",
+            meta["title"],
+            f"Asked {str(question.get('creationdate') or '')[:10]} • Score: {score(question)}",
+            html_to_text(question.get("body")),
+        ]
+        for answer in answers:
+            label = "Accepted answer" if str(answer.get("id")) == accepted else "Answer"
+            sections.append(f"## {label} • Score: {score(answer)}\n\n{html_to_text(answer.get('body'))}")
+        # JSON values are valid YAML, in the style of the sample files, and far cheaper than yaml.safe_dump
+        front_matter = "".join(f"{key}: {json.dumps(value, ensure_ascii=False)}\n" for key, value in meta.items())
+        return f"---\n{front_matter}---\n\n" + "\n\n".join(sections) + "\n"
@@ -0,0 +1,7 @@
+import os
+
+# ingest_so reads its configuration at import; point it at the local backend and a dead OpenAI endpoint
+os.environ.setdefault("RETRIEVER_BACKEND", "local")
+os.environ.setdefault("AZURE_OPENAI_EMBED_DEPLOYMENT", "test-embed")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9")
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test")
@@ -0,0 +1,184 @@
+import asyncio
+import contextvars
+import time
+
+import pytest
+from tenacity import Retrying, retry_if_exception_type, wait_fixed
+
+from admission import (
+    AdaptiveLimiter,
+    DeadlineExceeded,
+    Overloaded,
+    remaining,
+    set_deadline,
+    stop_at_deadline,
+    within_deadline,
+)
+
+
+def in_request(deadline: float, fn):
+    """Run ``fn`` in a fresh context with a request deadline ``deadline`` seconds away."""
+    def run():
+        set_deadline(deadline)
+        return fn()
+
+    return contextvars.copy_context().run(run)
+
+
+def test_limit_grows_additively_only_while_in_use():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=4)
+        tickets = [await limiter.acquire() for _ in range(4)]
+        limiter.release(tickets.pop())
+        assert limiter.limit == pytest.approx(4.25)
+        limiter.release(tickets.pop())
+        assert limiter.limit == pytest.approx(4.25 + 1 / 4.25)
+        # Two of ~4 slots in use: no longer growing
+        limiter.release(tickets.pop())
+        assert limiter.limit == pytest.approx(4.25 + 1 / 4.25)
+
+    asyncio.run(run())
+
+
+def test_failure_and_slow_requests_back_off_once_per_cooldown():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=10, min_limit=7, cooldown=60)
+        tickets = [await limiter.acquire() for _ in range(3)]
+        tickets[0].ok = False
+        limiter.release(tickets[0])
+        assert limiter.limit == pytest.approx(8)
+        tickets[1].start -= limiter.target_latency + 1
+        limiter.release(tickets[1])  # slow, but within the cooldown
+        assert limiter.limit == pytest.approx(8)
+        limiter._last_decrease -= 60
+        tickets[2].ok = False
+        limiter.release(tickets[2])
+        assert limiter.limit == 7  # floored at min_limit
+
+    asyncio.run(run())
+
+
+def test_release_is_idempotent():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=2)
+        ticket = await limiter.acquire()
+        limiter.release(ticket)
+        limiter.release(ticket)
+        assert limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_waiters_are_admitted_in_order():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5)
+        ticket = await limiter.acquire()
+        order = []
+
+        async def wait(name):
+            order.append(name)
+            limiter.release(await limiter.acquire())
+
+        waiters = [asyncio.create_task(wait(name)) for name in "abc"]
+        await asyncio.sleep(0)
+        assert limiter.stats()["queue_length"] == 3
+        limiter.release(ticket)
+        await asyncio.gather(*waiters)
+        assert order == ["a", "b", "c"]
+        assert limiter.stats()["queued"] == 3 and limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_queue_timeout_rejects_with_retry_after():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(Overloaded) as excinfo:
+            await limiter.acquire()
+        assert excinfo.value.retry_after >= 1
+        assert limiter.stats()["queue_length"] == 0 and limiter.rejected == 1
+
+    asyncio.run(run())
+
+
+def test_full_queue_rejects_at_once():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5, max_queue=1)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        with pytest.raises(Overloaded):
+            await limiter.acquire()
+        assert time.monotonic() - started < 0.1
+        queued.cancel()
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5)
+        ticket = await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.sleep(0)
+        assert limiter.stats()["queue_length"] == 0
+        limiter.release(ticket)
+        assert limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_queue_wait_is_bounded_by_the_deadline():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=30)
+        await limiter.acquire()
+        set_deadline(0.01)
+        started = time.monotonic()
+        with pytest.raises(Overloaded):
+            await limiter.acquire()
+        assert time.monotonic() - started < 1
+
+    asyncio.run(run())
+
+
+def test_within_deadline():
+    async def run():
+        assert await within_deadline(asyncio.sleep(0, "no deadline")) == "no deadline"
+        set_deadline(0.05)
+        assert 0 < remaining() <= 0.05
+        assert await within_deadline(asyncio.sleep(0, "in time")) == "in time"
+        with pytest.raises(DeadlineExceeded):
+            await within_deadline(asyncio.sleep(1))
+        # Already past the deadline: the coroutine is closed without running
+        with pytest.raises(DeadlineExceeded):
+            await within_deadline(asyncio.sleep(1))
+
+    asyncio.run(run())
+    assert remaining() is None
+
+
+def attempts(stop: stop_at_deadline, wait: float) -> int:
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        raise ConnectionError()
+
+    retrying = Retrying(stop=stop, wait=wait_fixed(wait), retry=retry_if_exception_type(ConnectionError), reraise=True)
+    with pytest.raises(ConnectionError):
+        retrying(flaky)
+    return len(calls)
+
+
+def test_stop_at_deadline_uses_max_attempts_outside_a_request():
+    assert attempts(stop_at_deadline(max_attempts=3), wait=0) == 3
+
+
+def test_stop_at_deadline_stops_before_a_sleep_would_overrun():
+    assert in_request(5, lambda: attempts(stop_at_deadline(max_attempts=3), wait=10)) == 1
+    # Inside a request max_attempts does not apply: it retries for as long as the deadline allows
+    assert 3 < in_request(0.2, lambda: attempts(stop_at_deadline(max_attempts=3), wait=0.02)) <= 11
@@ -0,0 +1,79 @@
+import pytest
+
+from benchmarks.chunking import SAMPLES, legacy_chunk
+from chunking import chunk_document, chunk_many, chunk_spans, chunk_text, prompt_fields
+from tokens import count_tokens
+
+SAMPLE_PATHS = sorted(SAMPLES.rglob("*.md"))
+
+PROSE = " ".join(f"Step {i}: restart the pod and check the logs again." for i in range(80))
+CODE = "```yaml\n" + "\n".join(f"key{i}: value{i}" for i in range(40)) + "\n```"
+GIANT_CODE = "```python\n" + "\n".join(f"print('line {i}')" for i in range(400)) + "\n```"
+
+
+@pytest.mark.parametrize("path", SAMPLE_PATHS, ids=lambda p: p.name)
+def test_samples_match_legacy_chunker(path):
+    text = path.read_text(encoding="utf-8")
+    assert chunk_text(text) == legacy_chunk(text)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        PROSE,
+        f"{PROSE}\n\n{CODE}\n\n{PROSE}",
+        f"Intro\n\n{GIANT_CODE}\n\nOutro",
+        f"{CODE}\n{CODE}\n{CODE}",
+        "",
+        "   \n\n  ",
+    ],
+    ids=["prose", "prose-code-prose", "giant-code", "code-only", "empty", "blank"],
+)
+@pytest.mark.parametrize("max_tokens, overlap", [(300, 50), (64, 1), (40, 39)])
+def test_synthetic_documents_match_legacy_chunker(text, max_tokens, overlap):
+    assert chunk_text(text, max_tokens, overlap) == legacy_chunk(text, max_tokens, overlap)
+
+
+def test_zero_overlap_does_not_repeat_tokens():
+    # The legacy chunker kept the whole buffer here (``buffer[-0:]``); spans do not overlap at all
+    chunks = chunk_document(f"Intro\n\n{GIANT_CODE}", max_tokens=64, overlap=0)
+    assert all(a.end_token == b.start_token for a, b in zip(chunks, chunks[1:]))
+
+
+def test_multibyte_boundary_keeps_the_character():
+    text = "数据库连接超时。" * 200 + " 🚀" * 200
+    chunks = chunk_text(text, max_tokens=37, overlap=5)
+    assert len(chunks) > 1
+    assert not any("�" in chunk for chunk in chunks)
+    assert any("�" in chunk for chunk in legacy_chunk(text, max_tokens=37, overlap=5))
+
+
+def test_chunk_spans():
+    assert chunk_spans([100, 250, 400, 420], max_tokens=300, overlap=50) == [(0, 250), (200, 420)]
+    # A segment larger than max_tokens is force-split with the same overlap
+    assert chunk_spans([10, 700], max_tokens=300, overlap=50) == [(0, 10), (0, 300), (250, 550), (500, 700)]
+    assert chunk_spans([]) == []
+    with pytest.raises(ValueError):
+        chunk_spans([10], max_tokens=10, overlap=10)
+
+
+def test_code_block_is_not_split_when_it_fits():
+    chunks = chunk_document(f"{PROSE}\n\n{CODE}\n\n{PROSE}")
+    assert any(CODE in chunk.text for chunk in chunks)
+    assert all(chunk.tokens <= 300 for chunk in chunks)
+
+
+def test_chunk_many_keeps_input_order():
+    texts = [f"{i} {PROSE}" for i in range(6)]
+    expected = [chunk_document(text) for text in texts]
+    assert chunk_many(texts, workers=1) == expected
+    assert chunk_many(texts, workers=2) == expected
+
+
+def test_prompt_fields():
+    short, long = "a short chunk", PROSE
+    fields = prompt_fields([short, long], snippet_tokens=20)
+    assert fields[0] == {"token_count": count_tokens(short), "snippet": short, "snippet_token_count": count_tokens(short)}
+    assert fields[1]["token_count"] == count_tokens(long)
+    assert long.startswith(fields[1]["snippet"])
+    assert fields[1]["snippet_token_count"] == count_tokens(fields[1]["snippet"]) <= 21
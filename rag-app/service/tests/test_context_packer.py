@@ -0,0 +1,96 @@
+import pytest
+
+from chunking import chunk_text, prompt_fields
+from context_packer import header_tokens, merge_adjacent, merge_overlap, pack_context
+from tokens import count_tokens
+
+THREAD = " ".join(f"Answer {i}: raise the liveness probe timeout to {i} seconds." for i in range(120))
+
+
+def hits_for(text: str, source: str, scores: dict, title: str = "Pods restarting") -> list:
+    """Search hits for the chunks of ``text`` whose index is a key of ``scores``."""
+    chunks = chunk_text(text)
+    fields = prompt_fields(chunks)
+    return [
+        {
+            "id": f"{source}-chunk{i}",
+            "title": title,
+            "source": source,
+            "chunk_index": i,
+            "content": chunks[i],
+            "@search.score": score,
+            **fields[i],
+        }
+        for i, score in scores.items()
+    ]
+
+
+def test_merge_overlap_keeps_shared_text_once():
+    chunks = chunk_text(THREAD)
+    assert len(chunks) > 2
+    merged = chunks[0]
+    for chunk in chunks[1:]:
+        merged = merge_overlap(merged, chunk)
+    assert merged == THREAD
+
+
+def test_merge_overlap_without_shared_text():
+    assert merge_overlap("first chunk of text here", "unrelated second chunk") == (
+        "first chunk of text here\n\nunrelated second chunk"
+    )
+
+
+def test_merge_adjacent_groups_consecutive_chunks_per_thread():
+    hits = hits_for(THREAD, "q/1", {0: 1.0, 1: 3.0, 3: 2.0}) + hits_for(THREAD, "q/2", {2: 2.5})
+    blocks = merge_adjacent(hits)
+    assert [b.ids for b in blocks] == [["q/1-chunk0", "q/1-chunk1"], ["q/2-chunk2"], ["q/1-chunk3"]]
+    assert blocks[0].score == 3.0
+    assert blocks[0].tokens == count_tokens(blocks[0].text)
+    assert blocks[1].snippet is not None and blocks[0].snippet is None
+
+
+def test_same_source_in_different_indexes_does_not_merge():
+    hits = hits_for(THREAD, "q/1", {0: 1.0, 1: 2.0})
+    hits[1]["index"] = "other-index"
+    assert len(merge_adjacent(hits)) == 2
+
+
+@pytest.mark.parametrize("budget", [120, 400, 700, 5000])
+def test_packed_sources_fit_the_budget(budget):
+    hits = hits_for(THREAD, "q/1", {0: 1.0, 1: 3.0, 4: 2.0}) + hits_for(THREAD, "q/2", {2: 2.5}, title="Other")
+    packed = pack_context(hits, budget)
+    assert packed.tokens <= budget
+    assert count_tokens(packed.text) <= budget
+    assert [s.score for s in packed.sources] == sorted((s.score for s in packed.sources), reverse=True)
+
+
+def test_everything_fits_untouched():
+    hits = hits_for(THREAD, "q/1", {0: 1.0, 2: 2.0})
+    packed = pack_context(hits, 10_000)
+    assert [s.text for s in packed.sources] == [hits[1]["content"], hits[0]["content"]]
+    assert not any(s.truncated for s in packed.sources)
+    assert packed.sources[0].tokens == header_tokens("Pods restarting") + hits[1]["token_count"]
+
+
+def test_last_source_is_cut_to_the_remaining_budget():
+    hits = hits_for(THREAD, "q/1", {0: 2.0, 2: 1.0})
+    first = header_tokens("Pods restarting") + hits[0]["token_count"]
+    packed = pack_context(hits, first + 150)
+    assert len(packed.sources) == 2
+    cut = packed.sources[1]
+    assert cut.truncated and hits[1]["content"].startswith(cut.text)
+    assert packed.tokens <= first + 150
+
+
+def test_single_chunk_uses_its_snippet_when_it_fits():
+    hits = hits_for(THREAD, "q/1", {0: 1.0})
+    budget = header_tokens("Pods restarting") + hits[0]["snippet_token_count"] + 5
+    packed = pack_context(hits, budget)
+    assert packed.sources[0].text == hits[0]["snippet"] and packed.sources[0].truncated
+
+
+def test_sources_below_the_minimum_are_dropped():
+    hits = hits_for(THREAD, "q/1", {0: 2.0, 2: 1.0})
+    first = header_tokens("Pods restarting") + hits[0]["token_count"]
+    packed = pack_context(hits, first + 30, min_source_tokens=50)
+    assert [s.ids for s in packed.sources] == [["q/1-chunk0"]]
@@ -0,0 +1,122 @@
+import hashlib
+import json
+
+import numpy as np
+import pytest
+
+from embedding_cache import DIGEST_SIZE, HEADER, EmbeddingCache, migrate_json
+
+
+def key(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def vector(seed: int, dim: int = 8) -> list:
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32).tolist()
+
+
+def test_round_trip_and_reopen(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache")
+    assert cache.put_many([(key("a"), vector(1)), (key("b"), vector(2))]) == 2
+    assert cache.put_many([(key("a"), vector(3))]) == 0  # existing entries are never rewritten
+    assert np.array_equal(cache.get_array(key("a")), np.float32(vector(1)))
+    cache.close()
+
+    reopened = EmbeddingCache(tmp_path / "cache")
+    assert len(reopened) == 2
+    assert key("b") in reopened and key("c") not in reopened
+    assert reopened[key("b")] == pytest.approx(vector(2))
+
+
+def test_rejects_wrong_dimensions(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache")
+    cache[key("a")] = vector(1)
+    with pytest.raises(ValueError, match="8-dimensional"):
+        cache[key("b")] = vector(2, dim=4)
+    cache.close()
+    with pytest.raises(ValueError, match="8 dimensions"):
+        EmbeddingCache(tmp_path / "cache", dim=16)
+
+
+def test_reads_entries_appended_after_first_read(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache")
+    cache[key("a")] = vector(1)
+    assert cache[key("a")] == pytest.approx(vector(1))
+    cache[key("b")] = vector(2)  # the memory map must grow to cover the new row
+    assert cache[key("b")] == pytest.approx(vector(2))
+
+
+@pytest.mark.parametrize("quantization, row_bytes", [("none", 8 * 4), ("int8", 4 + 8)])
+def test_crash_tail_is_truncated_to_complete_rows(tmp_path, quantization, row_bytes):
+    cache = EmbeddingCache(tmp_path / "cache", quantization=quantization)
+    cache.put_many([(key("a"), vector(1)), (key("b"), vector(2))])
+    cache.close()
+
+    # A crash mid-append: half a vector row, and a digest whose row never made it
+    with open(cache.vectors_path, "ab") as f:
+        f.write(b"\x00" * (row_bytes // 2))
+    with open(cache.index_path, "ab") as f:
+        f.write(bytes.fromhex(key("c")))
+
+    reopened = EmbeddingCache(tmp_path / "cache")
+    assert len(reopened) == 2
+    assert key("c") not in reopened
+    assert cache.vectors_path.stat().st_size == 2 * row_bytes
+    assert cache.index_path.stat().st_size == HEADER.size + 2 * DIGEST_SIZE
+
+    # Appending after the truncation keeps record i aligned with row i
+    reopened[key("c")] = vector(3)
+    reopened.close()
+    again = EmbeddingCache(tmp_path / "cache")
+    assert again[key("c")] == pytest.approx(vector(3), abs=0.05)
+    assert again[key("a")] == pytest.approx(vector(1), abs=0.05)
+
+
+def test_orphan_vector_row_is_dropped(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache")
+    cache[key("a")] = vector(1)
+    cache.close()
+    # The vector of an entry is written before its digest; a crash in between leaves an orphan row
+    with open(cache.vectors_path, "ab") as f:
+        f.write(np.float32(vector(2)).tobytes())
+
+    reopened = EmbeddingCache(tmp_path / "cache")
+    assert len(reopened) == 1
+    assert cache.vectors_path.stat().st_size == 8 * 4
+
+
+def test_int8_codec_is_kept_and_close_to_the_input(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache", quantization="int8")
+    original = np.float32(vector(1, dim=64))
+    cache[key("a")] = original.tolist()
+    cache.close()
+
+    # The codec comes from the header, not the constructor argument
+    reopened = EmbeddingCache(tmp_path / "cache")
+    assert reopened.quantization == "int8"
+    decoded = reopened.get_array(key("a"))
+    assert decoded.dtype == np.float32
+    step = np.abs(original).max() / 127
+    assert np.abs(decoded - original).max() <= step / 2 + 1e-6
+    assert cache.vectors_path.stat().st_size == 4 + 64
+
+
+def test_zero_vector_survives_int8(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache", quantization="int8")
+    cache[key("zero")] = [0.0] * 8
+    assert cache[key("zero")] == [0.0] * 8
+
+
+def test_rejects_unknown_codec(tmp_path):
+    with pytest.raises(ValueError, match="quantization"):
+        EmbeddingCache(tmp_path / "cache", quantization="binary")
+
+
+def test_migrate_json(tmp_path):
+    legacy = {key("a"): vector(1), key("b"): vector(2)}
+    json_path = tmp_path / "legacy.json"
+    json_path.write_text(json.dumps(legacy))
+    cache = EmbeddingCache(tmp_path / "cache")
+    assert migrate_json(json_path, cache) == 2
+    assert migrate_json(json_path, cache) == 0
+    assert cache[key("b")] == pytest.approx(vector(2))
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from index_router import IndexRouter, RetrieverPool, UnknownIndex
+
+
+@pytest.fixture
+def router() -> IndexRouter:
+    return IndexRouter(
+        default="kb",
+        indexes=["shared-kb"],
+        tenants={"tenant-a": ["tenant-a-index", "shared-kb"], "tenant-b": ["tenant-b-index"]},
+    )
+
+
+def test_defaults(router):
+    assert router.resolve() == ("kb",)
+    assert router.resolve(tenant="tenant-a") == ("shared-kb", "tenant-a-index")
+
+
+def test_untenanted_query_may_name_default_and_search_indexes(router):
+    assert router.resolve(["shared-kb", "kb"]) == ("kb", "shared-kb")
+
+
+def test_untenanted_query_cannot_name_a_tenants_index(router):
+    with pytest.raises(UnknownIndex, match="tenant-b-index"):
+        router.resolve(["tenant-b-index"])
+    with pytest.raises(UnknownIndex, match="tenant-a-index"):
+        router.resolve(["kb", "tenant-a-index"])
+
+
+def test_tenant_cannot_name_another_tenants_index(router):
+    with pytest.raises(UnknownIndex, match="tenant-b-index"):
+        router.resolve(["tenant-b-index"], tenant="tenant-a")
+
+
+@pytest.mark.parametrize("name", ["KB", "kb_1", "-kb", "kb/../x", "k" * 129])
+def test_invalid_index_names_are_rejected(name):
+    with pytest.raises(ValueError, match="Invalid index name"):
+        IndexRouter(default="kb", indexes=[name])
+
+
+def test_unknown_tenant(router):
+    with pytest.raises(UnknownIndex, match="tenant-c"):
+        router.resolve(tenant="tenant-c")
+
+
+class FakeRetriever:
+    def __init__(self, index: str):
+        self.index = index
+        self.closed = False
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_pool_evicts_least_recently_used_idle_retriever():
+    async def run():
+        pool = RetrieverPool(lambda index: asyncio.sleep(0, FakeRetriever(index)), max_size=1)
+        async with pool.lease("a") as a:
+            pass
+        async with pool.lease("b") as b:
+            assert not a.closed
+        assert a.closed and not b.closed
+        assert pool.stats()["size"] == 1
+
+    asyncio.run(run())
+
+
+def test_pool_lease_survives_eviction_before_waiter_resumes():
+    """A lease that exits between a retriever's creation and its waiter resuming must not evict it."""
+    async def run():
+        created = asyncio.Event()
+
+        async def create(index):
+            if index == "b":
+                created.set()
+            return FakeRetriever(index)
+
+        pool = RetrieverPool(create, max_size=1, pinned=["a"])
+
+        async def hold_a():
+            async with pool.lease("a"):
+                await created.wait()
+            # Left while "b" is pooled but its lease has not resumed: the pool is over max_size
+
+        async def use_b():
+            async with pool.lease("b") as retriever:
+                assert not retriever.closed
+                await asyncio.sleep(0)
+                assert not retriever.closed
+                return retriever
+
+        holder = asyncio.create_task(hold_a())
+        await asyncio.sleep(0)
+        retriever = await use_b()
+        await holder
+        assert retriever.index == "b"
+
+    asyncio.run(run())
+
+
+def test_pool_concurrent_leases_with_max_size_one():
+    async def run():
+        pool = RetrieverPool(lambda index: asyncio.sleep(0, FakeRetriever(index)), max_size=1)
+
+        async def lease(index):
+            async with pool.lease(index) as retriever:
+                assert not retriever.closed
+                await asyncio.sleep(0)
+                assert not retriever.closed
+
+        await asyncio.gather(*(lease(index) for _ in range(20) for index in "abc"))
+        assert pool.stats()["in_use"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+import ingest_so
+from ingest_manifest import FileEntry, IngestManifest, hash_chunk
+from ingest_so import delete_removed, plan_source, removed_files
+
+
+def thread(paragraphs: int, edit: str = "") -> bytes:
+    body = "\n\n".join(
+        " ".join(f"word{p}x{w}" for w in range(60)) + (edit if p == paragraphs - 1 else "")
+        for p in range(paragraphs)
+    )
+    return f"---\nsource: https://example.com/q/1\ntitle: Pods restarting\n---\n# RAW_THREAD\n{body}\n".encode()
+
+
+def plan(data: bytes, manifest: IngestManifest, full: bool = False):
+    return plan_source("q/pods.md", data, manifest, full, path="q/pods.md")
+
+
+@pytest.fixture
+def manifest(tmp_path) -> IngestManifest:
+    return IngestManifest(tmp_path / "manifest.json", "index", "chunker-v1")
+
+
+def test_hash_chunk_ignores_vector_and_key_order():
+    doc = {"id": "a", "content": "text", "title": "t"}
+    assert hash_chunk(doc) == hash_chunk({"title": "t", "content": "text", "id": "a", "contentVector": [0.1]})
+    assert hash_chunk(doc) != hash_chunk({**doc, "title": "other"})
+
+
+def test_manifest_round_trip(tmp_path, manifest):
+    manifest.update("a.md", FileEntry("h1", {"a-chunk0": "c0"}))
+    manifest.set_checkpoint("posts.xml", 4096, "fp")
+    manifest.save()
+
+    loaded = IngestManifest(tmp_path / "manifest.json", "index", "chunker-v1")
+    assert loaded.get("a.md") == FileEntry("h1", {"a-chunk0": "c0"})
+    assert loaded.checkpoint("posts.xml", "fp") == 4096
+    assert loaded.checkpoint("posts.xml", "other export") == 0
+    assert not (tmp_path / "manifest.json.tmp").exists()
+
+
+def test_other_index_starts_empty(tmp_path, manifest):
+    manifest.update("a.md", FileEntry("h1", {"a-chunk0": "c0"}))
+    manifest.save()
+    assert len(IngestManifest(tmp_path / "manifest.json", "other-index", "chunker-v1")) == 0
+
+
+def test_new_chunker_forgets_file_hashes_and_checkpoints_only(tmp_path, manifest):
+    manifest.update("a.md", FileEntry("h1", {"a-chunk0": "c0"}))
+    manifest.set_checkpoint("posts.xml", 4096, "fp")
+    manifest.save()
+
+    loaded = IngestManifest(tmp_path / "manifest.json", "index", "chunker-v2")
+    assert loaded.get("a.md") == FileEntry("", {"a-chunk0": "c0"})
+    assert loaded.checkpoint("posts.xml", "fp") == 0
+
+
+def test_unknown_version_is_ignored(tmp_path):
+    (tmp_path / "manifest.json").write_text(json.dumps({"version": 99, "index": "index", "files": {}}))
+    assert len(IngestManifest(tmp_path / "manifest.json", "index", "chunker-v1")) == 0
+
+
+def test_plan_new_unchanged_and_full(manifest):
+    data = thread(6)
+    delta = plan(data, manifest)
+    assert len(delta.upserts) > 1
+    assert delta.new == len(delta.upserts) and delta.unchanged == 0 and delta.stale_ids == []
+
+    manifest.update(delta.key, delta.entry)
+    assert plan(data, manifest) is None
+    again = plan(data, manifest, full=True)
+    assert len(again.upserts) == len(delta.upserts) and again.new == 0
+
+
+def test_plan_uploads_only_changed_chunks(manifest):
+    before = plan(thread(6), manifest)
+    manifest.update(before.key, before.entry)
+
+    after = plan(thread(6, edit=" edited"), manifest)
+    assert 0 < len(after.upserts) < len(before.upserts)
+    assert after.new == 0 and after.changed == len(after.upserts)
+    assert after.unchanged == len(before.upserts) - len(after.upserts)
+    assert after.stale_ids == []
+
+
+def test_plan_deletes_ids_a_shrunk_file_no_longer_produces(manifest):
+    before = plan(thread(6), manifest)
+    manifest.update(before.key, before.entry)
+
+    after = plan(thread(2), manifest)
+    assert after.stale_ids
+    assert set(after.stale_ids) == set(before.entry.chunks) - set(after.entry.chunks)
+
+
+def test_removed_files_skips_streamed_threads(manifest):
+    manifest.update("q/gone.md", FileEntry("h", {"gone-chunk0": "c"}))
+    manifest.update("q/kept.md", FileEntry("h", {"kept-chunk0": "c"}))
+    manifest.update("posts.xml#42", FileEntry("h", {"so-42-chunk0": "c"}))
+    paths = [f"{ingest_so.DATA_ROOT}/q/kept.md"]
+    assert removed_files(paths, manifest) == ["q/gone.md"]
+
+
+def test_failed_delete_keeps_the_file_for_the_next_run(manifest, monkeypatch):
+    manifest.update("q/a.md", FileEntry("h", {"a-chunk0": "c", "a-chunk1": "c"}))
+    manifest.update("q/b.md", FileEntry("h", {"b-chunk0": "c"}))
+    manifest.update("q/c.md", FileEntry("h", {"c-chunk0": "c"}))
+    deleted = []
+
+    def delete_chunks(doc_ids):
+        if doc_ids == ["b-chunk0"]:
+            raise RuntimeError("503")
+        deleted.extend(doc_ids)
+
+    monkeypatch.setattr(ingest_so, "delete_chunks", delete_chunks)
+    assert delete_removed([], manifest) == 3
+    assert deleted == ["a-chunk0", "a-chunk1", "c-chunk0"]
+    assert manifest.files() == ["q/b.md"]
@@ -0,0 +1,115 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import ingest_so
+from embedding_cache import EmbeddingCache
+from ingest_manifest import IngestManifest
+from ingest_so import run_pipeline
+from uploader import BulkUploader
+
+BODY = "\n\n".join(" ".join(f"step{p}x{w}" for w in range(60)) for p in range(6))
+
+
+def write_thread(path, title, body=BODY):
+    path.write_text(f"---\nsource: https://example.com/{title}\ntitle: {title}\n---\n# RAW_THREAD\n{body}\n")
+    return str(path)
+
+
+class Index:
+    """Stands in for the embedding deployment and the search index."""
+
+    def __init__(self, failing_ids=()):
+        self.embed_calls = []
+        self.docs = {}
+        self.failing_ids = set(failing_ids)
+        self.lock = threading.Lock()
+
+    def embed(self, texts, tokens=None):
+        with self.lock:
+            self.embed_calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.0, 0.0] for text in texts]
+
+    def send(self, docs):
+        results = []
+        for doc in docs:
+            ok = doc["id"] not in self.failing_ids
+            if ok:
+                self.docs[doc["id"]] = doc
+            results.append(SimpleNamespace(key=doc["id"], succeeded=ok, status_code=200 if ok else 400, error_message="bad"))
+        return results
+
+
+@pytest.fixture
+def index(monkeypatch, tmp_path):
+    index = Index()
+    monkeypatch.setattr(ingest_so, "DATA_ROOT", str(tmp_path))
+    monkeypatch.setattr(ingest_so, "embed_batch_with_tenacity", lambda texts, tokens=None: index.embed(texts, tokens))
+    monkeypatch.setattr(ingest_so, "make_uploader", lambda: BulkUploader(index.send, max_concurrency=1, retry_delay=0))
+    monkeypatch.setattr(ingest_so, "delete_chunks", lambda doc_ids: None)
+    monkeypatch.setattr(ingest_so, "notify_reingested", lambda doc_ids: None)
+    return index
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(tmp_path / "cache")
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return IngestManifest(tmp_path / "manifest.json", "index", ingest_so.CHUNKER_ID)
+
+
+def test_files_are_embedded_once_per_unique_chunk(index, cache, manifest, tmp_path):
+    paths = [write_thread(tmp_path / f"{name}.md", name) for name in ("a", "b", "c")]
+    stats = run_pipeline(paths, cache, manifest, workers=2)
+
+    chunks = len(ingest_so.chunk_docs(paths[0]))
+    assert len(index.docs) == stats.uploaded == 3 * chunks
+    # The three files share their chunk texts: each is embedded once, in batch or from the cache
+    assert sorted(text for call in index.embed_calls for text in call) == sorted({d["content"] for d in index.docs.values()})
+    assert stats.embedded == chunks
+    assert all(doc["contentVector"] for doc in index.docs.values())
+    assert sorted(manifest.files()) == ["a.md", "b.md", "c.md"]
+
+    again = run_pipeline(paths, cache, manifest, workers=2)
+    assert (again.skipped_files, again.uploaded) == (3, 0)
+
+
+def test_embed_batches_respect_the_size_limit(index, cache, manifest, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_so, "EMBED_BATCH_SIZE", 2)
+    paths = [write_thread(tmp_path / f"{i}.md", f"t{i}", body=BODY.replace("step", f"t{i}-")) for i in range(3)]
+    stats = run_pipeline(paths, cache, manifest, workers=1)
+    assert stats.failed_chunks == 0
+    assert max(len(call) for call in index.embed_calls) <= 2
+    assert sum(len(call) for call in index.embed_calls) == stats.embedded == stats.uploaded
+
+
+def test_failed_embedding_leaves_files_out_of_the_manifest(index, cache, manifest, tmp_path, monkeypatch):
+    def fail(texts, tokens=None):
+        raise RuntimeError("quota")
+
+    monkeypatch.setattr(ingest_so, "embed_batch_with_tenacity", fail)
+    paths = [write_thread(tmp_path / "a.md", "a")]
+    stats = run_pipeline(paths, cache, manifest, workers=1)
+    assert stats.failed_chunks > 0 and stats.uploaded == 0
+    assert manifest.files() == []
+    assert index.docs == {}
+
+
+def test_failed_upload_leaves_only_that_file_out(index, cache, manifest, tmp_path):
+    paths = [write_thread(tmp_path / "a.md", "a"), write_thread(tmp_path / "b.md", "b", body=f"other {BODY}")]
+    index.failing_ids = {ingest_so.make_doc_id(ingest_so.slug_from_path(paths[1]), 0)}
+    stats = run_pipeline(paths, cache, manifest, workers=1)
+    assert stats.failed_uploads == 1
+    assert manifest.files() == ["a.md"]
+
+
+def test_parse_errors_are_counted(index, cache, manifest, tmp_path):
+    broken = tmp_path / "broken.md"
+    broken.write_text("no front matter")
+    stats = run_pipeline([str(broken), write_thread(tmp_path / "a.md", "a")], cache, manifest, workers=1)
+    assert stats.failed_files == 1
+    assert manifest.files() == ["a.md"]
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import FileBackend, LocalBackend, RateLimiter, limiter_for
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["local", "file"])
+def backend(request, tmp_path):
+    return LocalBackend() if request.param == "local" else FileBackend(tmp_path / "state" / "limits.json")
+
+
+def test_reserve_spends_both_buckets_and_refills(clock, backend):
+    assert backend.reserve("d", 1, 600, 2, 1000) == 0
+    assert backend.reserve("d", 1, 300, 2, 1000) == 0
+    # Out of requests: one refills every 60 / rpm seconds
+    assert backend.reserve("d", 1, 10, 2, 1000) == pytest.approx(30)
+    clock.now += 30
+    # A request is back, but only 100 + 500 tokens: wait for the missing ones
+    assert backend.reserve("d", 1, 700, 2, 1000) == pytest.approx(100 * 60 / 1000)
+    clock.now += 6
+    assert backend.reserve("d", 1, 700, 2, 1000) == 0
+
+
+def test_oversized_call_passes_on_a_full_bucket(clock, backend):
+    assert backend.reserve("d", 1, 50_000, 10, 1000) == 0
+    assert backend.reserve("d", 1, 1, 10, 1000) > 0
+
+
+def test_keys_have_separate_buckets(clock, backend):
+    assert backend.reserve("chat", 1, 0, 1, 1000) == 0
+    assert backend.reserve("chat", 1, 0, 1, 1000) > 0
+    assert backend.reserve("embed", 1, 0, 1, 1000) == 0
+
+
+def test_clamp_lowers_levels_and_blocks_until_retry_after(clock, backend):
+    backend.clamp("d", 60, 1000, remaining_requests=0, remaining_tokens=None, retry_after=None)
+    assert backend.reserve("d", 1, 0, 60, 1000) == pytest.approx(1)
+    backend.clamp("d", 60, 1000, remaining_requests=None, remaining_tokens=None, retry_after=5)
+    clock.now += 4
+    assert backend.reserve("d", 1, 0, 60, 1000) == pytest.approx(1)
+    clock.now += 1
+    assert backend.reserve("d", 1, 0, 60, 1000) == 0
+
+
+def test_clamp_never_raises_a_level(clock, backend):
+    backend.reserve("d", 1, 900, 60, 1000)
+    backend.clamp("d", 60, 1000, remaining_requests=60, remaining_tokens=1000, retry_after=None)
+    assert backend.reserve("d", 1, 200, 60, 1000) > 0
+
+
+def test_file_backend_state_is_shared_between_instances(clock, tmp_path):
+    path = tmp_path / "limits.json"
+    first, second = FileBackend(path), FileBackend(path)
+    assert first.reserve("d", 1, 0, 1, 1000) == 0
+    assert second.reserve("d", 1, 0, 1, 1000) > 0
+    assert FileBackend.blocking and not LocalBackend.blocking
+
+
+def test_update_from_headers(clock):
+    limiter = RateLimiter(rpm=60, tpm=1000, key="d")
+    limiter.update_from_headers({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-remaining-requests": "59"})
+    assert limiter.backend.reserve("d", 1, 60, 60, 1000) == pytest.approx(60 * 60 / 1000)
+    limiter.update_from_headers({"retry-after-ms": "2500", "retry-after": "9"})
+    assert limiter.backend.reserve("d", 0, 0, 60, 1000) == pytest.approx(2.5)
+
+
+def test_update_from_headers_ignores_garbage(clock):
+    limiter = RateLimiter(rpm=60, tpm=1000, key="d")
+    limiter.update_from_headers({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT", "x-ratelimit-remaining-tokens": "n/a"})
+    assert limiter.backend.reserve("d", 1, 1000, 60, 1000) == 0
+
+
+def test_unset_dimension_is_not_enforced(clock):
+    limiter = RateLimiter(rpm=None, tpm=100, key="d")
+    for _ in range(1000):
+        limiter.acquire(0)  # requests are unlimited
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "0"})
+    limiter.acquire(100)
+    assert limiter.backend.reserve("d", *limiter._cost(1)) > 0
+
+
+def test_limiter_without_budgets_is_a_no_op(monkeypatch):
+    monkeypatch.delenv("X_RPM", raising=False)
+    monkeypatch.delenv("X_TPM", raising=False)
+    limiter = limiter_for("d", "X")
+    assert not limiter.enabled
+    limiter.update_from_headers({"retry-after": "60"})
+    limiter.acquire(10**9)
+    asyncio.run(limiter.acquire_async(10**9))
+
+
+def test_limiter_for_reads_budgets(monkeypatch):
+    monkeypatch.setenv("X_RPM", "30")
+    monkeypatch.delenv("X_TPM", raising=False)
+    limiter = limiter_for("deployment", "X")
+    assert (limiter.rpm, limiter.tpm, limiter.key) == (30, None, "deployment")
+
+
+def test_async_limiter_waits_and_uses_threads_for_blocking_backends(clock, tmp_path, monkeypatch):
+    limiter = RateLimiter(rpm=1, tpm=None, key="d", backend=FileBackend(tmp_path / "limits.json"))
+    threaded, slept = [], []
+    real_to_thread = asyncio.to_thread
+
+    async def to_thread(func, *args):
+        threaded.append(func.__name__)
+        return await real_to_thread(func, *args)
+
+    async def sleep(seconds):
+        slept.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(rate_limiter.asyncio, "to_thread", to_thread)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", sleep)
+
+    async def run():
+        await limiter.acquire_async()
+        await limiter.acquire_async()
+        await limiter.update_from_headers_async({"retry-after": "1"})
+
+    asyncio.run(run())
+    assert slept == [pytest.approx(60)]
+    assert threaded == ["reserve", "reserve", "reserve", "clamp"]
@@ -0,0 +1,97 @@
+import asyncio
+import gc
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def run():
+        flight, calls, release = SingleFlight(), [], asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        waiters = [asyncio.create_task(flight.do("q", compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert flight.stats() == {"in_flight": 1, "leaders": 1, "coalesced": 4}
+        release.set()
+        assert await asyncio.gather(*waiters) == ["answer"] * 5
+        assert len(calls) == 1
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_key_is_forgotten_once_the_call_finishes():
+    async def run():
+        flight = SingleFlight()
+        assert await flight.do("q", lambda: asyncio.sleep(0, 1)) == 1
+        assert await flight.do("q", lambda: asyncio.sleep(0, 2)) == 2
+        assert flight.stats() == {"in_flight": 0, "leaders": 2, "coalesced": 0}
+
+    asyncio.run(run())
+
+
+def test_every_waiter_gets_the_exception():
+    async def run():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0)
+            raise RuntimeError("search down")
+
+        results = await asyncio.gather(*(flight.do("q", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(run())
+
+
+def test_cancelled_leader_does_not_cancel_the_shared_call():
+    async def run():
+        flight, release = SingleFlight(), asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flight.do("q", compute))
+        follower = asyncio.create_task(flight.do("q", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == "answer"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(run())
+
+
+def test_call_finishes_after_every_waiter_went_away():
+    async def run():
+        flight, finished = SingleFlight(), asyncio.Event()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            finished.set()
+            raise RuntimeError("nobody is listening")
+
+        waiter = asyncio.create_task(flight.do("q", fail))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await finished.wait()
+        await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == 0
+
+    loop = asyncio.new_event_loop()
+    errors = []
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    loop.run_until_complete(run())
+    loop.close()
+    gc.collect()
+    # The abandoned task's exception was retrieved: no "exception was never retrieved" report
+    assert errors == []
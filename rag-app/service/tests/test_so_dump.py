@@ -0,0 +1,142 @@
+import gzip
+import json
+from xml.sax.saxutils import quoteattr
+
+import pytest
+
+from so_dump import MAX_ANSWERS, DumpReader, OffsetTracker, html_to_text, parse_tags
+
+
+def question(id, tags="<kubernetes><docker>", accepted=None, **extra):
+    return {"Id": id, "PostTypeId": 1, "Title": f"Question {id}", "Body": f"<p>Body of {id}</p>",
+            "Tags": tags, "Score": 3, "AcceptedAnswerId": accepted, **extra}
+
+
+def answer(id, parent, score=1):
+    return {"Id": id, "PostTypeId": 2, "ParentId": parent, "Body": f"<p>Answer {id}</p>", "Score": score}
+
+
+def write_xml(path, posts):
+    rows = [
+        "<row " + " ".join(f"{k}={quoteattr(str(v))}" for k, v in post.items() if v is not None) + " />"
+        for post in posts
+    ]
+    path.write_text('<?xml version="1.0" encoding="utf-8"?>\n<posts>\n' + "\n".join(rows) + "\n</posts>\n")
+    return path
+
+
+POSTS = [
+    question(1, accepted=12), answer(11, 1, score=9), question(2), answer(12, 1), answer(21, 2),
+    question(3), answer(99, 404), question(4, tags="<excel>"), answer(41, 4), answer(31, 3),
+]
+
+
+def read(path, **kwargs):
+    reader = DumpReader(path, **kwargs)
+    return reader, list(reader)
+
+
+def test_threads_are_grouped_and_rendered(tmp_path):
+    reader, threads = read(write_xml(tmp_path / "Posts.xml", POSTS))
+    assert [t.key for t in threads] == ["Posts.xml#1", "Posts.xml#2", "Posts.xml#3", "Posts.xml#4"]
+    assert threads[0].slug == "stackoverflow-1"
+    text = threads[0].text
+    assert text.startswith("---\nsource: \"https://stackoverflow.com/questions/1\"\n")
+    assert "# RAW_THREAD" in text
+    # The accepted answer comes first whatever its score
+    assert text.index("Accepted answer • Score: 1") < text.index("## Answer • Score: 9")
+    assert (reader.posts, reader.threads, reader.orphans, reader.filtered) == (10, 4, 1, 0)
+
+
+def test_tag_and_answer_filters(tmp_path):
+    posts = POSTS + [question(5)]
+    reader, threads = read(write_xml(tmp_path / "Posts.xml", posts), tags=["docker"])
+    # Question 4 is filtered by tag (its answer is then an orphan); 5 has no answer
+    assert [t.key for t in threads] == ["Posts.xml#1", "Posts.xml#2", "Posts.xml#3"]
+    assert (reader.filtered, reader.orphans) == (2, 2)
+
+
+def test_answers_outside_the_window_are_orphans(tmp_path):
+    posts = [question(1), question(2), question(3), answer(21, 2), answer(11, 1)]
+    reader, threads = read(write_xml(tmp_path / "Posts.xml", posts), window=2, min_answers=0)
+    assert [t.key for t in threads] == ["Posts.xml#1", "Posts.xml#2", "Posts.xml#3"]
+    assert reader.orphans == 1
+    assert "Answer 21" in threads[1].text
+
+
+def test_max_open_closes_the_oldest_thread(tmp_path):
+    posts = [question(1), question(2), question(3), answer(11, 1), answer(31, 3)]
+    reader, threads = read(write_xml(tmp_path / "Posts.xml", posts), max_open=2)
+    assert [t.key for t in threads] == ["Posts.xml#3"]
+    assert reader.orphans == 1
+
+
+def test_keeps_the_accepted_and_best_answers(tmp_path):
+    answers = [answer(100 + i, 1, score=i) for i in range(MAX_ANSWERS + 3)]
+    posts = [question(1, accepted=100), *answers]
+    _, [thread] = read(write_xml(tmp_path / "Posts.xml", posts))
+    assert "Answer 100" in thread.text
+    assert "Answer 101" not in thread.text and "Answer 103" not in thread.text
+    assert thread.text.count("## ") == MAX_ANSWERS
+
+
+@pytest.mark.parametrize("name", ["posts.jsonl", "posts.jsonl.gz"])
+def test_jsonl_exports_match_xml(tmp_path, name):
+    # Warehouse exports use snake_case names
+    records = [{"id": p["Id"], "post_type_id": p["PostTypeId"], **{k.lower(): v for k, v in p.items()}} for p in POSTS]
+    data = "\n".join(json.dumps(r) for r in records).encode() + b"\n"
+    path = tmp_path / name
+    path.write_bytes(gzip.compress(data) if name.endswith(".gz") else data)
+    _, xml_threads = read(write_xml(tmp_path / "Posts.xml", POSTS))
+    _, threads = read(path)
+    assert [t.text for t in threads] == [t.text for t in xml_threads]
+
+
+def test_bad_lines_are_counted_and_skipped(tmp_path):
+    path = write_xml(tmp_path / "Posts.xml", POSTS)
+    path.write_text(path.read_text().replace('<row Id="2"', '<row Id="2" broken'))
+    reader, threads = read(path)
+    assert reader.bad_lines == 1
+    assert "Posts.xml#2" not in [t.key for t in threads]
+
+
+def test_offset_tracker():
+    tracker = OffsetTracker(start=10)
+    assert tracker.checkpoint == 10
+    tracker.opened(100)
+    tracker.opened(200)
+    tracker.advanced(300)
+    assert tracker.checkpoint == 100
+    tracker.done(200)
+    assert tracker.checkpoint == 100
+    tracker.done(100)
+    assert tracker.checkpoint == 300
+
+
+def test_resume_from_checkpoint_yields_every_unfinished_thread(tmp_path):
+    path = write_xml(tmp_path / "Posts.xml", POSTS)
+    reader = DumpReader(path)
+    threads = iter(reader)
+    ingested = []
+    # Interrupted after two threads were recorded, with the third parsed but not uploaded
+    for thread in threads:
+        if len(ingested) == 2:
+            break
+        ingested.append(thread.key)
+        reader.tracker.done(thread.offset)
+    checkpoint = reader.tracker.checkpoint
+    assert checkpoint == path.read_bytes().index(b'<row Id="3"')
+
+    _, resumed = read(path, start=checkpoint)
+    _, everything = read(path)
+    assert [t.key for t in resumed] == [t.key for t in everything if t.key not in ingested]
+
+
+def test_html_to_text():
+    body = "<p>Use <code>kubectl</code>:</p><pre><code>kubectl get pods\n</code></pre><ul><li>one</li></ul>"
+    assert html_to_text(body) == "Use `kubectl`:\n\n```\nkubectl get pods\n```\n\n- one"
+
+
+@pytest.mark.parametrize("tags", ["<a><b-c>", "|a|b-c|", ["a", "b-c"]])
+def test_parse_tags(tags):
+    assert parse_tags(tags) == ["a", "b-c"]
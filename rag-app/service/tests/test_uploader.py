@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+
+from uploader import BulkUploader, compact_vector, payload_size
+
+
+def result(key, status=200, error=None):
+    return SimpleNamespace(key=key, succeeded=status in (200, 201), status_code=status, error_message=error)
+
+
+def doc(i, **extra):
+    return {"id": f"d{i}", "content": f"chunk {i}", **extra}
+
+
+class Service:
+    """Answers each call with the next entry of ``script``: ``{key: status}``, or an exception to raise."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+
+    def __call__(self, docs):
+        self.calls.append([d["id"] for d in docs])
+        step = self.script.pop(0) if self.script else {}
+        if isinstance(step, Exception):
+            raise step
+        return [result(d["id"], step.get(d["id"], 200)) for d in docs]
+
+
+def http_error(status):
+    error = HttpResponseError(message=f"HTTP {status}")
+    error.status_code = status
+    return error
+
+
+def uploader(send, **kwargs):
+    return BulkUploader(send, max_concurrency=1, retry_delay=0, **kwargs)
+
+
+def test_batches_by_count_and_size():
+    service = Service()
+    up = uploader(service, max_docs=3)
+    for i in range(7):
+        up.add(doc(i), tag=i)
+    assert up.close() == [(i, None) for i in range(7)]
+    assert [len(call) for call in service.calls] == [3, 3, 1]
+
+    service = Service()
+    size = payload_size(doc(0, content="x" * 1000))
+    up = uploader(service, max_bytes=2 * size + 10)
+    for i in range(5):
+        up.add(doc(i, content="x" * 1000))
+    up.close()
+    assert [len(call) for call in service.calls] == [2, 2, 1]
+
+
+def test_only_retryable_keys_are_sent_again():
+    service = Service({"d1": 429, "d2": 400, "d3": 503}, {"d3": 500}, {})
+    up = uploader(service)
+    for i in range(4):
+        up.add(doc(i), tag=i)
+    outcomes = dict(up.close())
+    assert service.calls == [["d0", "d1", "d2", "d3"], ["d1", "d3"], ["d3"]]
+    assert outcomes[0] is None and outcomes[1] is None and outcomes[3] is None
+    assert outcomes[2].startswith("400")
+    assert (up.retried, up.failed) == (3, 1)
+
+
+def test_keys_missing_from_the_results_are_retried():
+    calls = []
+
+    def send(docs):
+        calls.append([d["id"] for d in docs])
+        return [result(d["id"]) for d in docs[:1]]
+
+    up = uploader(send)
+    up.add(doc(0))
+    up.add(doc(1))
+    up.close()
+    assert calls == [["d0", "d1"], ["d1"]]
+
+
+def test_gives_up_after_max_attempts():
+    service = Service(*[{"d0": 503}] * 3)
+    up = uploader(service, max_attempts=3)
+    up.add(doc(0), tag="t")
+    assert up.close() == [("t", "still failing after 3 attempts")]
+    assert len(service.calls) == 3
+
+
+def test_whole_batch_errors():
+    # Throttled or dropped requests retry the batch; anything else fails it at once
+    service = Service(http_error(503), ServiceRequestError("reset"), {})
+    up = uploader(service)
+    up.add(doc(0))
+    up.add(doc(1))
+    assert all(error is None for _, error in up.close())
+    assert len(service.calls) == 3
+
+    up = uploader(Service(http_error(413)))
+    up.add(doc(0), tag="t")
+    assert up.close() == [("t", "HTTP 413: HTTP 413")]
+
+    up = uploader(Service(ValueError("bad document")))
+    up.add(doc(0), tag="t")
+    assert up.close() == [("t", "bad document")]
+
+
+def test_throttling_lowers_the_limit_and_success_raises_it():
+    up = BulkUploader(Service(http_error(429), {}), concurrency=8, max_concurrency=16, backoff=0.5, retry_delay=0)
+    up.add(doc(0))
+    up.close()
+    assert up.throttled == 1 and up.limit == 4
+
+    # A single busy document out of many is retried without backing off
+    up = BulkUploader(Service({"d0": 429}), concurrency=8, max_concurrency=16, throttle_share=0.05, retry_delay=0)
+    for i in range(40):
+        up.add(doc(i))
+    up.close()
+    assert up.throttled == 0 and up.limit == 8
+
+    # Growth needs the limit to be in use: one batch in flight fills a limit of 1
+    up = BulkUploader(Service(), concurrency=1, max_concurrency=16)
+    up.add(doc(0))
+    up.close()
+    assert up.limit == 2
+
+
+def test_concurrent_batches_stay_within_the_limit():
+    lock, active, peak = threading.Lock(), [0], [0]
+
+    def send(docs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return [result(d["id"]) for d in docs]
+
+    up = BulkUploader(send, max_docs=1, concurrency=3, max_concurrency=3, retry_delay=0)
+    for i in range(20):
+        up.add(doc(i), tag=i)
+    assert sorted(tag for tag, _ in up.close()) == list(range(20))
+    assert 1 < peak[0] <= 3
+
+
+def test_vectors_are_rounded_and_the_size_estimate_is_an_upper_bound():
+    vector = np.random.default_rng(0).standard_normal(1536).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    document = doc(0, contentVector=compact_vector(vector.tolist(), 8))
+    assert all(len(repr(x).split(".")[-1]) <= 8 for x in document["contentVector"])
+    estimate = payload_size(document, vector_decimals=8)
+    actual = len(json.dumps({**document, "@search.action": "mergeOrUpload"}))
+    assert actual <= estimate < actual * 1.2
+
+
+@pytest.mark.parametrize("decimals", [None, 8])
+def test_added_documents_are_not_modified(decimals):
+    service = Service()
+    up = uploader(service, vector_decimals=decimals)
+    original = doc(0, contentVector=[0.123456789012345])
+    up.add(original)
+    up.close()
+    assert original["contentVector"] == [0.123456789012345]
@@ -0,0 +1,70 @@
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+import tiktoken
+
+DEFAULT_MODEL = "gpt-35-turbo"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = DEFAULT_MODEL) -> tiktoken.Encoding:
+    """Load the tiktoken encoder for ``model`` once per process."""
+    return tiktoken.encoding_for_model(model)
+
+
+@lru_cache(maxsize=None)
+def token_byte_lengths(model: str = DEFAULT_MODEL) -> Tuple[int, ...]:
+    """UTF-8 byte length of every ordinary token id (0 for unused ids)."""
+    enc = get_encoding(model)
+    lengths = []
+    for token in range(enc.n_vocab):
+        try:
+            lengths.append(len(enc.decode_single_token_bytes(token)))
+        except KeyError:
+            lengths.append(0)
+    return tuple(lengths)
+
+
+def char_offsets(text: str, tokens: Sequence[int], positions: Sequence[int], model: str = DEFAULT_MODEL) -> List[int]:
+    """Character offset in ``text`` where ``tokens[i]`` starts, for each ``i`` in ascending ``positions``.
+
+    ``tokens`` must be ``encode_ordinary(text)``; ``text[offsets[a]:offsets[b]]``
+    then equals ``decode(tokens[a:b])`` without decoding any tokens. Position
+    ``len(tokens)`` maps to ``len(text)``. A boundary that falls inside a
+    multi-byte character is moved past that character.
+    """
+    lengths = token_byte_lengths(model)
+    byte_offsets = []
+    offset = previous = 0
+    for position in positions:
+        offset += sum(map(lengths.__getitem__, tokens[previous:position]))
+        byte_offsets.append(offset)
+        previous = position
+    if text.isascii():
+        return byte_offsets
+
+    raw = text.encode("utf-8")
+    offsets = []
+    chars = previous_byte = 0
+    for offset in byte_offsets:
+        while offset < len(raw) and raw[offset] & 0xC0 == 0x80:
+            offset += 1
+        chars += len(raw[previous_byte:offset].decode("utf-8"))
+        offsets.append(chars)
+        previous_byte = offset
+    return offsets
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+def count_batch_tokens(texts: List[str], model: str = DEFAULT_MODEL) -> int:
+    return sum(len(t) for t in get_encoding(model).encode_ordinary_batch(texts))
+
+
+def truncate_to_tokens(text: str, max_tokens: int = 250, model: str = DEFAULT_MODEL) -> str:
+    tokens = get_encoding(model).encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return text[:char_offsets(text, tokens, [max_tokens], model)[0]]
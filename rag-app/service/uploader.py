@@ -0,0 +1,245 @@
+"""Bulk upload engine for ingestion: payload-sized batches, several in flight.
+
+``BulkUploader`` packs documents into batches under Azure AI Search's request
+limits, sends up to an adaptive ``limit`` of them concurrently and retries
+only the keys that failed with a retryable status.
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from azure.core.pipeline.transport import RequestsTransport
+
+MAX_REQUEST_BYTES = 16 * 2**20
+MAX_REQUEST_DOCS = 1000
+RETRYABLE_STATUS = {409, 422, 429, 500, 502, 503, 504}
+THROTTLED_STATUS = {429, 503}
+
+Send = Callable[[List[Dict[str, Any]]], Sequence[Any]]
+
+
+@dataclass
+class _Batch:
+    items: List[Tuple[Dict[str, Any], Any, int]] = field(default_factory=list)  # (document, tag, size)
+    size: int = 0
+
+
+def compact_vector(vector: Sequence[float], decimals: int) -> List[float]:
+    return np.round(np.asarray(vector, dtype=np.float64), decimals).tolist()
+
+
+def payload_size(doc: Dict[str, Any], vector_decimals: Optional[int] = None) -> int:
+    """Serialized size of ``doc`` in a batch (the SDK uses json.dumps defaults: ASCII only)."""
+    vector = doc.get("contentVector")
+    if vector is None or vector_decimals is None:
+        return len(json.dumps(doc)) + 40  # + "@search.action"
+    # Rounded, normalised components take at most "-0." + decimals + ", " each; dumping 1536 floats
+    # per document just to measure it would cost more than the rest of the upload path
+    rest = {key: value for key, value in doc.items() if key != "contentVector"}
+    return len(json.dumps(rest)) + 60 + len(vector) * (vector_decimals + 5)
+
+
+class BulkUploader:
+    def __init__(
+        self,
+        send: Send,
+        max_docs: int = MAX_REQUEST_DOCS,
+        max_bytes: int = 8 * 2**20,
+        concurrency: int = 4,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        backoff: float = 0.5,
+        cooldown: float = 1.0,
+        throttle_share: float = 0.05,
+        max_attempts: int = 5,
+        retry_delay: float = 0.5,
+        vector_decimals: Optional[int] = 8,
+    ):
+        self.send = send
+        self.max_docs = min(max_docs, MAX_REQUEST_DOCS)
+        self.max_bytes = min(max_bytes, MAX_REQUEST_BYTES)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(min(max(concurrency, self.min_concurrency), max_concurrency))
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.throttle_share = throttle_share
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.vector_decimals = vector_decimals
+        self.in_flight = 0
+        self._batch = _Batch()
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self._outcomes: "queue.Queue[Tuple[Any, Optional[str]]]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_concurrency, thread_name_prefix="upload") if max_concurrency > 1 else None
+        self.requests = 0
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    # ---- caller side ----
+
+    def add(self, doc: Dict[str, Any], tag: Any = None) -> None:
+        """Queue one document; ``tag`` comes back with its outcome from ``drain()``."""
+        # contentVector is stored as Edm.Single: 17-digit float64 text doubles the payload for nothing
+        if self.vector_decimals is not None and doc.get("contentVector") is not None:
+            doc = {**doc, "contentVector": compact_vector(doc["contentVector"], self.vector_decimals)}
+        size = payload_size(doc, self.vector_decimals)
+        batch = self._batch
+        if batch.items and (len(batch.items) >= self.max_docs or batch.size + size > self.max_bytes):
+            self.flush()
+        self._batch.items.append((doc, tag, size))
+        self._batch.size += size
+
+    def flush(self) -> None:
+        """Send the partial batch now (blocks while ``limit`` batches are in flight)."""
+        batch, self._batch = self._batch, _Batch()
+        if not batch.items:
+            return
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        if self._pool is None:
+            self._run(batch)
+        else:
+            self._pool.submit(self._run, batch)
+
+    def drain(self) -> List[Tuple[Any, Optional[str]]]:
+        """Outcomes finished so far: ``(tag, None)`` on success, ``(tag, error message)`` on failure."""
+        outcomes = []
+        while True:
+            try:
+                outcomes.append(self._outcomes.get_nowait())
+            except queue.Empty:
+                return outcomes
+
+    def close(self) -> List[Tuple[Any, Optional[str]]]:
+        """Send what is left, wait for every batch and return the remaining outcomes."""
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        return self.drain()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "requests": self.requests,
+            "mb_sent": round(self.bytes_sent / 2**20, 1),
+            "throttled": self.throttled,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    # ---- workers ----
+
+    def _adjust(self, throttled: bool) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(float(self.min_concurrency), self.limit * self.backoff)
+                    self._last_decrease = now
+            elif self.in_flight >= int(self.limit):
+                # Only grow a limit that is being used, or it drifts up while the source is slow
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _attempt(self, items: List[Tuple[Dict[str, Any], Any, int]]) -> Tuple[List[Tuple[Dict[str, Any], Any, int]], bool]:
+        """Send once; report outcomes that are final and return the items to retry."""
+        docs = [doc for doc, _, _ in items]
+        with self._cond:
+            self.requests += 1
+            self.bytes_sent += sum(size for _, _, size in items)
+        try:
+            results = self.send(docs)
+        except HttpResponseError as e:
+            status = e.status_code or 0
+            if status in RETRYABLE_STATUS:
+                return items, status in THROTTLED_STATUS
+            for _, tag, _ in items:
+                self._fail(tag, f"HTTP {status}: {e.message}")
+            return [], False
+        except (ServiceRequestError, ServiceResponseError):
+            return items, False  # connection reset, timeout: the whole batch again
+
+        by_key = {result.key: result for result in results}
+        retry, throttled = [], 0
+        for doc, tag, size in items:
+            result = by_key.get(doc["id"])
+            if result is not None and result.succeeded:
+                self._outcomes.put((tag, None))
+            elif result is not None and result.status_code not in RETRYABLE_STATUS:
+                self._fail(tag, f"{result.status_code}: {result.error_message}")
+            else:
+                retry.append((doc, tag, size))
+                throttled += result is not None and result.status_code in THROTTLED_STATUS
+        # A stray busy document is retried; backing off takes a real share of the batch
+        return retry, throttled > self.throttle_share * len(items)
+
+    def _fail(self, tag: Any, error: str) -> None:
+        with self._cond:
+            self.failed += 1
+        self._outcomes.put((tag, error))
+
+    def _run(self, batch: _Batch) -> None:
+        items = batch.items
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    items, throttled = self._attempt(items)
+                except Exception as e:
+                    for _, tag, _ in items:
+                        self._fail(tag, str(e))
+                    return
+                self._adjust(throttled)
+                if not items:
+                    return
+                if attempt < self.max_attempts:
+                    with self._cond:
+                        self.retried += len(items)
+                    time.sleep(self.retry_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            for _, tag, _ in items:
+                self._fail(tag, f"still failing after {self.max_attempts} attempts")
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+
+def pooled_transport(connections: int) -> RequestsTransport:
+    """A ``SearchClient`` transport that keeps ``connections`` connections (requests' default is 10)."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return RequestsTransport(session=session, session_owner=True)
+
+
+def upload_concurrency() -> int:
+    return int(os.getenv("INGEST_UPLOAD_MAX_CONCURRENCY", "16"))
+
+
+def uploader_from_env(send: Send, max_concurrency: Optional[int] = None) -> BulkUploader:
+    decimals = os.getenv("INGEST_VECTOR_DECIMALS", "8")
+    return BulkUploader(
+        send,
+        max_docs=int(os.getenv("INGEST_UPLOAD_BATCH_SIZE", str(MAX_REQUEST_DOCS))),
+        max_bytes=int(float(os.getenv("INGEST_UPLOAD_MAX_MB", "8")) * 2**20),
+        concurrency=int(os.getenv("INGEST_UPLOAD_CONCURRENCY", "4")),
+        max_concurrency=max_concurrency or upload_concurrency(),
+        max_attempts=int(os.getenv("INGEST_UPLOAD_MAX_ATTEMPTS", "5")),
+        vector_decimals=int(decimals) if decimals else None,
+    )